@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import argparse
+
+import logging
+
+from atn.build import ATNBuilder, read_mapped_reactions
+from atn.export import write_atn
+
+logging.basicConfig(format='%(levelname)s:\t%(message)s', level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description="Update a saved atom transition network reaction by reaction.")
+    parser.add_argument('state', help="builder state saved with --state")
+    parser.add_argument('outputgml', help="ATN in GML format, or a binary bundle if it ends with .npz")
+    parser.add_argument('--add', action='append', default=[], metavar='MAPPEDSMILES',
+                        help="add the reactions of a mapped SMILES file, they get new ids")
+    parser.add_argument('--remove', type=int, nargs='+', default=[], metavar='ID', help="remove reactions by id")
+    parser.add_argument('--replace', action='append', nargs=2, default=[], metavar=('ID', 'MAPPEDSMILES'),
+                        help="replace a reaction with the first reaction of a mapped SMILES file")
+    args = parser.parse_args()
+
+    builder = ATNBuilder.load(args.state)
+
+    for reaction_id in args.remove:
+        builder.remove_reaction(reaction_id)
+
+    for reaction_id, path in args.replace:
+        reaction = next(read_mapped_reactions(path))
+        builder.replace_reaction(reaction._replace(index=int(reaction_id)))
+
+    for path in args.add:
+        offset = builder.next_reaction_id()
+        for reaction in read_mapped_reactions(path):
+            builder.add_reaction(reaction._replace(index=offset + reaction.index))
+
+    write_atn(builder.ATN, builder.transitions, builder.compoundId_to_compound, args.outputgml, builder.directed)
+    builder.save(args.state)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+
+import logging
+
+from atn.build import ATNBuilder
+from atn.draw import draw_compounds, draw_reactions, draw_network
+
+logging.basicConfig(format='%(levelname)s:\t%(message)s', level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw compounds, reactions and the network of a saved directed ATN as HTML.")
+    parser.add_argument('state', help="builder state saved with 04_generate_ATN_directed.py --state")
+    parser.add_argument('molecule_graph_path', help="folder for the HTML drawings")
+    parser.add_argument('--compound', action='append', default=[], help="draw this compound, all compounds if neither --compound nor --reaction is given")
+    parser.add_argument('--reaction', type=int, action='append', default=[], help="draw this reaction with its compounds")
+    parser.add_argument('--full', action='store_true', help="draw the network as full_ATN.html")
+    parser.add_argument('--around', action='append', default=[], help="draw the network around this compound")
+    parser.add_argument('--radius', type=int, default=2, help="number of edges around the --around compounds")
+    parser.add_argument('--max-nodes', type=int, default=2000, help="do not draw networks with more nodes")
+    parser.add_argument('--workers', type=int, default=1, help="processes used for drawing")
+    parser.add_argument('--force', action='store_true', help="redraw drawings that are newer than the state")
+    args = parser.parse_args()
+
+    builder = ATNBuilder.load(args.state)
+    if not builder.directed:
+        parser.error("drawings need the state of a directed ATN")
+    source_mtime = None if args.force else os.path.getmtime(args.state)
+
+    if not os.path.exists(args.molecule_graph_path):
+        os.makedirs(args.molecule_graph_path)
+
+    compounds = args.compound
+    if not args.compound and not args.reaction:
+        compounds = builder.compound_to_subgraph
+    draw_compounds(builder, compounds, args.molecule_graph_path, workers=args.workers, source_mtime=source_mtime)
+    draw_reactions(builder, args.reaction, args.molecule_graph_path, workers=args.workers, source_mtime=source_mtime)
+
+    if args.full:
+        draw_network(builder, args.molecule_graph_path + '/full_ATN.html', max_nodes=args.max_nodes,
+                     source_mtime=source_mtime)
+    if args.around:
+        outputhtml = args.molecule_graph_path + '/ATN_around_' + '_'.join(args.around) + '_' + str(args.radius) + '.html'
+        draw_network(builder, outputhtml, max_nodes=args.max_nodes, around=args.around, radius=args.radius,
+                     source_mtime=source_mtime)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+
+from atn.reachability import ReachabilityIndex
+
+def batch_query(line):
+    """
+    Parses a query line of a batch file. Compound names may contain spaces,
+    so only the query kind is split off before the argument.
+    """
+    kind, *argument = line.split(None, 1)
+    argument = argument[0].strip() if argument else ''
+    if kind == 'can-reach':
+        return (kind,) + tuple(argument.split())
+    return (kind, argument)
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer label reachability queries on a directed ATN.")
+    parser.add_argument('atn', help="directed ATN written by 04_generate_ATN_directed.py, GML or .npz bundle")
+    parser.add_argument('--reachable', action='append', default=[], help="list the atoms label on this atom can reach")
+    parser.add_argument('--can-reach', nargs=2, action='append', default=[], metavar=('SOURCE', 'TARGET'), help="whether label on SOURCE can reach TARGET")
+    parser.add_argument('--compound', action='append', default=[], help="list the compounds receiving label from this compound")
+    parser.add_argument('--batch', help="file of queries, one per line: 'reachable ATOM', 'can-reach SOURCE TARGET' or 'compound NAME'")
+    parser.add_argument('--reactions-only', action='store_true', help="follow only reaction transitions, not symmetries or hydrogen edges")
+    args = parser.parse_args()
+
+    queries = [('reachable', node) for node in args.reachable]
+    queries += [('can-reach', source, target) for source, target in args.can_reach]
+    queries += [('compound', name) for name in args.compound]
+    if args.batch:
+        with open(args.batch) as batch:
+            queries += [batch_query(line) for line in batch if line.strip() and not line.startswith('#')]
+
+    transitions = {'Reaction'} if args.reactions_only else None
+    index = ReachabilityIndex.from_file(args.atn, transitions)
+
+    # answer each kind of query in one batch, print in input order
+    answers = {}
+    pairs = [query for query in queries if query[0] == 'can-reach']
+    for query, reached in zip(pairs, index.can_reach_many(query[1:] for query in pairs)):
+        answers[query] = str(bool(reached))
+    for query in queries:
+        if query in answers:
+            continue
+        if query[0] == 'reachable':
+            answers[query] = ','.join(index.reachable(query[1]))
+        elif query[0] == 'compound':
+            answers[query] = ','.join(index.labelled_compounds(query[1]))
+        else:
+            parser.error("unknown query {}".format(' '.join(query)))
+
+    for query in queries:
+        print(*query, answers[query], sep='\t', file=sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import argparse
+
+import logging
+
+from atn.emu import EMUNetwork
+
+logging.basicConfig(format='%(levelname)s:\t%(message)s', level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the EMU reaction network of measured compounds from a directed ATN.")
+    parser.add_argument('atn', help="directed ATN written by 04_generate_ATN_directed.py, GML or .npz bundle")
+    parser.add_argument('output', help="EMU network as .npz file")
+    parser.add_argument('--measure', action='append', default=[], required=True, help="measured compound, optionally with atoms: NAME or NAME:ATOM,ATOM")
+    parser.add_argument('--element', default='C', help="element of the measured atoms if none are given")
+    parser.add_argument('--substrate', action='append', default=[], help="compound whose EMUs are inputs")
+    parser.add_argument('--max-emus', type=int, default=100000, help="stop if more EMUs are needed")
+    parser.add_argument('--exclude-reaction', type=int, action='append', default=[], help="reaction id that forms no EMUs")
+    args = parser.parse_args()
+
+    network = EMUNetwork.from_file(args.atn, substrates=args.substrate, max_emus=args.max_emus,
+                                   excluded_reactions=args.exclude_reaction)
+    for measured in args.measure:
+        name, _, atoms = measured.partition(':')
+        try:
+            network.add(atoms.split(',') if atoms else network.compound_atoms(name, args.element))
+        except ValueError as e:
+            parser.error(str(e))
+
+    logging.info("%d EMUs, %d EMU reactions, %d inputs", len(network.emus), len(network.reactions), len(network.inputs))
+    network.save(args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+
+import logging
+
+import numpy as np
+
+from atn.simulation import LabellingSimulator, MassIsotopomerSimulator
+
+logging.basicConfig(format='%(levelname)s:\t%(message)s', level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate steady state 13C labelling of a directed ATN for given fluxes.")
+    parser.add_argument('atn', help="directed ATN written by 04_generate_ATN_directed.py, GML or .npz bundle")
+    parser.add_argument('mappedsmiles', help="mapped SMILES file the ATN was generated from")
+    parser.add_argument('fluxes', help="flux vectors indexed by reaction id, one per row, as text or .npy file")
+    parser.add_argument('--exchange', help="exchange fluxes in the same layout as the fluxes")
+    parser.add_argument('--tracer', action='append', required=True,
+                        help="labelled substrate: NAME, NAME:ATOM,ATOM or either followed by =ENRICHMENT; all carbons if no atoms are given")
+    parser.add_argument('--substrate', action='append', default=[], help="further unlabelled substrate compound")
+    parser.add_argument('--measure', action='append', default=[], help="print the mass isotopomer distribution of the carbons of this compound, simulated on its EMU network")
+    parser.add_argument('--exclude-reaction', type=int, action='append', default=[], help="reaction id that forms no EMUs, see 08_generate_EMU.py")
+    parser.add_argument('--output', help="write the atom enrichments (flux vectors x atoms x tracers) to this .npy file")
+    args = parser.parse_args()
+
+    with open('metanetx/list_highlyConcMol.txt', 'r') as highmol_file:
+        highmol_list = [s.strip() for s in highmol_file.readlines()]
+
+    def load(path):
+        return np.atleast_2d(np.load(path) if path.endswith('.npy') else np.loadtxt(path))
+
+    tracers = []
+    for tracer in args.tracer:
+        spec, _, enrichment = tracer.partition('=')
+        name, _, atoms = spec.partition(':')
+        tracers.append((name, atoms.split(',') if atoms else None, float(enrichment or 1.0)))
+
+    simulator = LabellingSimulator.from_files(args.atn, args.mappedsmiles,
+                                              [name for name, _, _ in tracers] + args.substrate, highmol_list)
+    labels = simulator.tracer_matrix([{atom: enrichment for atom in atoms or simulator.compound_atoms(name, 'C')}
+                                      for name, atoms, enrichment in tracers])
+    fluxes = load(args.fluxes)
+    exchange = load(args.exchange) if args.exchange else None
+    enrichment = simulator.simulate_many(fluxes, labels, exchange)
+    if args.output:
+        np.save(args.output, enrichment)
+
+    if args.measure:
+        network = simulator.emu_network(excluded_reactions=args.exclude_reaction)
+        try:
+            measured = [network.add(network.compound_atoms(compound, 'C')) for compound in args.measure]
+            distributions = MassIsotopomerSimulator(simulator, network).simulate_many(fluxes, labels, exchange)
+        except ValueError as e:
+            parser.error(str(e))
+        for row, mids in enumerate(distributions):
+            for compound, index in zip(args.measure, measured):
+                for tracer, distribution in zip(args.tracer, mids[index]):
+                    print(row, compound, tracer, *('%.6f' % value for value in distribution), sep='\t', file=sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+
+from atn.design import TracerDesigner
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank tracer labellings of substrates by how well they distinguish reactions of a directed ATN.")
+    parser.add_argument('atn', help="directed ATN written by 04_generate_ATN_directed.py, GML or .npz bundle")
+    parser.add_argument('--substrate', action='append', required=True, help="compound whose labellings are enumerated")
+    parser.add_argument('--reaction', type=int, action='append', default=[], help="reaction of interest, all reactions if neither --reaction nor --pathway is given")
+    parser.add_argument('--pathway', action='append', default=[], help="pathway of interest as NAME:ID,ID")
+    parser.add_argument('--element', default='C', help="element of the labelled atoms")
+    parser.add_argument('--max-positions', type=int, default=2, help="most positions of multi position labellings")
+    parser.add_argument('--top', type=int, default=20, help="number of candidates to print")
+    args = parser.parse_args()
+
+    targets = None
+    if args.reaction or args.pathway:
+        targets = {str(rid): (rid,) for rid in args.reaction}
+        for pathway in args.pathway:
+            name, _, rids = pathway.partition(':')
+            targets[name] = [int(rid) for rid in rids.split(',')]
+
+    designer = TracerDesigner.from_file(args.atn, targets)
+    for score in designer.rank(args.substrate, args.element, args.max_positions, args.top):
+        print(score.candidate.compound, score.candidate.kind, ','.join(score.candidate.atoms),
+              score.separated, score.classes, score.covered, sep='\t', file=sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""
+Shared building blocks for generating and analysing atom transition networks.
+"""
+
+from .transitions import TransitionIndex
@@ -0,0 +1,1148 @@
+"""
+Construction of atom transition networks (ATN) from atom mapped reactions.
+
+The build is split into three phases:
+
+1. every distinct compound is parsed once into a :class:`CompoundTemplate`
+   (heavy atom graph, symmetry edges, explicit hydrogens),
+2. every reaction is resolved into correspondences between its atom map
+   classes and template atoms,
+3. the transition edges are merged into the ATN in reaction order.
+
+Phases one and two only depend on the compounds and on a single reaction, and
+can therefore run in a process pool. Phase three is always serial, so the
+resulting network does not depend on the number of workers.
+"""
+
+import itertools
+import pickle
+import logging
+import multiprocessing
+import zlib
+from collections import namedtuple
+
+import networkx as nx
+from networkx.algorithms import isomorphism as nxisomorphism
+
+from rdkit import Chem
+
+from custom_pysmiles import read_smiles
+from custom_pysmiles.smiles_helper import (add_explicit_hydrogens, remove_explicit_hydrogens)
+
+from .transitions import TransitionIndex
+from .types import TransitionType, TransitionCode, DirectionType
+
+LOGGER = logging.getLogger(__name__)
+
+NO_MAP_DEFAULT_KEY = -1
+
+# version of the pickled ATNBuilder state, bump on incompatible changes
+STATE_VERSION = 6
+
+
+MappedReaction = namedtuple('MappedReaction', ['index', 'meta', 'names', 'smiles', 'samples'], defaults=(None,))
+CompoundOccurrence = namedtuple('CompoundOccurrence', ['reaction', 'side', 'position'])
+
+
+def read_mapped_reactions(mappedsmiles):
+    """
+    Reads a mapped SMILES file as written by `02_atommap_smiles_reactions.py`.
+
+    Parameters
+    ----------
+    mappedsmiles : str
+        Path to the file. Every reaction takes three lines: the meta line, the
+        reaction with compound names and the atom mapped reaction SMILES.
+        Files of sampled models, like `ecoli1`, are read as well, see
+        :func:`read_sampled_reactions`.
+
+    Yields
+    ------
+    MappedReaction
+        The reactions in file order. Stereo information is stripped from the
+        SMILES.
+    """
+    with open(mappedsmiles, 'r') as smiles_file:
+        if smiles_file.read(2) == '#,':
+            yield from read_sampled_reactions(mappedsmiles)
+            return
+        smiles_file.seek(0)
+        index = 0
+        while True:
+            meta_line = smiles_file.readline()
+            name_line = smiles_file.readline()
+            mapped_smiles_line = smiles_file.readline()
+            if not name_line or not mapped_smiles_line:
+                break
+            smiles_str = mapped_smiles_line.strip().replace("@", '').replace("/", '')
+            yield MappedReaction(index, meta_line.strip(), name_line.strip(), smiles_str)
+            index += 1
+
+
+def read_sampled_reactions(mappedsmiles):
+    """
+    Reads a mapped SMILES file of sampled models. Every reaction starts with a
+    header line ``#,<names>, Bigg ID: .. MetaNetXId: .. Reversible: ..
+    Samples: [..]`` followed by the atom mapped reaction SMILES. Only the first
+    SMILES line of a reaction is used.
+
+    Yields
+    ------
+    MappedReaction
+        The reactions in file order, `samples` holds the sorted ids of the
+        model samples containing the reaction, or None if the header has no
+        sample list.
+    """
+    with open(mappedsmiles, 'r') as smiles_file:
+        index = 0
+        header = None
+        smiles_lines = []
+        for line in itertools.chain(smiles_file, ['#,']):
+            line = line.strip()
+            if not line.startswith('#,'):
+                if line:
+                    smiles_lines.append(line)
+                continue
+            if header is not None:
+                names, _, meta_line = header[2:].rpartition(', Bigg ID: ')
+                meta_line, _, sample_list = ('Bigg ID: ' + meta_line).partition(' Samples: ')
+                if not smiles_lines:
+                    LOGGER.warning("No mapped SMILES for reaction %s", meta_line)
+                else:
+                    if len(smiles_lines) > 1:
+                        LOGGER.warning("Ignoring %d additional SMILES lines of %s", len(smiles_lines) - 1, meta_line)
+                    samples = sorted({int(s) for s in sample_list.strip('[] ').split(',') if s.strip()}) if sample_list else None
+                    smiles_str = smiles_lines[0].replace("@", '').replace("/", '')
+                    yield MappedReaction(index, meta_line, names, smiles_str, samples)
+                    index += 1
+            header = line
+            smiles_lines = []
+
+
+def is_reversible(meta_line):
+    """
+    Returns whether the meta line of a reaction marks it as reversible.
+    """
+    fields = meta_line.split()
+    return len(fields) > 6 and fields[6] == "True"
+
+
+def reaction_sides(reaction, renamed_compounds=()):
+    """
+    Splits a reaction into its educts and products.
+
+    Parameters
+    ----------
+    reaction : MappedReaction
+        The reaction.
+    renamed_compounds : collections.abc.Container
+        Compounds, typically highly concentrated ones, that get separate nodes
+        as educt (suffix ``_in``) and as product (suffix ``_out``).
+
+    Returns
+    -------
+    tuple(list, list) or None
+        Lists of ``(name, smiles)`` for educts and products. None for
+        compartment changes, which are not interesting for the ATN.
+    """
+    # create left and right list with the smiles
+    smiles_sides = reaction.smiles.split('>>')
+    smiles_left = smiles_sides[0].split('.')
+    smiles_right = smiles_sides[1].split('.')
+
+    # create left and right list with the metabolite names
+    names_sides = reaction.names.split('=')
+    names_left = list(map(str.strip, names_sides[0].split(' + ')))
+    names_right = list(map(str.strip, names_sides[1].split(' + ')))
+
+    if set(names_left) == set(names_right):
+        return None
+
+    educts = [(name + '_in' if name in renamed_compounds else name, smiles)
+              for name, smiles in zip(names_left, smiles_left)]
+    products = [(name + '_out' if name in renamed_compounds else name, smiles)
+                for name, smiles in zip(names_right, smiles_right)]
+    return educts, products
+
+
+def hasPath(G, s, t, edge_type):
+    if s == t:
+        return True
+
+    visited = set()
+    visited.add(s)
+    stack = [(s, iter(G[s]))]
+    while stack:
+        parent, children = stack[-1]
+
+        for child in children:
+            if child not in visited and G.edges[parent, child]['transition'] == edge_type:
+                if child == t:
+                    return True
+                visited.add(child)
+                stack.append((child, iter(G[child])))
+        stack.pop()
+    return False
+
+
+def findHydrogenGroups(mol, mapped_hydrogens, mapped_atoms):
+
+    inv_mapped_atom = {v: k for k, v in mapped_atoms.items()}
+
+    for n in mol.nodes():
+        if mol.nodes[n].get('element', '') == 'H':
+            class_id = NO_MAP_DEFAULT_KEY
+            for neighbor in mol[n]:
+                if neighbor in inv_mapped_atom:
+                    class_id = inv_mapped_atom[neighbor]
+            mapped_hydrogens.setdefault(class_id, []).append(n)
+
+
+def findIsomorphATNStructure(ATN, mol):
+
+    em = nxisomorphism.categorical_edge_match(['order'],[0])
+    nm = nxisomorphism.categorical_node_match(['element', 'isotope', 'hcount', 'charge'],['', 0, 0, 0])
+    GM = nxisomorphism.GraphMatcher(ATN, mol, node_match=nm, edge_match=em)
+    result_iso = GM.subgraph_is_monomorphic()
+    mapping_ATN_to_mol = GM.mapping
+
+    return (result_iso, mapping_ATN_to_mol)
+
+
+def structure_hash(mol, iterations=3):
+    """
+    Weisfeiler-Lehman hash of a compound over the attributes compounds are
+    matched on: element, isotope, hcount and charge of the atoms and the
+    bond orders. Equal structures get equal hashes, so a compound can only
+    match a template with the same hash.
+
+    Labels are combined with Python's hash of integer tuples, which is not
+    randomised, so all processes compute the same hash.
+
+    Parameters
+    ----------
+    mol : nx.Graph
+        The heavy atom graph of the compound, as given by :func:`parseXDuct`.
+    iterations : int
+        Number of times the labels of neighbours are aggregated.
+
+    Returns
+    -------
+    str
+    """
+    codes = {}
+    labels = []
+    for _, data in mol.nodes(data=True):
+        label = (data.get('element', ''), data.get('isotope', 0), data.get('hcount', 0), data.get('charge', 0))
+        if label not in codes:
+            codes[label] = zlib.crc32('{}/{}/{}/{}'.format(*label).encode())
+        labels.append(codes[label])
+    index = {node: i for i, node in enumerate(mol)}
+    neighbors = [[(index[neighbor], bond.get('order', 0)) for neighbor, bond in mol.adj[node].items()]
+                 for node in mol]
+    signature = [tuple(sorted(labels))]
+    for _ in range(iterations):
+        labels = [hash((label, tuple(sorted([(labels[neighbor], order) for neighbor, order in bonds]))))
+                  for label, bonds in zip(labels, neighbors)]
+        signature.append(tuple(sorted(labels)))
+    return '{:016x}'.format(hash(tuple(signature)) & 0xFFFFFFFFFFFFFFFF)
+
+
+def compound_structure(smiles):
+    """
+    Returns the :func:`structure_hash` and the heavy atom graph of a compound.
+    """
+    _, mol = parseXDuct(smiles)
+    return structure_hash(mol), mol
+
+
+def _same_heavy_structure(mol, other):
+    # both without symmetry edges, a monomorphism of equal sizes is an isomorphism
+    return (len(mol) == len(other) and mol.number_of_edges() == other.number_of_edges()
+            and findIsomorphATNStructure(mol, other)[0])
+
+
+def automorphisms(mol):
+    """
+    Returns all automorphisms of `mol` as mappings of its nodes, respecting
+    the attributes compounds are matched on.
+    """
+    em = nxisomorphism.categorical_edge_match(['order'],[0])
+    nm = nxisomorphism.categorical_node_match(['element', 'isotope', 'hcount', 'charge'],['', 0, 0, 0])
+    GM = nxisomorphism.GraphMatcher(mol, mol, node_match=nm, edge_match=em)
+    return list(GM.isomorphisms_iter())
+
+
+def automorphism_generators(mol, permutations):
+    """
+    Returns permutations among `permutations`, the automorphism group of
+    `mol`, that generate the group. They are picked in sorted order, so the
+    generators do not depend on the order the automorphisms were found in.
+
+    Returns
+    -------
+    list[dict]
+        The generators, without the identity.
+    """
+    nodes = sorted(mol)
+    index = {node: i for i, node in enumerate(nodes)}
+    identity = tuple(range(len(nodes)))
+    candidates = sorted(tuple(index[permutation[node]] for node in nodes) for permutation in permutations)
+    generators = []
+    group = {identity}
+    for candidate in candidates:
+        if candidate in group:
+            continue
+        generators.append(candidate)
+        # the closure of the generators so far
+        group = {identity}
+        to_visit = [identity]
+        while to_visit:
+            element = to_visit.pop()
+            for generator in generators:
+                product = tuple(generator[i] for i in element)
+                if product not in group:
+                    group.add(product)
+                    to_visit.append(product)
+    return [{node: nodes[image] for node, image in zip(nodes, generator)} for generator in generators]
+
+
+def addAutomorphisms(mol, transition_type, directed, limit_to_orbits=True, permutation_lists=None):
+    if permutation_lists is None:
+        permutation_lists = automorphisms(mol)
+
+    symmetry = {'transition': transition_type.SYMMETRY}
+    if directed:
+        symmetry['directed'] = DirectionType.BIDIRECTED
+
+    if limit_to_orbits:
+        blockset = set()
+        for node in mol.nodes():
+            if node in blockset:
+                continue
+            for isomorphism in permutation_lists:
+                if node != isomorphism[node]:
+                    mol.add_edge(node, isomorphism[node])
+                    mol.edges[node, isomorphism[node]].update(symmetry)
+                    blockset.add(isomorphism[node])
+    else:
+        for isomorphism in permutation_lists:
+            for i in isomorphism:
+                if i != isomorphism[i] and not mol.has_edge(i, isomorphism[i]):
+                    mol.add_edge(i, isomorphism[i])
+                    mol.edges[i, isomorphism[i]].update(symmetry)
+
+
+def parseXDuct(smiles):
+    """
+    Parses the SMILES of a single educt or product.
+
+    Returns
+    -------
+    tuple(str, nx.Graph)
+        The SMILES with all hydrogens explicit as written by RDKit, and the
+        heavy atom graph of the molecule with atom map numbers as 'class'.
+
+    Raises
+    ------
+    ValueError
+        If RDKit can not parse `smiles`, e.g. for a wrong valence.
+    """
+    rdmol = Chem.MolFromSmiles(smiles)
+    if rdmol is None:
+        raise ValueError('RDKit can not parse ' + smiles)
+    fixed_smiles = Chem.MolToSmiles(rdmol, allHsExplicit=True, canonical=False)
+    mol = read_smiles( fixed_smiles ) # read smile
+
+    # RXNMApper does not create valid H mappings, remove them all
+    for n in mol.nodes():
+        if mol.nodes[n].get('element', '') == 'H' and 'class' in mol.nodes[n]:
+            del mol.nodes[n]['class']
+    remove_explicit_hydrogens(mol)
+    return fixed_smiles, mol
+
+
+class CompoundTemplate:
+    """
+    A compound prepared for insertion into the ATN.
+
+    Attributes
+    ----------
+    cid : int
+        Compound id, used as prefix of all ATN node ids of the compound.
+    name : str
+        Compound name as used in the reaction, including `_in`/`_out`
+        modifiers.
+    smiles : str
+        The SMILES the template was built from, hydrogens explicit.
+    graph : nx.Graph
+        The compound with ATN node ids: bonds, symmetry edges and, if built
+        with explicit hydrogens, the hydrogen atoms. Nodes carry the map
+        'class' of the defining occurrence.
+    origin : CompoundOccurrence
+        The occurrence of the compound that defined the template. None once
+        the defining reaction was removed from the ATN.
+    structure_hash : str
+        The :func:`structure_hash` of the compound.
+    """
+
+    def __init__(self, cid, name, smiles, graph, origin, structure_hash=None):
+        self.cid = cid
+        self.name = name
+        self.smiles = smiles
+        self.graph = graph
+        self.origin = origin
+        self.structure_hash = structure_hash
+        # VF2 iterates sets of G1 nodes, integer labels keep the found mapping
+        # independent of string hash randomisation
+        self.nodes = list(graph)
+        self.match_graph = nx.convert_node_labels_to_integers(graph)
+
+
+def build_template(cid, name, smiles, origin, directed=False, explicit_hydrogens=False, library=None):
+    """
+    Phase one: builds the :class:`CompoundTemplate` of a compound.
+
+    Parameters
+    ----------
+    cid : int
+        The compound id to use.
+    name : str
+        The compound name.
+    smiles : str
+        The SMILES of the defining occurrence.
+    origin : CompoundOccurrence
+        The defining occurrence.
+    directed : bool
+        Whether the template is meant for the directed ATN.
+    explicit_hydrogens : bool
+        Whether hydrogens are nodes in the ATN.
+    library : atn.library.TemplateLibrary
+        Library the automorphisms of the compound are taken from and stored
+        in. They are searched for if None.
+
+    Returns
+    -------
+    CompoundTemplate
+    """
+    LOGGER.debug("Add New Compound " + name)
+    transition_type = TransitionType if directed else TransitionCode
+
+    fixed_smiles, mol = parseXDuct(smiles)
+    structure = structure_hash(mol)
+
+    # symmetries are computed before renaming, so that they are found in a
+    # deterministic order
+    permutations = automorphisms(mol) if library is None else library.automorphisms(mol)
+    addAutomorphisms(mol, transition_type, directed, permutation_lists=permutations)
+
+    rename = {node : str(cid)+'_'+str(node) for node in mol.nodes()} # rename all nodes so that we cannot have collisions in the ATN
+
+    if directed:
+        # symmetry edges only tell the orbits of single atoms; the atoms an
+        # automorphism moves store their images under generators of the
+        # group, for the symmetric images of atom sets (see atn.emu)
+        generators = automorphism_generators(mol, permutations)
+        for node in mol.nodes():
+            if any(generator[node] != node for generator in generators):
+                mol.nodes[node]['automorphisms'] = ','.join(rename[generator[node]] for generator in generators)
+
+    nx.relabel_nodes(mol, rename, copy=False)
+
+    if explicit_hydrogens:
+        add_explicit_hydrogens(mol, str(cid)+"_")
+
+    for n in mol.nodes():
+        mol.nodes[n]['compound_id'] = cid
+        mol.nodes[n]['compound_name'] = name
+
+    for e in mol.edges():
+        if directed:
+            mol.edges[e]['compound_id'] = cid
+            mol.edges[e]['compound_name'] = name
+        if 'transition' not in mol.edges[e]:
+            mol.edges[e]['transition'] = transition_type.NO_TRANSITION
+            if directed:
+                mol.edges[e]['directed'] = DirectionType.UNDIRECTED
+
+    return CompoundTemplate(cid, name, fixed_smiles, mol, origin, structure)
+
+
+def mapOccurrence(template, occurrence, smiles, mapped_atoms, mapped_hydrogens, explicit_hydrogens=False):
+    """
+    Phase two for a single compound occurrence: records which template atom
+    every atom map class of the occurrence corresponds to.
+
+    Parameters
+    ----------
+    template : CompoundTemplate
+        The template of the compound.
+    occurrence : CompoundOccurrence
+        Where the compound occurs.
+    smiles : str
+        The mapped SMILES of the occurrence.
+    mapped_atoms : dict
+        Map class to ATN node, updated in place.
+    mapped_hydrogens : dict
+        Map class of the heavy atom to hydrogen ATN nodes, updated in place.
+    explicit_hydrogens : bool
+        Whether hydrogens are nodes in the ATN.
+    """
+    LOGGER.debug("Parse " + template.name + " : " + smiles)
+
+    if occurrence == template.origin:
+        for node, data in template.graph.nodes(data=True):
+            if 'class' in data:
+                mapped_atoms[data['class']] = node
+    elif smiles:
+        # an occurrence without atoms has nothing to match
+        LOGGER.debug("Use Existing " + template.name)
+
+        try:
+            _, mol = parseXDuct(smiles)
+        except ValueError:
+            LOGGER.error("Compound Parse Error: " + template.name + " : " + smiles)
+            return
+        # a different structure can not match, the search is skipped
+        has_isomorph_subgraph = structure_hash(mol) == template.structure_hash
+        if has_isomorph_subgraph:
+            if explicit_hydrogens:
+                add_explicit_hydrogens(mol)
+            has_isomorph_subgraph, mapping_ATN_to_mol = findIsomorphATNStructure(template.match_graph, mol)
+        if has_isomorph_subgraph:
+            for atn_node in mapping_ATN_to_mol:
+                if 'class' in mol.nodes[mapping_ATN_to_mol[atn_node]]:
+                    mapped_atoms[ mol.nodes[mapping_ATN_to_mol[atn_node]]['class'] ] = template.nodes[atn_node]
+        else:
+            LOGGER.error("Compound Naming Error: " + template.name + " : " + smiles)
+
+    if explicit_hydrogens:
+        LOGGER.debug("Find Hydrogen Partners")
+        findHydrogenGroups(template.graph, mapped_hydrogens, mapped_atoms)
+
+
+def mapReaction(index, sides, templates, explicit_hydrogens=False):
+    """
+    Phase two: resolves the atom correspondences of one reaction.
+
+    Returns
+    -------
+    tuple(dict, dict, dict, dict)
+        Mapped educt atoms, educt hydrogens, product atoms and product
+        hydrogens.
+    """
+    mapped = ({}, {}, {}, {})
+    for side, compounds in enumerate(sides):
+        mapped_atoms, mapped_hydrogens = mapped[2*side], mapped[2*side+1]
+        for position, (name, smiles) in enumerate(compounds):
+            if name not in templates:
+                continue # occurrence without atoms
+            mapOccurrence(templates[name], CompoundOccurrence(index, side, position), smiles,
+                          mapped_atoms, mapped_hydrogens, explicit_hydrogens)
+    return mapped
+
+
+_WORKER_TEMPLATES = {}
+
+
+def _init_worker(templates):
+    _WORKER_TEMPLATES.clear()
+    _WORKER_TEMPLATES.update(templates)
+
+
+def _build_template_job(args):
+    try:
+        return build_template(*args)
+    except ValueError:
+        return None
+
+
+def _compound_structure_job(smiles):
+    try:
+        return compound_structure(smiles)
+    except ValueError:
+        return None
+
+
+def _map_reaction_job(args):
+    index, sides, explicit_hydrogens = args
+    return mapReaction(index, sides, _WORKER_TEMPLATES, explicit_hydrogens)
+
+
+class ATNBuilder:
+    """
+    Builds an atom transition network reaction by reaction.
+
+    Parameters
+    ----------
+    directed : bool
+        Whether to build the network for the directed output: respects
+        reaction reversibility and records edge directions.
+    explicit_hydrogens : bool
+        Whether hydrogens are mapped as ATN nodes.
+    renamed_compounds : collections.abc.Container
+        Compounds that get separate educt and product nodes, see
+        :func:`reaction_sides`.
+    elements : collections.abc.Iterable[str]
+        The traced elements, e.g. ``('C',)``. Compounds are still parsed
+        and matched as whole molecules, but only atoms of these elements
+        and the edges between them become part of the ATN. All atoms if
+        None.
+    merge_compounds : bool
+        Whether compounds with the same structure as an earlier compound
+        are merged into it, whatever their names. Their occurrences are
+        matched against the earlier template and get no nodes of their
+        own. Compounds in `renamed_compounds` are never merged.
+    library : atn.library.TemplateLibrary
+        Library of compound automorphisms shared between builds. Not saved
+        with the builder state.
+
+    Attributes
+    ----------
+    ATN : nx.Graph
+        The network. Bond, symmetry and transition edges are undirected,
+        directions are kept in `transitions`.
+    compound_to_subgraph : dict[str, list]
+        Compound name to its ATN nodes.
+    compoundId_to_compound : dict[int, tuple(str, str)]
+        Compound id to name and SMILES.
+    transitions : TransitionIndex
+        Reactions on the transition edges.
+    reactions : dict[int, MappedReaction]
+        All reactions in the ATN, by reaction id.
+    reaction_compounds : dict[int, set]
+        Names of the compounds every reaction references.
+    structure_index : dict[str, list]
+        :func:`structure_hash` to the names of the compound templates with
+        this hash.
+    compound_aliases : dict[str, str]
+        Names of merged compounds to the name of the compound they were
+        merged into.
+    compound_placeholders : dict[int, dict[int, str]]
+        Compound ids in `compoundId_to_compound` held by compounds without
+        atoms, to the reactions that put them there and the names they used.
+    reaction_hydrogen_groups : dict[int, list]
+        Pairs of hydrogen nodes every reaction connected by
+        HYDROGEN_GROUP edges.
+
+    An ATN built this way can be saved with :meth:`save` and updated one
+    reaction at a time with :meth:`add_reaction`, :meth:`remove_reaction` and
+    :meth:`replace_reaction`. Updates only touch the edges and compounds of
+    the affected reactions.
+    """
+
+    def __init__(self, directed=False, explicit_hydrogens=False, renamed_compounds=(), elements=None,
+                 merge_compounds=False, library=None):
+        self.elements = None if elements is None else frozenset(elements)
+        if explicit_hydrogens and self.elements is not None and 'H' not in self.elements:
+            raise ValueError('Mapping hydrogens needs H among the traced elements')
+        self.directed = directed
+        self.explicit_hydrogens = explicit_hydrogens
+        self.renamed_compounds = set(renamed_compounds)
+        self.transition_type = TransitionType if directed else TransitionCode
+
+        self.ATN = nx.Graph()
+        self.compound_to_subgraph = {}
+        self.compoundId_to_compound = {}
+        self.transitions = TransitionIndex()
+        self.reactions = {}
+        self.reaction_compounds = {}
+        self.compound_reactions = {}
+        self.templates = {}
+        self.merge_compounds = merge_compounds
+        self.library = library
+        self.structure_index = {}
+        self.compound_aliases = {}
+        self.compound_placeholders = {}
+        self.reaction_hydrogen_groups = {}
+        self._next_cid = 0
+        self._inserted_compounds = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['library'] = None
+        return state
+
+    def save(self, path):
+        """
+        Pickles the builder, so that the ATN can be updated later on.
+        """
+        with open(path, 'wb') as state_file:
+            pickle.dump((STATE_VERSION, self), state_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a builder saved with :meth:`save`.
+        """
+        with open(path, 'rb') as state_file:
+            version, builder = pickle.load(state_file)
+        if version != STATE_VERSION:
+            raise ValueError('ATN state {} has version {}, expected {}'.format(path, version, STATE_VERSION))
+        return builder
+
+    def next_reaction_id(self):
+        """
+        Returns the id the next appended reaction should get.
+        """
+        return max(self.reactions, default=-1) + 1
+
+    def _new_template(self, name, smiles, origin):
+        # an occurrence RDKit can not parse uses no id, the next one of the
+        # compound defines it
+        template = build_template(self._next_cid, name, smiles, origin, self.directed, self.explicit_hydrogens,
+                                  self.library)
+        self._next_cid += 1
+        return template
+
+    def _add_template(self, template):
+        self.templates[template.name] = template
+        self.structure_index.setdefault(template.structure_hash, []).append(template.name)
+
+    def _mergeable(self, name):
+        base, _, suffix = name.rpartition('_')
+        return self.merge_compounds and not (suffix in ('in', 'out') and base in self.renamed_compounds)
+
+    def _find_same_structure(self, structure, mol, pending=None):
+        """
+        Returns the name of a template, or of a compound in `pending` (name to
+        hash and heavy atom graph), with the same structure as `mol`. None if
+        there is none.
+        """
+        for name in self.structure_index.get(structure, ()):
+            template = self.templates[name]
+            if not self._mergeable(name):
+                continue
+            matched = mol.copy()
+            if self.explicit_hydrogens:
+                add_explicit_hydrogens(matched)
+            if len(matched) == len(template.match_graph) and findIsomorphATNStructure(template.match_graph, matched)[0]:
+                return name
+        for name, (other_structure, other) in (pending or {}).items():
+            if other_structure == structure and _same_heavy_structure(other, mol):
+                return name
+        return None
+
+    def _known(self, name):
+        return name in self.templates or name in self.compound_aliases
+
+    def _resolve(self, sides):
+        """
+        Replaces the names of merged compounds in `sides` by the names of the
+        compounds they were merged into.
+        """
+        aliases = self.compound_aliases
+        return tuple([(aliases.get(name, name), smiles) for name, smiles in compounds] for compounds in sides)
+
+    def add_reaction(self, reaction):
+        """
+        Adds a single reaction, running all three phases in this process.
+
+        Parameters
+        ----------
+        reaction : MappedReaction
+            The reaction. Its index is the reaction id and must not be in use.
+        """
+        self._add_reaction(reaction)
+        self.update_directions(self.transitions.reaction_edges(reaction.index))
+
+    def _add_reaction(self, reaction):
+        if reaction.index in self.reactions:
+            raise ValueError('Reaction {} is already part of the ATN'.format(reaction.index))
+        sides = self._register(reaction)
+        if sides is None:
+            return
+        for side, compounds in enumerate(sides):
+            for position, (name, smiles) in enumerate(compounds):
+                if self._known(name) or not smiles:
+                    continue
+                origin = CompoundOccurrence(reaction.index, side, position)
+                try:
+                    if self._mergeable(name):
+                        same = self._find_same_structure(*compound_structure(smiles))
+                        if same is not None:
+                            LOGGER.info("Merge Compound %s into %s", name, same)
+                            self.compound_aliases[name] = same
+                            continue
+                    self._add_template(self._new_template(name, smiles, origin))
+                except ValueError:
+                    LOGGER.error("Compound Parse Error: " + name + " : " + smiles)
+        sides = self._resolve(sides)
+        mapped = mapReaction(reaction.index, sides, self.templates, self.explicit_hydrogens)
+        self._merge_reaction(reaction, sides, mapped)
+
+    def remove_reaction(self, reaction_id):
+        """
+        Removes a reaction from the ATN. Transition edges without any other
+        reaction are deleted, as are compounds no other reaction references.
+
+        Parameters
+        ----------
+        reaction_id : int
+            The reaction to remove.
+
+        Returns
+        -------
+        MappedReaction
+            The removed reaction.
+        """
+        reaction, orphans = self._detach_reaction(reaction_id)
+        for name in orphans:
+            self._remove_compound(name)
+        return reaction
+
+    def replace_reaction(self, reaction):
+        """
+        Replaces the reaction with id `reaction.index`, e.g. after its atom
+        mapping was corrected. Compounds the new version still references keep
+        their nodes.
+
+        Returns
+        -------
+        MappedReaction
+            The replaced reaction.
+        """
+        old, orphans = self._detach_reaction(reaction.index)
+        self.add_reaction(reaction)
+        for name in orphans:
+            if not self.compound_reactions[name]:
+                self._remove_compound(name)
+        return old
+
+    def _detach_reaction(self, reaction_id):
+        """
+        Removes the transitions of a reaction, returns the reaction and the
+        names of the compounds left without any reaction.
+        """
+        if reaction_id not in self.reactions:
+            raise KeyError('Reaction {} is not part of the ATN'.format(reaction_id))
+        reaction = self.reactions.pop(reaction_id)
+
+        kept, dropped = self.transitions.remove_reaction(reaction_id)
+        self.ATN.remove_edges_from(dropped)
+        trans_H_node = "react_"+str(reaction_id)+"_free_H"
+        if self.ATN.has_node(trans_H_node) and not self.ATN.degree(trans_H_node):
+            self.ATN.remove_node(trans_H_node)
+        self.update_directions(kept)
+        for cid, placed in list(self.compound_placeholders.items()):
+            if placed.pop(reaction_id, None) is not None:
+                if not placed:
+                    del self.compound_placeholders[cid]
+                self._restore_placeholder(cid)
+        self._reset_hydrogen_groups(self.reaction_hydrogen_groups.pop(reaction_id, ()))
+
+        orphans = []
+        for name in self.reaction_compounds.pop(reaction_id, ()):
+            template = self.templates[name]
+            if template.origin is not None and template.origin.reaction == reaction_id:
+                # later occurrences are matched against the template with VF2
+                template.origin = None
+            references = self.compound_reactions[name]
+            references.discard(reaction_id)
+            if not references:
+                orphans.append(name)
+        return reaction, orphans
+
+    def _remove_compound(self, name):
+        LOGGER.debug("Remove Compound " + name)
+        self.ATN.remove_nodes_from(self.compound_to_subgraph.pop(name))
+        template = self.templates.pop(name)
+        del self.compoundId_to_compound[template.cid]
+        self._restore_placeholder(template.cid)
+        del self.compound_reactions[name]
+        self.structure_index[template.structure_hash].remove(name)
+        if not self.structure_index[template.structure_hash]:
+            del self.structure_index[template.structure_hash]
+        self.compound_aliases = {alias: merged for alias, merged in self.compound_aliases.items() if merged != name}
+
+    def _restore_placeholder(self, cid):
+        """
+        Puts the compound without atoms last placed at `cid` by a reaction
+        still in the ATN back into `compoundId_to_compound`, as a fresh build
+        would have it. Compounds with atoms keep their id.
+        """
+        if self.compoundId_to_compound.get(cid, ('', ''))[1]:
+            return
+        placed = self.compound_placeholders.get(cid)
+        if placed:
+            self.compoundId_to_compound[cid] = (placed[max(placed)], '')
+        else:
+            self.compoundId_to_compound.pop(cid, None)
+
+    def _reset_hydrogen_groups(self, groups):
+        """
+        Removes the HYDROGEN_GROUP edges connecting the hydrogens of `groups`,
+        then reconnects them for the reactions still in the ATN.
+        """
+        group_type = self.transition_type.HYDROGEN_GROUP
+        nodes = set()
+        stack = [node for pair in groups for node in pair if node in self.ATN]
+        while stack:
+            node = stack.pop()
+            if node in nodes:
+                continue
+            nodes.add(node)
+            stack.extend(other for other, data in self.ATN[node].items() if data['transition'] == group_type)
+        self.ATN.remove_edges_from([(u, v) for u, v, transition in self.ATN.edges(nodes, data='transition')
+                                    if transition == group_type])
+        for reaction_id in sorted(self.reaction_hydrogen_groups):
+            for rep_atom, atom in self.reaction_hydrogen_groups[reaction_id]:
+                if rep_atom in nodes:
+                    self._add_hydrogen_group(rep_atom, atom)
+
+    def build(self, reactions, workers=1, chunksize=8):
+        """
+        Adds all `reactions`.
+
+        Parameters
+        ----------
+        reactions : collections.abc.Iterable[MappedReaction]
+            The reactions in order.
+        workers : int
+            Number of processes for phases one and two. With a single worker
+            everything runs in this process.
+        chunksize : int
+            Number of tasks handed to a worker at once.
+        """
+        if workers <= 1:
+            for reaction in reactions:
+                self._add_reaction(reaction)
+            self.update_directions()
+            return
+
+        reactions = list(reactions)
+
+        # phase one: collect unique compounds in order of appearance, each
+        # defined by its first occurrence RDKit can parse
+        all_sides = []
+        pending = {}
+        unparsable = []
+        for reaction in reactions:
+            sides = reaction_sides(reaction, self.renamed_compounds)
+            all_sides.append(sides)
+            if sides is None:
+                continue
+            for side, compounds in enumerate(sides):
+                for position, (name, smiles) in enumerate(compounds):
+                    if self._known(name) or name in pending or not smiles:
+                        continue
+                    if Chem.MolFromSmiles(smiles) is None:
+                        unparsable.append((name, smiles))
+                        continue
+                    pending[name] = (smiles, CompoundOccurrence(reaction.index, side, position))
+
+        with multiprocessing.Pool(workers) as pool:
+            if self.merge_compounds:
+                # compounds are merged in order of appearance, before
+                # templates get their ids
+                mergeable = [name for name in pending if self._mergeable(name)]
+                structures = pool.imap(_compound_structure_job, [pending[name][0] for name in mergeable], chunksize)
+                kept = {}
+                for name, found in zip(mergeable, structures):
+                    if found is None:
+                        unparsable.append((name, pending.pop(name)[0]))
+                        continue
+                    structure, mol = found
+                    same = self._find_same_structure(structure, mol, kept)
+                    if same is None:
+                        kept[name] = (structure, mol)
+                    else:
+                        LOGGER.info("Merge Compound %s into %s", name, same)
+                        self.compound_aliases[name] = same
+                        del pending[name]
+
+            jobs = [(self._next_cid + i, name, smiles, origin, self.directed, self.explicit_hydrogens, self.library)
+                    for i, (name, (smiles, origin)) in enumerate(pending.items())]
+            self._next_cid += len(jobs)
+            LOGGER.info("Build %d compound templates with %d workers", len(jobs), workers)
+            for (_, name, smiles, origin, *_), template in zip(jobs, pool.imap(_build_template_job, jobs, chunksize)):
+                if template is None:
+                    unparsable.append((name, smiles))
+                else:
+                    self._add_template(template)
+        # occurrences of compounds with a template are reported when mapped
+        for name, smiles in unparsable:
+            if name not in self.templates:
+                LOGGER.error("Compound Parse Error: " + name + " : " + smiles)
+        all_sides = [None if sides is None else self._resolve(sides) for sides in all_sides]
+
+        # phase two: atom correspondences per reaction, merged in order (phase three)
+        jobs = [(reaction.index, sides, self.explicit_hydrogens)
+                for reaction, sides in zip(reactions, all_sides) if sides is not None]
+        LOGGER.info("Map %d reactions with %d workers", len(jobs), workers)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(self.templates,)) as pool:
+            results = pool.imap(_map_reaction_job, jobs, chunksize)
+            for reaction, sides in zip(reactions, all_sides):
+                self._register(reaction)
+                if sides is not None:
+                    self._merge_reaction(reaction, sides, next(results))
+        self.update_directions()
+
+    def _register(self, reaction):
+        LOGGER.info("Next Reaction ==============")
+        LOGGER.info(reaction.names)
+        LOGGER.info(reaction.smiles)
+        self.reactions[reaction.index] = reaction
+        return reaction_sides(reaction, self.renamed_compounds)
+
+    def _insert_compound(self, template):
+        self.compoundId_to_compound[template.cid] = (template.name, template.smiles)
+        graph = template.graph
+        if self.elements is not None:
+            graph = graph.subgraph(n for n, element in graph.nodes(data='element') if element in self.elements)
+        self.ATN.add_nodes_from(graph.nodes(data=True))
+        self.ATN.add_edges_from(graph.edges(data=True))
+        self.compound_to_subgraph[template.name] = list(graph)
+        self.compound_reactions[template.name] = set()
+        self._inserted_compounds += 1
+
+    def _merge_reaction(self, reaction, sides, mapped):
+        """
+        Phase three: inserts new compounds and the transition edges of a
+        reaction into the ATN.
+        """
+        ATN = self.ATN
+        T = self.transition_type
+        reaction_id = reaction.index
+        reversable = self.directed and is_reversible(reaction.meta)
+        mapped_educt_atoms, mapped_educt_hydrogens, mapped_product_atoms, mapped_product_hydrogens = mapped
+
+        for side, compounds in enumerate(sides):
+            for position, (name, smiles) in enumerate(compounds):
+                if name in self.compound_to_subgraph:
+                    continue
+                if not smiles:
+                    # a compound without atoms gets no nodes, its id is
+                    # taken over by the next new compound
+                    self.compound_placeholders.setdefault(self._inserted_compounds, {})[reaction_id] = name
+                    self._restore_placeholder(self._inserted_compounds)
+                elif name in self.templates and self.templates[name].origin == (reaction_id, side, position):
+                    self._insert_compound(self.templates[name])
+
+        compounds = {name for names in sides for name, _ in names if name in self.compound_to_subgraph}
+        self.reaction_compounds[reaction_id] = compounds
+        for name in compounds:
+            self.compound_reactions[name].add(reaction_id)
+
+        if self.explicit_hydrogens:
+
+            LOGGER.debug("Map Hydrogens")
+
+            trans_H_node = "react_"+str(reaction_id)+"_free_H"
+
+            key_set_educt  = set(mapped_educt_hydrogens.keys())
+            key_set_product  = set(mapped_product_hydrogens.keys())
+            key_set_all = key_set_educt.union(key_set_product)
+
+            for key in key_set_all:
+
+                hydro_count_educts = 0
+                if key in key_set_educt:
+                    hydro_count_educts = len(mapped_educt_hydrogens[key])
+                hydro_count_products = 0
+                if key in key_set_product:
+                    hydro_count_products = len(mapped_product_hydrogens[key])
+
+                if key == NO_MAP_DEFAULT_KEY or not hydro_count_educts == hydro_count_products:
+                    if not ATN.has_node(trans_H_node):
+                        ATN.add_node(trans_H_node)
+                        ATN.nodes[trans_H_node]['element'] = 'H'
+
+                    if hydro_count_educts > hydro_count_products or (key == NO_MAP_DEFAULT_KEY and hydro_count_educts > 0):
+                        for n in mapped_educt_hydrogens[key]:
+                            self._add_free_hydrogen(n, trans_H_node, reaction_id, reversable,
+                                                    hydro_count_educts - hydro_count_products)
+
+                    if hydro_count_educts < hydro_count_products or (key == NO_MAP_DEFAULT_KEY and hydro_count_products > 0):
+                        for n in mapped_product_hydrogens[key]:
+                            self._add_free_hydrogen(trans_H_node, n, reaction_id, reversable,
+                                                    hydro_count_products - hydro_count_educts)
+
+                # we always need to add in the real H transitions
+                if key == NO_MAP_DEFAULT_KEY or hydro_count_educts == 0 or hydro_count_products == 0:
+                    continue
+
+                rep_atom_educt = mapped_educt_hydrogens[key][0]
+                rep_atom_product = mapped_product_hydrogens[key][0]
+                if not ATN.has_edge(rep_atom_educt,rep_atom_product):
+                    ATN.add_edge(rep_atom_educt,rep_atom_product)
+                    ATN.edges[rep_atom_educt,rep_atom_product]['transition'] = T.HYDROGEN_REACTION
+
+                self.transitions.add(rep_atom_educt, rep_atom_product, reaction_id)
+                if reversable:
+                    self.transitions.add(rep_atom_product, rep_atom_educt, reaction_id)
+
+                groups = self.reaction_hydrogen_groups.setdefault(reaction_id, [])
+                for atom in mapped_educt_hydrogens[key][1:]: # all in group need to be connected
+                    groups.append((rep_atom_educt, atom))
+                    self._add_hydrogen_group(rep_atom_educt, atom)
+
+                for atom in mapped_product_hydrogens[key][1:]: # all in group need to be connected
+                    groups.append((rep_atom_product, atom))
+                    self._add_hydrogen_group(rep_atom_product, atom)
+
+        # classes of unmatched or unparsable occurrences, like naming errors
+        unmatched = [c for c in mapped_educt_atoms if c not in mapped_product_atoms]
+        if unmatched:
+            LOGGER.error("Atom Mapping Error: reaction " + str(reaction_id) + " : no product atom for classes "
+                         + ','.join(map(str, unmatched)))
+
+        for c in mapped_educt_atoms:
+
+            if c not in mapped_product_atoms:
+                continue
+            n1 = mapped_educt_atoms[c]
+            n2 = mapped_product_atoms[c]
+
+            if self.elements is not None and (n1 not in ATN or n2 not in ATN):
+                continue # atoms of elements that are not traced
+
+            if ATN.nodes[n1]['compound_id'] == ATN.nodes[n2]['compound_id']:
+                continue # skip all self maps
+
+            if not ATN.has_edge(n1,n2):
+                ATN.add_edge(n1, n2)
+                ATN.edges[n1, n2]['transition'] = T.REACTION
+
+            self.transitions.add(n1, n2, reaction_id)
+            if reversable and not (ATN.nodes[n2]['compound_name'].endswith('_in') or ATN.nodes[n2]['compound_name'].endswith('_out') or ATN.nodes[n1]['compound_name'].endswith('_in') or ATN.nodes[n1]['compound_name'].endswith('_out')):
+                self.transitions.add(n2, n1, reaction_id)
+
+    def _add_free_hydrogen(self, s, t, reaction_id, reversable, moving_atom):
+        ATN = self.ATN
+        ATN.add_edge(s, t)
+        if self.directed:
+            ATN.edges[s, t]['directed'] = DirectionType.DIRECTED
+        ATN.edges[s, t]['transition'] = self.transition_type.HYDROGEN_FREE
+        ATN.edges[s, t]['moving_atom'] = moving_atom
+        self.transitions.add(s, t, reaction_id)
+        if reversable:
+            ATN.edges[s, t]['directed'] = DirectionType.BIDIRECTED
+            self.transitions.add(t, s, reaction_id)
+
+    def _add_hydrogen_group(self, rep_atom, atom):
+        if not hasPath(self.ATN, rep_atom, atom, self.transition_type.HYDROGEN_GROUP):
+            self.ATN.add_edge(rep_atom, atom)
+            self.ATN.edges[rep_atom, atom]['transition'] = self.transition_type.HYDROGEN_GROUP
+            if self.directed:
+                self.ATN.edges[rep_atom, atom]['directed'] = DirectionType.BIDIRECTED
+
+    def update_directions(self, edges=None):
+        """
+        Sets the 'directed' attribute of reaction edges from the directions
+        recorded in `transitions`. Does nothing for undirected builds.
+
+        Parameters
+        ----------
+        edges : collections.abc.Iterable
+            The edges to update. Defaults to all transition edges.
+        """
+        if not self.directed:
+            return
+        T = self.transition_type
+        for u, v in (self.transitions if edges is None else edges):
+            if self.ATN.edges[u, v]['transition'] == T.REACTION or self.ATN.edges[u, v]['transition'] == T.HYDROGEN_REACTION:
+                if all(self.transitions.directions(u, v)):
+                    self.ATN.edges[u, v]['directed'] = DirectionType.BIDIRECTED
+                else:
+                    self.ATN.edges[u, v]['directed'] = DirectionType.DIRECTED
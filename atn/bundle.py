@@ -0,0 +1,295 @@
+"""
+Binary ATN bundles: the network as CSR arrays with typed attribute columns,
+plus the compound key, in a single NumPy ``.npz`` file.
+
+Layout of the bundle (all keys are plain arrays, no pickles):
+
+- ``directed``: whether edges are directed.
+- ``node_id``: node labels, in node order.
+- ``indptr``, ``indices``: the edges in CSR form, sorted by source node.
+  Undirected edges are stored once.
+- ``node.<name>`` / ``edge.<name>``: an attribute column, together with
+  ``.mask`` for missing values. String columns are categorical and add
+  ``.categories``; columns of reaction id lists are ragged and add
+  ``.offsets``.
+- ``ckey.id``, ``ckey.name``, ``ckey.smiles``: the compound key.
+- ``rindex.id``, ``rindex.offsets``, ``rindex.edges``: the reaction index,
+  for every reaction id the positions of its edges in CSR order.
+"""
+
+import enum
+from array import array
+from collections import namedtuple
+
+import networkx as nx
+import numpy as np
+
+
+ATNArrays = namedtuple('ATNArrays', ['directed', 'nodes', 'indptr', 'indices',
+                                     'node_attrs', 'edge_attrs', 'compound_key', 'reaction_index'],
+                       defaults=(None,))
+ATNArrays.__doc__ = """
+An ATN bundle as arrays. `node_attrs` and `edge_attrs` map attribute names to
+masked arrays, ragged columns to ``(offsets, values)`` tuples. Edge
+attributes follow the CSR order of `indices`. `reaction_index` is a tuple
+``(ids, offsets, edges)``, see :func:`reaction_index`, None for bundles
+without one.
+"""
+
+REACTION_COLUMNS = ('reaction_ids', 'reaction_id')
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+    return value
+
+
+class _Column:
+    """
+    Collects the values of one attribute in typed arrays, records without it
+    are missing. Strings are stored as category codes, sequences as lengths
+    and flat values.
+    """
+
+    @classmethod
+    def collect(cls, columns, index, attrs):
+        """
+        Adds the attributes of record `index` to the columns in `columns`.
+        """
+        for name, value in attrs.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = cls()
+            column.add(index, value)
+
+    def __init__(self):
+        self.records = array('q')
+        self.values = None
+        self.categories = None
+        self.lengths = None
+
+    def add(self, index, value):
+        value = _plain(value)
+        self.records.append(index)
+        if self.categories is None and isinstance(value, str):
+            self._to_categories()
+        if self.categories is not None:
+            self.values.append(self.categories.setdefault(str(value), len(self.categories)))
+        elif not np.isscalar(value):
+            if self.lengths is None:
+                if self.values is not None:
+                    raise TypeError('Attribute mixes sequences and single values')
+                self.lengths, self.values = array('q'), array('q')
+            self.lengths.append(len(value))
+            self.values.extend(iter(value))
+        elif self.values is None:
+            self.values = array('d' if isinstance(value, float) else 'q', [value])
+        else:
+            if isinstance(value, float) and self.values.typecode == 'q':
+                self.values = array('d', self.values)
+            self.values.append(value)
+
+    def _to_categories(self):
+        # a string among numbers makes all values strings
+        values = [] if self.values is None else [str(value) for value in self.values]
+        self.categories = {}
+        self.values = array('q', [self.categories.setdefault(value, len(self.categories)) for value in values])
+
+    def arrays(self, prefix, length, order=None):
+        """
+        Returns the arrays of the column for `length` records, permuted by
+        `order` if given.
+        """
+        records = np.frombuffer(self.records, dtype=np.int64) if self.records else np.zeros(0, np.int64)
+        mask = np.ones(length, dtype=bool)
+        mask[records] = False
+        values = np.array(self.values)
+        categories = None
+        if self.categories is not None:
+            # categories are sorted, as np.unique gives them
+            names = np.array(list(self.categories), dtype=str)
+            rank = np.empty(len(names), dtype=np.int32)
+            rank[np.argsort(names, kind='stable')] = np.arange(len(names), dtype=np.int32)
+            column = np.full(length, -1, dtype=np.int32)
+            column[records] = rank[values.astype(np.int64)]
+            categories = np.sort(names)
+        elif self.lengths is not None:
+            counts = np.array(self.lengths, dtype=np.int64)
+            lengths = np.zeros(length, dtype=np.int64)
+            lengths[records] = counts
+            starts = np.zeros(length, dtype=np.int64)
+            starts[records] = np.cumsum(counts) - counts
+            if order is not None:
+                lengths, starts, mask = lengths[order], starts[order], mask[order]
+            offsets = np.zeros(length + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths)
+            positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+            return {prefix + '.mask': mask, prefix: values.astype(np.int64)[positions], prefix + '.offsets': offsets}
+        else:
+            column = np.zeros(length, dtype=values.dtype)
+            column[records] = values
+        if order is not None:
+            column, mask = column[order], mask[order]
+        out = {prefix + '.mask': mask, prefix: column}
+        if categories is not None:
+            out[prefix + '.categories'] = categories
+        return out
+
+
+def reaction_index(offsets, values):
+    """
+    Inverts a ragged column of reaction ids per edge.
+
+    Returns
+    -------
+    tuple(np.ndarray, np.ndarray, np.ndarray)
+        The sorted reaction ids, and offsets into the edge positions so that
+        ``edges[offsets[i]:offsets[i + 1]]`` are the edges of ``ids[i]``.
+    """
+    edges = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    order = np.argsort(values, kind='stable')
+    ids, counts = np.unique(values[order], return_counts=True)
+    return ids, np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), edges[order]
+
+
+def write_bundle(path, nodes, edges, compoundId_to_compound, directed):
+    """
+    Writes an ATN bundle from node and edge records.
+
+    Parameters
+    ----------
+    path : str
+        The ``.npz`` file to write.
+    nodes : collections.abc.Iterable[tuple(str, dict)]
+        Node labels with their attributes.
+    edges : collections.abc.Iterable[tuple(str, str, dict)]
+        Edges with their attributes. Reaction ids are given as sequences of
+        int. Edges may only refer to nodes listed before.
+    compoundId_to_compound : dict[int, tuple(str, str)]
+        The compound key, compound id to name and SMILES.
+    directed : bool
+        Whether `edges` are directed.
+
+    Records are consumed one at a time into typed arrays, a few bytes per
+    value, and no record is kept. Besides the arrays only a dict from node
+    label to position is held.
+    """
+    node_ids = {}
+    node_columns = {}
+    for index, (node, attrs) in enumerate(nodes):
+        node_ids[node] = index
+        _Column.collect(node_columns, index, attrs)
+
+    # edges are collected column by column, then sorted by source
+    sources, targets = array('q'), array('q')
+    edge_columns = {}
+    for index, (source, target, attrs) in enumerate(edges):
+        sources.append(node_ids[source])
+        targets.append(node_ids[target])
+        _Column.collect(edge_columns, index, attrs)
+    n_edges = len(sources)
+    sources = np.frombuffer(sources, dtype=np.int64) if n_edges else np.zeros(0, np.int64)
+    order = np.argsort(sources, kind='stable')
+
+    n_nodes = len(node_ids)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(sources, minlength=n_nodes))
+
+    arrays = {'directed': np.array(directed),
+              'node_id': np.array(list(node_ids), dtype=str),
+              'indptr': indptr,
+              'indices': np.array(targets, dtype=np.int64)[order]}
+    for name, column in node_columns.items():
+        arrays.update(column.arrays('node.' + name, n_nodes))
+    for name, column in edge_columns.items():
+        arrays.update(column.arrays('edge.' + name, n_edges, order))
+    for name in REACTION_COLUMNS:
+        if 'edge.' + name + '.offsets' in arrays:
+            ids, offsets, positions = reaction_index(arrays['edge.' + name + '.offsets'], arrays['edge.' + name])
+            arrays.update({'rindex.id': ids, 'rindex.offsets': offsets, 'rindex.edges': positions})
+            break
+
+    compound_ids = sorted(compoundId_to_compound)
+    arrays['ckey.id'] = np.array(compound_ids, dtype=np.int64)
+    arrays['ckey.name'] = np.array([compoundId_to_compound[cid][0] for cid in compound_ids], dtype=str)
+    arrays['ckey.smiles'] = np.array([compoundId_to_compound[cid][1] for cid in compound_ids], dtype=str)
+
+    with open(path, 'wb') as bundle_file:
+        np.savez_compressed(bundle_file, **arrays)
+
+
+def _read_columns(bundle, prefix):
+    columns = {}
+    for key in bundle.files:
+        if not key.startswith(prefix) or key.count('.') != 1:
+            continue
+        mask = bundle[key + '.mask']
+        if key + '.categories' in bundle.files:
+            values = bundle[key + '.categories'][np.maximum(bundle[key], 0)]
+            columns[key[len(prefix):]] = np.ma.MaskedArray(values, mask)
+        elif key + '.offsets' in bundle.files:
+            columns[key[len(prefix):]] = (bundle[key + '.offsets'], bundle[key])
+        else:
+            columns[key[len(prefix):]] = np.ma.MaskedArray(bundle[key], mask)
+    return columns
+
+
+def read_bundle_arrays(path):
+    """
+    Reads an ATN bundle without building a graph.
+
+    Returns
+    -------
+    ATNArrays
+    """
+    with np.load(path) as bundle:
+        compound_key = {int(cid): (str(name), str(smiles)) for cid, name, smiles
+                        in zip(bundle['ckey.id'], bundle['ckey.name'], bundle['ckey.smiles'])}
+        index = None
+        if 'rindex.id' in bundle.files:
+            index = (bundle['rindex.id'], bundle['rindex.offsets'], bundle['rindex.edges'])
+        return ATNArrays(bool(bundle['directed']), bundle['node_id'], bundle['indptr'], bundle['indices'],
+                         _read_columns(bundle, 'node.'), _read_columns(bundle, 'edge.'), compound_key, index)
+
+
+def _column_values(column):
+    if isinstance(column, tuple):
+        offsets, values = column
+        # ragged columns hold reaction ids, formatted as in the GML files
+        return [None if start == end else ','.join(map(str, values[start:end]))
+                for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    return [None if missing else value.item() for value, missing
+            in zip(column.data, np.ma.getmaskarray(column))]
+
+
+def _attr_dicts(columns, count):
+    dicts = [{} for _ in range(count)]
+    for name, column in columns.items():
+        for attrs, value in zip(dicts, _column_values(column)):
+            if value is not None:
+                attrs[name] = value
+    return dicts
+
+
+def read_bundle(path):
+    """
+    Reads an ATN bundle into a networkx graph. Attributes are the ones the GML
+    writers produce, reaction ids as comma separated strings.
+
+    Returns
+    -------
+    tuple(nx.Graph, dict)
+        The ATN (a DiGraph if the bundle is directed) and the compound key.
+    """
+    arrays = read_bundle_arrays(path)
+    graph = nx.DiGraph() if arrays.directed else nx.Graph()
+    nodes = arrays.nodes.tolist()
+    graph.add_nodes_from(zip(nodes, _attr_dicts(arrays.node_attrs, len(nodes))))
+    sources = np.repeat(np.arange(len(nodes)), np.diff(arrays.indptr))
+    graph.add_edges_from((nodes[s], nodes[t], attrs) for s, t, attrs
+                         in zip(sources.tolist(), arrays.indices.tolist(),
+                                _attr_dicts(arrays.edge_attrs, len(arrays.indices))))
+    return graph, arrays.compound_key
@@ -0,0 +1,194 @@
+"""
+Tracer experiment design on the directed ATN.
+
+Label presence propagates independently for every atom, so the reactions a
+tracer labels are the union of those its atoms label. Every substrate atom is
+therefore propagated once, in one batch, and all candidate labellings are
+scored from these per-atom results without propagating again.
+
+A candidate distinguishes two reactions (or pathways) of interest if they are
+reached by label from different sets of its atoms. Candidates are ranked by
+the number of such separated pairs, then by the number of reactions they
+label, then by the number of labelled positions (fewer is cheaper).
+"""
+
+import itertools
+from collections import namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .propagation import LABEL_TRANSITIONS, LabelPropagator
+from .reachability import directed_arrays, read_directed_arrays
+from .types import TransitionType
+
+TracerCandidate = namedtuple('TracerCandidate', ['compound', 'atoms', 'kind'])
+TracerCandidate.__doc__ = """
+A labelling of substrate `compound`: the labelled `atoms` and the `kind` of
+labelling, 'single', 'multi' or 'uniform'.
+"""
+
+TracerScore = namedtuple('TracerScore', ['candidate', 'separated', 'classes', 'covered'])
+TracerScore.__doc__ = """
+The score of a candidate: the number of `separated` pairs of targets, the
+number of distinct `classes` of targets (by the atoms reaching them, not
+reached ones included) and the number of `covered` targets.
+"""
+
+
+class TracerDesigner:
+    """
+    Enumerates and scores tracer labellings of substrates.
+
+    Parameters
+    ----------
+    arrays : atn.reachability.DirectedArrays
+        Reaction and symmetry edges of a directed ATN with their reaction ids.
+    targets : dict[str, collections.abc.Iterable[int]] or collections.abc.Iterable[int]
+        The reactions of interest, or pathways of interest as name to
+        reaction ids. A pathway is labelled if any of its reactions is.
+        Defaults to all reactions of the ATN.
+    """
+
+    def __init__(self, arrays, targets=None):
+        self.propagator = LabelPropagator(arrays)
+        sources = np.repeat(np.arange(len(arrays.nodes)), np.diff(arrays.indptr))
+        if targets is None:
+            targets = sorted({rid for rids in arrays.reaction_ids for rid in rids})
+        if not isinstance(targets, dict):
+            targets = {str(rid): (rid,) for rid in targets}
+        self.target_names = list(targets)
+        rows = {}
+        for row, rids in enumerate(targets.values()):
+            for rid in rids:
+                rows.setdefault(rid, []).append(row)
+
+        # target x atom incidence: label on the atom passes the target
+        entries = {(row, u) for u, transition, rids in zip(sources.tolist(), arrays.transitions, arrays.reaction_ids)
+                   if transition == TransitionType.REACTION.value for rid in rids for row in rows.get(rid, ())}
+        entries = np.array(sorted(entries), dtype=np.int64).reshape(-1, 2)
+        self._incidence = csr_matrix((np.ones(len(entries), dtype=np.int32), (entries[:, 0], entries[:, 1])),
+                                     shape=(len(self.target_names), len(arrays.nodes)))
+
+    @classmethod
+    def from_graph(cls, ATN, targets=None):
+        """
+        Builds the designer of a directed ATN graph.
+        """
+        return cls(directed_arrays(ATN, LABEL_TRANSITIONS), targets)
+
+    @classmethod
+    def from_file(cls, path, targets=None):
+        """
+        Builds the designer of a directed ATN file, a GML file or a ``.npz``
+        bundle.
+        """
+        return cls(read_directed_arrays(path, LABEL_TRANSITIONS), targets)
+
+    def traversal(self, atoms):
+        """
+        Returns which targets label on each of `atoms` passes.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean atoms x targets matrix.
+        """
+        labels = self.propagator.propagate([[atom] for atom in atoms])
+        return np.asarray((self._incidence @ labels.astype(np.int32)) > 0).T
+
+    def candidates(self, substrates, element='C', max_positions=2, traversal=None):
+        """
+        Enumerates the labellings of `substrates`: every single position,
+        combinations of up to `max_positions` positions and the uniform
+        labelling of all atoms of `element`.
+
+        Atoms whose label passes the same targets are interchangeable, only
+        the first of them is used for single and multi position labellings;
+        atoms labelling no target are left out of them.
+
+        Parameters
+        ----------
+        traversal : dict[str, np.ndarray]
+            Results of :meth:`traversal` of the atoms, computed if not given.
+
+        Yields
+        ------
+        TracerCandidate
+        """
+        for compound in substrates:
+            atoms = self.propagator.compound_atoms(compound, element)
+            passes = traversal[compound] if traversal is not None else self.traversal(atoms)
+            _, first = np.unique(passes, axis=0, return_index=True)
+            useful = [atoms[i] for i in sorted(first) if passes[i].any()]
+            for atom in useful:
+                yield TracerCandidate(compound, (atom,), 'single')
+            for size in range(2, min(max_positions, len(useful)) + 1):
+                for combination in itertools.combinations(useful, size):
+                    if size < len(atoms):
+                        yield TracerCandidate(compound, combination, 'multi')
+            yield TracerCandidate(compound, tuple(atoms), 'uniform')
+
+    def score(self, candidates, traversal):
+        """
+        Scores `candidates` at once.
+
+        Parameters
+        ----------
+        candidates : collections.abc.Sequence[TracerCandidate]
+        traversal : dict[str, tuple(list[str], np.ndarray)]
+            Per substrate its atoms and the result of :meth:`traversal` for
+            them.
+
+        Returns
+        -------
+        list[TracerScore]
+        """
+        n_targets = len(self.target_names)
+        # the atoms reaching a target are hashed as sum of random atom keys,
+        # so equal atom sets give equal hashes
+        rng = np.random.default_rng(0)
+        scores = []
+        for compound, group in itertools.groupby(candidates, key=lambda candidate: candidate.compound):
+            group = list(group)
+            atoms, passes = traversal[compound]
+            column = {atom: i for i, atom in enumerate(atoms)}
+            keys = rng.integers(1, 2**63, size=len(atoms), dtype=np.uint64)
+            chosen = np.zeros((len(group), len(atoms)), dtype=np.uint64)
+            for row, candidate in enumerate(group):
+                chosen[row, [column[atom] for atom in candidate.atoms]] = 1
+            hashes = np.sort((chosen * keys) @ passes.astype(np.uint64), axis=1)
+            starts = np.ones(hashes.shape, dtype=bool)
+            starts[:, 1:] = hashes[:, 1:] != hashes[:, :-1]
+            classes = starts.sum(axis=1)
+            # pairs in the same class are not separated
+            run_ids = np.cumsum(starts, axis=1) - 1
+            sizes = np.zeros((len(group), n_targets), dtype=np.int64)
+            np.add.at(sizes, (np.repeat(np.arange(len(group)), n_targets), run_ids.ravel()), 1)
+            separated = n_targets * (n_targets - 1) // 2 - (sizes * (sizes - 1) // 2).sum(axis=1)
+            covered = (hashes != 0).sum(axis=1)
+            scores.extend(TracerScore(candidate, int(s), int(c), int(v))
+                          for candidate, s, c, v in zip(group, separated, classes, covered))
+        return scores
+
+    def rank(self, substrates, element='C', max_positions=2, top=None):
+        """
+        Enumerates the labellings of `substrates` (see :meth:`candidates`),
+        scores and ranks them.
+
+        Returns
+        -------
+        list[TracerScore]
+            The best `top` candidates, all if None.
+        """
+        # one propagation for the atoms of all substrates
+        atoms = {compound: self.propagator.compound_atoms(compound, element) for compound in substrates}
+        passes = self.traversal([atom for compound in substrates for atom in atoms[compound]])
+        bounds = np.cumsum([0] + [len(atoms[compound]) for compound in substrates])
+        traversal = {compound: (atoms[compound], passes[start:end])
+                     for compound, start, end in zip(substrates, bounds[:-1], bounds[1:])}
+        candidates = list(self.candidates(substrates, element, max_positions,
+                                          {compound: passes for compound, (_, passes) in traversal.items()}))
+        scores = self.score(candidates, traversal)
+        scores.sort(key=lambda score: (-score.separated, -score.covered, len(score.candidate.atoms)))
+        return scores if top is None else scores[:top]
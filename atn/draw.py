@@ -0,0 +1,230 @@
+"""
+HTML drawings of ATNs with pyvis.
+
+Drawing is a separate stage: it works on a saved builder state of a
+directed ATN (see `06_draw_ATN.py`), renders compounds and reactions in a
+process pool and skips drawings that are newer than the state.
+"""
+
+import os
+import logging
+import multiprocessing
+
+import networkx as nx
+
+from pyvis.network import Network
+
+from .transitions import TransitionIndex
+from .types import TransitionType, DirectionType
+
+LOGGER = logging.getLogger(__name__)
+
+ELEMENT_COLORS = {'C': "black", 'O': "red", 'S': "yellow"}
+
+
+def draw_single_compound(name, mol, molecule_graph_path):
+    """
+    Writes the atoms of a compound with bonds and symmetries to
+    `molecule_graph_path`/`name`.html.
+    """
+    newMol = mol.copy()
+    for n in mol.nodes():
+        if 'element' in mol.nodes[n]:
+            newMol.nodes[n]['label'] = mol.nodes[n]['element'] + '(' + n + ')'
+            if mol.nodes[n]['element'] in ELEMENT_COLORS:
+                newMol.nodes[n]['color'] = ELEMENT_COLORS[mol.nodes[n]['element']]
+        else:
+            newMol.nodes[n]['label'] = "*"
+
+    for e in mol.edges():
+        newMol.edges[e].pop('directed', None)
+        if mol.edges[e]['transition'] == TransitionType.REACTION:
+            newMol.edges[e]['label'] = str(mol.edges[e]['order'])
+            newMol.edges[e]['color'] = "black"
+        elif mol.edges[e]['transition'] == TransitionType.SYMMETRY:
+            newMol.edges[e]['color'] = "green"
+
+    net = Network()
+    net.from_nx(newMol)
+    with open(molecule_graph_path + '/' + name + '.html', "w+") as out:
+        out.write(net.generate_html())
+
+
+def draw_full_ATN(ATN, transitions, outputhtml):
+    """
+    Writes `ATN` with all bonds and transitions to `outputhtml`.
+    """
+    draw = nx.DiGraph()
+    draw.add_nodes_from(ATN.nodes())
+    draw.add_edges_from(ATN.edges(data=True))
+
+    for n in ATN.nodes():
+        if 'element' in ATN.nodes[n]:
+            draw.nodes[n]['label'] = ATN.nodes[n]['element']
+        else:
+            draw.nodes[n]['label'] = "*"
+        if 'hcount' in ATN.nodes[n]:
+            draw.nodes[n]['label'] += str(ATN.nodes[n]['hcount'])+'H'
+        draw.nodes[n]['color'] = "black"
+
+    for e in ATN.edges():
+
+        del draw.edges[e]['directed']
+
+        if ATN.edges[e]['directed'] == DirectionType.DIRECTED:
+            if transitions.reactions(*e):
+                draw.edges[e]['arrows'] = "to"
+            else:
+                draw.edges[e]['arrows'] = "from"
+        elif ATN.edges[e]['directed'] == DirectionType.BIDIRECTED:
+            draw.edges[e]['arrows'] = "to, from"
+        elif ATN.edges[e]['directed'] == DirectionType.UNDIRECTED:
+            draw.edges[e]['arrows'] = "no"
+
+        if ATN.edges[e]['transition'] == TransitionType.SYMMETRY:
+            draw.edges[e]['color'] = "green"
+        elif ATN.edges[e]['transition'] == TransitionType.REACTION:
+            draw.edges[e]['color'] = "red"
+        elif ATN.edges[e]['transition'] == TransitionType.HYDROGEN_GROUP or ATN.edges[e]['transition'] == TransitionType.HYDROGEN_REACTION:
+            draw.edges[e]['color'] = "LightSkyBlue"
+        elif ATN.edges[e]['transition'] == TransitionType.HYDROGEN_FREE:
+            draw.edges[e]['color'] = "DarkBlue"
+        else:
+            draw.edges[e]['label'] = str(ATN.edges[e]['order'])
+            draw.edges[e]['color'] = "black"
+
+    nt = Network('1000px', '1000px', directed=True)
+    nt.show_buttons()
+    nt.from_nx(draw)
+    with open(outputhtml, "w+") as out:
+        out.write(nt.generate_html())
+
+
+def reaction_subgraph(builder, reaction_id):
+    """
+    Returns the compounds of a reaction with the transitions it induces. Other
+    transition edges between these compounds are left out.
+    """
+    nodes = [n for name in builder.reaction_compounds.get(reaction_id, ()) for n in builder.compound_to_subgraph[name]]
+    trans_H_node = "react_"+str(reaction_id)+"_free_H"
+    if builder.ATN.has_node(trans_H_node):
+        nodes.append(trans_H_node)
+    own = {frozenset(edge) for edge in builder.transitions.reaction_edges(reaction_id)}
+    return nx.subgraph_view(builder.ATN.subgraph(nodes),
+                            filter_edge=lambda u, v: (u, v) not in builder.transitions or frozenset((u, v)) in own)
+
+
+def neighbourhood(ATN, sources, radius):
+    """
+    Returns the subgraph of all nodes at most `radius` edges away from any
+    node in `sources`.
+    """
+    reached = nx.multi_source_dijkstra_path_length(ATN, set(sources), cutoff=radius)
+    return ATN.subgraph(reached)
+
+
+def is_up_to_date(path, source_mtime):
+    """
+    Returns whether `path` exists and is newer than `source_mtime`.
+    """
+    return os.path.exists(path) and os.path.getmtime(path) >= source_mtime
+
+
+def _draw_compound_job(job):
+    name, mol, molecule_graph_path = job
+    draw_single_compound(name, mol, molecule_graph_path)
+    return name
+
+
+def _draw_graph_job(job):
+    graph, transitions, outputhtml = job
+    draw_full_ATN(graph, transitions, outputhtml)
+    return outputhtml
+
+
+def _run(function, jobs, workers):
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            function(job)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for _ in pool.imap_unordered(function, jobs):
+            pass
+
+
+def draw_compounds(builder, names, molecule_graph_path, workers=1, source_mtime=None):
+    """
+    Draws the compounds `names` of the ATN of `builder`, as
+    :func:`draw_single_compound`.
+
+    Parameters
+    ----------
+    builder : atn.build.ATNBuilder
+        The builder holding the ATN.
+    names : collections.abc.Iterable[str]
+        The compounds to draw.
+    molecule_graph_path : str
+        Folder for the HTML files.
+    workers : int
+        Number of processes drawing.
+    source_mtime : float
+        Modification time of the ATN. Drawings newer than that are kept. If
+        None, everything is drawn.
+
+    Returns
+    -------
+    int
+        The number of compounds drawn.
+    """
+    jobs = []
+    for name in names:
+        path = molecule_graph_path + '/' + name + '.html'
+        if source_mtime is not None and is_up_to_date(path, source_mtime):
+            continue
+        # copies, so that only the compound is sent to the workers
+        jobs.append((name, builder.ATN.subgraph(builder.compound_to_subgraph[name]).copy(), molecule_graph_path))
+    LOGGER.info("Draw %d compounds with %d workers", len(jobs), workers)
+    _run(_draw_compound_job, jobs, workers)
+    return len(jobs)
+
+
+def draw_reactions(builder, reaction_ids, molecule_graph_path, workers=1, source_mtime=None):
+    """
+    Draws reactions with their compounds to
+    `molecule_graph_path`/reaction_<id>.html, see :func:`draw_compounds`.
+    """
+    jobs = []
+    for reaction_id in reaction_ids:
+        path = molecule_graph_path + '/reaction_' + str(reaction_id) + '.html'
+        if source_mtime is not None and is_up_to_date(path, source_mtime):
+            continue
+        transitions = TransitionIndex()
+        for source, target in builder.transitions.reaction_edges(reaction_id):
+            transitions.add(source, target, reaction_id)
+        jobs.append((nx.Graph(reaction_subgraph(builder, reaction_id)), transitions, path))
+    LOGGER.info("Draw %d reactions with %d workers", len(jobs), workers)
+    _run(_draw_graph_job, jobs, workers)
+    return len(jobs)
+
+
+def draw_network(builder, outputhtml, max_nodes=2000, around=(), radius=2, source_mtime=None):
+    """
+    Draws the full ATN, or the neighbourhood of the compounds `around`, to
+    `outputhtml`. Nothing is drawn if the graph has more than `max_nodes`
+    nodes, such drawings cannot be used in a browser.
+
+    Returns
+    -------
+    bool
+        Whether the drawing was written.
+    """
+    if source_mtime is not None and is_up_to_date(outputhtml, source_mtime):
+        return False
+    graph = builder.ATN
+    if around:
+        graph = neighbourhood(graph, (n for name in around for n in builder.compound_to_subgraph[name]), radius)
+    if graph.number_of_nodes() > max_nodes:
+        LOGGER.warning("Not drawing %s, %d nodes are more than %d", outputhtml, graph.number_of_nodes(), max_nodes)
+        return False
+    draw_full_ATN(graph, builder.transitions, outputhtml)
+    return True
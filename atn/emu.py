@@ -0,0 +1,326 @@
+"""
+Elementary metabolite unit (EMU) decomposition of a directed ATN.
+
+An EMU is a subset of the atoms of one compound. Starting from the measured
+EMUs, every reaction producing a compound is traced back along its reaction
+edges: the atoms of an EMU come from one precursor EMU, or from several that
+are combined (a convolution of their mass distributions). Precursors are
+decomposed in turn until substrates or compounds without producing reaction
+are reached, so only the EMUs a measurement depends on are generated.
+
+Symmetric compounds are scrambled: an EMU and its images under the
+automorphisms of its compound are the same EMU, and each image contributes an
+equal share of the producing reactions. Single atoms are mapped along the
+symmetry edges; larger EMUs need the generators of the automorphism group
+stored with the symmetric atoms (the 'automorphisms' node attribute written
+by `04_generate_ATN_directed.py`).
+
+All molecules of a compound share its atoms in the ATN, so a reaction using
+a compound twice (e.g. ``pyruvate + pyruvate``) does not tell which molecule
+an atom comes from. Single atoms are still traced, one EMU reaction per
+molecule of the product. EMUs that would combine atoms of several molecules
+raise a ValueError; such reactions can be excluded explicitly.
+"""
+
+from collections import namedtuple, deque
+
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse import csr_matrix
+
+from .reachability import atom_order, directed_arrays, read_directed_arrays
+from .types import TransitionType
+
+EMU_TRANSITIONS = (TransitionType.REACTION.value, TransitionType.SYMMETRY.value)
+
+EMU = namedtuple('EMU', ['compound', 'atoms'])
+EMU.__doc__ = """
+An elementary metabolite unit, a compound name and a sorted tuple of atoms.
+"""
+
+EMUReaction = namedtuple('EMUReaction', ['reaction_id', 'product', 'precursors', 'weight', 'unmapped'])
+EMUReaction.__doc__ = """
+One way of forming EMU `product` (an index into the EMUs) by reaction
+`reaction_id`: the convolution of the EMUs `precursors`, with a share
+`weight` of the reaction flux. `unmapped` atoms of the product have no
+labelled origin in the reaction and are always unlabelled.
+"""
+
+
+class EMUNetwork:
+    """
+    The EMU reaction network needed to simulate measured EMUs.
+
+    Parameters
+    ----------
+    arrays : atn.reachability.DirectedArrays
+        The reaction and symmetry edges of a directed ATN with their reaction
+        ids. Use :meth:`from_graph` and :meth:`from_file` to get them from an
+        ATN.
+    substrates : collections.abc.Iterable[str]
+        Compounds whose EMUs are inputs and are not decomposed further.
+    max_emus : int
+        Upper bound of the number of EMUs. Decomposition stops with a
+        ValueError if more are needed.
+    excluded_reactions : collections.abc.Iterable[int]
+        Reactions that form no EMUs, e.g. reactions using a compound twice
+        whose EMUs can not be traced.
+
+    Attributes
+    ----------
+    emus : list[EMU]
+        The EMUs, indices in :class:`EMUReaction` refer to this list.
+    reactions : list[EMUReaction]
+        The EMU reactions.
+    inputs : list[int]
+        The EMUs that are not formed by any EMU reaction.
+    """
+
+    def __init__(self, arrays, substrates=(), max_emus=100000, excluded_reactions=()):
+        self.nodes = list(arrays.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.compounds = list(arrays.compounds)
+        self.elements = list(arrays.elements)
+        self.substrates = set(substrates)
+        self.max_emus = max_emus
+        self.excluded_reactions = set(excluded_reactions)
+
+        n_nodes = len(self.nodes)
+        sources = np.repeat(np.arange(n_nodes), np.diff(arrays.indptr)).tolist()
+        targets = np.asarray(arrays.indices).tolist()
+
+        # origin[atom][reaction] are the atoms it receives label from, one per
+        # molecule of its compound formed by the reaction
+        self._origin = [{} for _ in range(n_nodes)]
+        # compounds of which a reaction uses several molecules: one of their
+        # atoms passes label to several atoms
+        self._repeated = {}
+        passed = set()
+        symmetric = []
+        for u, v, transition, reaction_ids in zip(sources, targets, arrays.transitions, arrays.reaction_ids):
+            if transition == TransitionType.SYMMETRY.value:
+                symmetric.append((u, v))
+            elif transition == TransitionType.REACTION.value:
+                for rid in reaction_ids:
+                    self._origin[v].setdefault(rid, []).append(u)
+                    if (u, rid) in passed:
+                        self._repeated.setdefault(rid, set()).add(self.compounds[u])
+                    passed.add((u, rid))
+        for origins in self._origin:
+            for rid in origins:
+                origins[rid].sort()
+
+        # symmetry orbits of single atoms, and the images of symmetric atoms
+        # under the generators of their compound's automorphism group
+        pairs = np.array(symmetric, dtype=np.int64).reshape(-1, 2)
+        graph = csr_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n_nodes, n_nodes))
+        _, labels = connected_components(graph, directed=False)
+        orbits = {}
+        for node, label in enumerate(labels.tolist()):
+            orbits.setdefault(label, []).append(node)
+        self._orbit = {node: orbit for orbit in orbits.values() if len(orbit) > 1 for node in orbit}
+        self._generators = {node: tuple(self.node_index[image] for image in images.split(','))
+                            for node, images in enumerate(arrays.automorphisms or ()) if images}
+
+        self.emus = []
+        self.reactions = []
+        self.inputs = []
+        self._emu_index = {}
+
+    @classmethod
+    def from_graph(cls, ATN, substrates=(), max_emus=100000, excluded_reactions=()):
+        """
+        Builds an empty EMU network of a directed ATN graph.
+        """
+        return cls(directed_arrays(ATN, EMU_TRANSITIONS), substrates, max_emus, excluded_reactions)
+
+    @classmethod
+    def from_file(cls, path, substrates=(), max_emus=100000, excluded_reactions=()):
+        """
+        Builds an empty EMU network of a directed ATN file, a GML file or a
+        ``.npz`` bundle.
+        """
+        return cls(read_directed_arrays(path, EMU_TRANSITIONS), substrates, max_emus, excluded_reactions)
+
+    def __len__(self):
+        return len(self.emus)
+
+    def compound_atoms(self, compound, element=None):
+        """
+        Returns the atoms of `compound` in SMILES order, only those of
+        `element` if given.
+        """
+        atoms = [node for node, name, atom_element in zip(self.nodes, self.compounds, self.elements)
+                 if name == compound and (element is None or atom_element == element)]
+        if not atoms:
+            raise KeyError('No atoms of compound {}'.format(compound))
+        return sorted(atoms, key=atom_order)
+
+    def _images(self, atoms):
+        """
+        Returns `atoms` and its distinct symmetric images, sorted. A single
+        atom is equivalent to every atom of its orbit; larger EMUs are mapped
+        by the automorphisms of their compound.
+        """
+        if len(atoms) == 1:
+            return [(atom,) for atom in sorted(self._orbit.get(atoms[0], atoms))]
+        symmetric = [atom for atom in atoms if atom in self._orbit]
+        if not symmetric:
+            return [atoms]
+        if any(atom not in self._generators for atom in symmetric):
+            raise ValueError('The ATN has no automorphisms of {}, its EMU {} can not be scrambled; '
+                             'generate the ATN again'.format(self.compounds[atoms[0]],
+                                                             ','.join(self.nodes[atom] for atom in atoms)))
+        n_generators = len(self._generators[symmetric[0]])
+        images = {atoms}
+        to_visit = [atoms]
+        while to_visit:
+            current = to_visit.pop()
+            for generator in range(n_generators):
+                image = tuple(sorted(self._generators[atom][generator] if atom in self._generators else atom
+                                     for atom in current))
+                if image not in images:
+                    images.add(image)
+                    to_visit.append(image)
+        return sorted(images)
+
+    def images(self, index):
+        """
+        Returns the atoms of EMU `index` and of its symmetric images, which
+        the EMU stands for.
+        """
+        return [tuple(self.nodes[atom] for atom in image)
+                for image in self._images(tuple(self.node_index[node] for node in self.emus[index].atoms))]
+
+    def _emu(self, atoms, queue):
+        key = self._images(atoms)[0]
+        index = self._emu_index.get(key)
+        if index is None:
+            if len(self.emus) >= self.max_emus:
+                raise ValueError('The EMU network needs more than {} EMUs'.format(self.max_emus))
+            index = self._emu_index[key] = len(self.emus)
+            self.emus.append(EMU(self.compounds[key[0]], tuple(self.nodes[atom] for atom in key)))
+            queue.append(index)
+        return index
+
+    def _ambiguous(self, rid, compound, atoms):
+        return ValueError('Reaction {} uses {} more than once, the ATN does not tell from which of its '
+                          'molecules the atoms {} come; exclude the reaction'.format(
+                              rid, compound, ','.join(self.nodes[atom] for atom in atoms)))
+
+    def _precursors(self, atoms, rid):
+        """
+        Returns the ways reaction `rid` forms `atoms`, one per molecule of
+        the product: the precursor atom groups and the number of atoms
+        without labelled origin.
+        """
+        origins = [[source for source in self._origin[atom].get(rid, ()) if self.compounds[source] is not None]
+                   for atom in atoms]
+        if any(len(sources) > 1 for sources in origins):
+            # the molecules of the product can only be told apart for a
+            # single atom
+            if len(atoms) > 1:
+                raise self._ambiguous(rid, self.compounds[atoms[0]], atoms)
+            return [([(source,)], 0) for source in origins[0]]
+
+        groups = []
+        unmapped = 0
+        for sources in origins:
+            if not sources:
+                unmapped += 1
+                continue
+            source = sources[0]
+            # two atoms from the same compound come from two molecules of it
+            # if they share an origin
+            for group in groups:
+                if self.compounds[group[0]] == self.compounds[source] and source not in group:
+                    group.append(source)
+                    break
+            else:
+                groups.append([source])
+        repeated = self._repeated.get(rid, ())
+        for group in groups:
+            if len(group) > 1 and self.compounds[group[0]] in repeated:
+                raise self._ambiguous(rid, self.compounds[group[0]], group)
+        return [([tuple(sorted(group)) for group in groups], unmapped)]
+
+    def _decompose(self, index, queue):
+        atoms = tuple(self.node_index[node] for node in self.emus[index].atoms)
+        if self.emus[index].compound in self.substrates:
+            self.inputs.append(index)
+            return
+        images = self._images(atoms)
+        formed = False
+        for image in images:
+            for rid in sorted({rid for atom in image for rid in self._origin[atom]} - self.excluded_reactions):
+                for groups, unmapped in self._precursors(image, rid):
+                    if not groups:
+                        continue
+                    precursors = tuple(self._emu(group, queue) for group in groups)
+                    self.reactions.append(EMUReaction(rid, index, precursors, 1.0 / len(images), unmapped))
+                    formed = True
+        if not formed:
+            self.inputs.append(index)
+
+    def add(self, atoms):
+        """
+        Adds the EMU of `atoms` together with all EMUs it depends on. Already
+        known EMUs are not decomposed again.
+
+        Parameters
+        ----------
+        atoms : collections.abc.Iterable[str]
+            Atoms of a single compound.
+
+        Returns
+        -------
+        int
+            The index of the EMU.
+        """
+        atoms = tuple(sorted({self.node_index[atom] for atom in atoms}))
+        if not atoms:
+            raise ValueError('An EMU needs at least one atom')
+        if len({self.compounds[atom] for atom in atoms}) != 1 or self.compounds[atoms[0]] is None:
+            raise ValueError('The atoms of an EMU must belong to one compound')
+        queue = deque()
+        index = self._emu(atoms, queue)
+        while queue:
+            self._decompose(queue.popleft(), queue)
+        return index
+
+    def sizes(self):
+        """
+        Returns the number of atoms of every EMU.
+        """
+        return np.array([len(emu.atoms) for emu in self.emus], dtype=np.int64)
+
+    def save(self, path):
+        """
+        Writes the EMU network as ``.npz`` file.
+
+        The EMUs are given by ``emu_compound`` (indices into
+        ``compound_names``) and the ragged ``emu_atoms`` / ``emu_offsets``
+        (indices into ``node_id``). EMU reactions are given by
+        ``reaction_id``, ``product``, ``weight``, ``unmapped`` and the ragged
+        ``precursors`` / ``precursor_offsets`` (EMU indices). ``inputs``
+        lists the input EMUs.
+        """
+        names = sorted({emu.compound for emu in self.emus})
+        codes = {name: i for i, name in enumerate(names)}
+        atoms = [self.node_index[atom] for emu in self.emus for atom in emu.atoms]
+        precursors = [precursor for reaction in self.reactions for precursor in reaction.precursors]
+        with open(path, 'wb') as emu_file:
+            np.savez_compressed(emu_file,
+                                node_id=np.array(self.nodes, dtype=str),
+                                compound_names=np.array(names, dtype=str),
+                                emu_compound=np.array([codes[emu.compound] for emu in self.emus], dtype=np.int64),
+                                emu_atoms=np.array(atoms, dtype=np.int64),
+                                emu_offsets=np.concatenate([[0], np.cumsum(self.sizes())]).astype(np.int64),
+                                reaction_id=np.array([r.reaction_id for r in self.reactions], dtype=np.int64),
+                                product=np.array([r.product for r in self.reactions], dtype=np.int64),
+                                weight=np.array([r.weight for r in self.reactions], dtype=np.float64),
+                                unmapped=np.array([r.unmapped for r in self.reactions], dtype=np.int64),
+                                precursors=np.array(precursors, dtype=np.int64),
+                                precursor_offsets=np.concatenate(
+                                    [[0], np.cumsum([len(r.precursors) for r in self.reactions])]).astype(np.int64),
+                                inputs=np.array(self.inputs, dtype=np.int64))
@@ -0,0 +1,299 @@
+"""
+Writers for the ATN outputs of the generation scripts.
+
+The ATN is exported as a stream of node and edge records, built while walking
+the undirected ATN once. Both the GML writer and the binary bundle consume
+these records, so no second graph is built for the export.
+"""
+
+import re
+import enum
+
+import networkx as nx
+
+from .bundle import write_bundle
+from .types import TransitionType, DirectionType
+
+
+def write_compound_key(compoundId_to_compound, outputgml):
+    """
+    Writes the compound key next to a GML file, as `outputgml` + '.ckey'.
+    Every line holds compound id, name and SMILES, separated by tabs.
+    """
+    with open(outputgml+".ckey", 'w') as og:
+        for key in sorted(compoundId_to_compound):
+            print(key, compoundId_to_compound[key][0], compoundId_to_compound[key][1] ,sep='\t', file=og)
+
+
+# GML WRITER
+
+_GML_ESCAPE = re.compile('[^ -~]|[&"]')
+
+
+def _gml_value(value):
+    """
+    Formats an attribute value the way `nx.write_gml` does. Sequences of
+    reaction ids become comma separated strings.
+    """
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        if -2**31 <= value < 2**31:
+            return str(value)
+        return '"' + str(value) + '"'
+    if isinstance(value, float):
+        text = repr(value).upper()
+        if text == 'INF':
+            return '+INF'
+        epos = text.rfind('E')
+        if epos != -1 and text.find('.', 0, epos) == -1:
+            text = text[:epos] + '.' + text[epos:]
+        return text
+    if not isinstance(value, str):
+        value = ','.join(map(str, value))
+    return '"' + _GML_ESCAPE.sub(lambda m: '&#' + str(ord(m.group(0))) + ';', value) + '"'
+
+
+def write_gml_records(path, nodes, edges, directed):
+    """
+    Writes node and edge records as GML, readable with `nx.read_gml`.
+
+    Parameters
+    ----------
+    path : str
+        The GML file to write.
+    nodes : collections.abc.Iterable[tuple(str, dict)]
+        Node labels with their attributes.
+    edges : collections.abc.Iterable[tuple(str, str, dict)]
+        Edges with their attributes. Edges may only refer to nodes listed
+        before.
+    directed : bool
+        Whether `edges` are directed.
+    """
+    node_ids = {}
+    with open(path, 'w', encoding='ascii') as gml:
+        gml.write('graph [\n')
+        if directed:
+            gml.write('  directed 1\n')
+        for node, attrs in nodes:
+            node_ids[node] = len(node_ids)
+            gml.write('  node [\n    id %d\n    label %s\n' % (node_ids[node], _gml_value(str(node))))
+            for key, value in attrs.items():
+                if key != 'id' and key != 'label':
+                    gml.write('    %s %s\n' % (key, _gml_value(value)))
+            gml.write('  ]\n')
+        for source, target, attrs in edges:
+            gml.write('  edge [\n    source %d\n    target %d\n' % (node_ids[source], node_ids[target]))
+            for key, value in attrs.items():
+                if key != 'source' and key != 'target':
+                    gml.write('    %s %s\n' % (key, _gml_value(value)))
+            gml.write('  ]\n')
+        gml.write(']\n')
+
+
+# UNDIRECTED ATN
+
+def undirected_records(ATN, transitions):
+    """
+    Returns node and edge records of the undirected ATN. Transition edges
+    carry all their reactions as 'reaction_id', a list of int.
+    """
+    nodes = iter(ATN.nodes(data=True))
+    edges = ((u, v, dict(attrs, reaction_id=transitions.edge_reactions(u, v)) if (u, v) in transitions else attrs)
+             for u, v, attrs in ATN.edges(data=True))
+    return nodes, edges
+
+
+def write_undirected_gml(ATN, transitions, outputgml):
+    """
+    Writes the undirected ATN, transition edges carry all their reactions as
+    comma separated 'reaction_id'.
+    """
+    nodes, edges = undirected_records(ATN, transitions)
+    write_gml_records(outputgml, nodes, edges, directed=False)
+
+
+def write_undirected_bundle(ATN, transitions, compoundId_to_compound, outputnpz):
+    """
+    Writes the undirected ATN and its compound key as binary bundle, see
+    :mod:`atn.bundle`.
+    """
+    nodes, edges = undirected_records(ATN, transitions)
+    write_bundle(outputnpz, nodes, edges, compoundId_to_compound, directed=False)
+
+
+# DIRECTED ATN
+
+# bond orders are not part of the directed ATN, not even on symmetry edges
+_EDGE_META = ('compound_id', 'compound_name', 'moving_atom')
+
+
+def _directed_node(attrs):
+    node = {key: value for key, value in attrs.items() if key != 'class'}
+    node.setdefault('element', "*")
+    return node
+
+
+def _directed_edge(attrs, reactions):
+    edge = {'transition': attrs['transition'].value}
+    for key in _EDGE_META:
+        if key in attrs:
+            edge[key] = attrs[key]
+    if reactions:
+        edge['reaction_ids'] = reactions
+    return edge
+
+
+def _directed_edges(ATN, transitions, filter_bonds):
+    for u, v, attrs in ATN.edges(data=True):
+        if filter_bonds and attrs['transition'] == TransitionType.NO_TRANSITION:
+            continue
+
+        # transition edges point the way their reactions move atoms, so that
+        # restricted indices (see atn.samples) give the right directions
+        forward = transitions.reactions(u, v)
+        backward = transitions.reactions(v, u)
+        if forward or backward:
+            if forward:
+                yield u, v, _directed_edge(attrs, forward)
+            if backward:
+                yield v, u, _directed_edge(attrs, backward)
+        elif attrs['directed'] == DirectionType.BIDIRECTED or attrs['directed'] == DirectionType.UNDIRECTED:
+            yield u, v, _directed_edge(attrs, forward)
+            yield v, u, _directed_edge(attrs, backward)
+
+
+def directed_records(ATN, transitions, filter_bonds=True):
+    """
+    Returns node and edge records of the directed ATN: directed transitions
+    give one edge, bidirected and undirected ones an edge per direction.
+    Edges carry the reactions inducing them in that direction as
+    'reaction_ids', a sequence of int. Chemical bonds are left out if
+    `filter_bonds` is set.
+    """
+    nodes = ((n, _directed_node(attrs)) for n, attrs in ATN.nodes(data=True))
+    return nodes, _directed_edges(ATN, transitions, filter_bonds)
+
+
+def bfs_ready_transform(ATN, transitions, filter_bonds=True):
+    """
+    Returns the directed ATN as `nx.DiGraph`, with 'reaction_ids' formatted as
+    in the GML output. The writers stream :func:`directed_records` instead.
+    """
+    nodes, edges = directed_records(ATN, transitions, filter_bonds)
+    DATN = nx.DiGraph()
+    DATN.add_nodes_from(nodes)
+    for s, t, attrs in edges:
+        if 'reaction_ids' in attrs:
+            attrs['reaction_ids'] = transitions.format(s, t)
+        DATN.add_edge(s, t, **attrs)
+    return DATN
+
+
+def symmetry_orbits(ATN):
+    """
+    Returns the symmetry orbits of `ATN`: for every atom joined to others by
+    symmetry edges the representative of its orbit, the orbit atom first in
+    node order.
+    """
+    symmetric = nx.Graph()
+    symmetric.add_edges_from((u, v) for u, v, transition in ATN.edges(data='transition')
+                             if transition == TransitionType.SYMMETRY)
+    order = {node: i for i, node in enumerate(ATN)}
+    representative = {}
+    for orbit in nx.connected_components(symmetric):
+        first = min(orbit, key=order.__getitem__)
+        for node in orbit:
+            representative[node] = first
+    return representative
+
+
+def quotient_records(ATN, transitions, filter_bonds=True):
+    """
+    Returns node and edge records of the symmetry quotient of the directed
+    ATN: every symmetry orbit becomes its first atom, with the attribute
+    'multiplicity' and the orbit's atoms as comma separated 'atoms'.
+    Symmetry edges disappear, transition edges between the same orbits are
+    merged and carry the union of their 'reaction_ids'.
+
+    Orbit atoms reach each other by symmetry edges, so label reaches an atom
+    in the directed ATN exactly if it reaches its orbit in the quotient.
+    """
+    representative = symmetry_orbits(ATN)
+    members = {}
+    for node in ATN:
+        members.setdefault(representative.get(node, node), []).append(node)
+
+    def nodes():
+        for node, attrs in ATN.nodes(data=True):
+            if node in members:
+                quotient = _directed_node(attrs)
+                quotient['multiplicity'] = len(members[node])
+                if len(members[node]) > 1:
+                    quotient['atoms'] = ','.join(map(str, members[node]))
+                yield node, quotient
+
+    merged = {}
+    for u, v, attrs in _directed_edges(ATN, transitions, filter_bonds):
+        if attrs['transition'] == TransitionType.SYMMETRY.value:
+            continue
+        u, v = representative.get(u, u), representative.get(v, v)
+        if u == v:
+            continue
+        edge = merged.get((u, v))
+        if edge is None:
+            merged[u, v] = dict(attrs)
+        elif 'reaction_ids' in attrs:
+            edge['reaction_ids'] = sorted(set(edge.get('reaction_ids', ())) | set(attrs['reaction_ids']))
+    return nodes(), ((u, v, attrs) for (u, v), attrs in merged.items())
+
+
+def write_directed_gml(ATN, transitions, outputgml):
+    """
+    Writes the directed ATN without chemical bonds, transition edges carry
+    the reactions inducing them in that direction as 'reaction_ids'.
+    """
+    nodes, edges = directed_records(ATN, transitions)
+    write_gml_records(outputgml, nodes, edges, directed=True)
+
+
+def write_directed_bundle(ATN, transitions, compoundId_to_compound, outputnpz):
+    """
+    Writes the directed ATN without chemical bonds and its compound key as
+    binary bundle, see :mod:`atn.bundle`.
+    """
+    nodes, edges = directed_records(ATN, transitions)
+    write_bundle(outputnpz, nodes, edges, compoundId_to_compound, directed=True)
+
+
+def write_quotient_atn(ATN, transitions, compoundId_to_compound, output):
+    """
+    Writes the symmetry quotient of the directed ATN (see
+    :func:`quotient_records`) like :func:`write_atn`.
+    """
+    nodes, edges = quotient_records(ATN, transitions)
+    if output.endswith('.npz'):
+        write_bundle(output, nodes, edges, compoundId_to_compound, directed=True)
+        return
+    write_gml_records(output, nodes, edges, directed=True)
+    write_compound_key(compoundId_to_compound, output)
+
+
+def write_atn(ATN, transitions, compoundId_to_compound, output, directed):
+    """
+    Writes the ATN to `output`, as binary bundle if the name ends with
+    '.npz', otherwise as GML with the compound key next to it.
+    """
+    if output.endswith('.npz'):
+        if directed:
+            write_directed_bundle(ATN, transitions, compoundId_to_compound, output)
+        else:
+            write_undirected_bundle(ATN, transitions, compoundId_to_compound, output)
+        return
+    if directed:
+        write_directed_gml(ATN, transitions, output)
+    else:
+        write_undirected_gml(ATN, transitions, output)
+    write_compound_key(compoundId_to_compound, output)
@@ -0,0 +1,216 @@
+"""
+Persistent library of prepared compound structures, shared between ATN
+builds.
+
+Finding the automorphisms of a compound is the most expensive part of
+building its template. The library stores them per canonical structure, as
+permutations of canonical atom ranks (see
+:func:`custom_pysmiles.write_smiles.canonical_ranks`), so that a compound is
+only searched once over all models built with the same library.
+
+The library is an SQLite database, opened on first use. Entries are read
+one at a time when a compound is built. It records its format and the
+``custom_pysmiles`` version, the canonical ranking depends on it. A library
+written by another version is emptied when opened.
+"""
+
+import hashlib
+import logging
+import pickle
+import sqlite3
+import time
+
+import custom_pysmiles
+from custom_pysmiles.write_smiles import canonical_ranks
+
+from .build import automorphisms
+
+LOGGER = logging.getLogger(__name__)
+
+# version of the entry format, bump on incompatible changes
+LIBRARY_VERSION = 2
+
+# the attributes compounds are matched on, see atn.build.findIsomorphATNStructure
+_MATCHED = (('element', ''), ('isotope', 0), ('hcount', 0), ('charge', 0))
+
+
+def canonical_structure(mol):
+    """
+    Returns the key of the canonical structure of `mol` and its atoms in
+    canonical order. Map classes are ignored.
+
+    The key is a digest of the atoms, with the attributes compounds are
+    matched on, and the bonds of `mol` relabelled by canonical rank. Equal
+    keys therefore mean equal relabelled graphs, and automorphisms stored
+    in ranks apply to every compound with the key.
+
+    Parameters
+    ----------
+    mol : nx.Graph
+        The heavy atom graph of a compound, as given by
+        :func:`atn.build.parseXDuct`.
+
+    Returns
+    -------
+    tuple(str, list)
+    """
+    plain = mol.copy()
+    for node in plain.nodes:
+        plain.nodes[node].pop('class', None)
+    ranks = canonical_ranks(plain)
+    by_rank = sorted(mol, key=ranks.get)
+    atoms = ['/'.join(str(mol.nodes[node].get(name, default)) for name, default in _MATCHED)
+             for node in by_rank]
+    bonds = sorted((min(ranks[u], ranks[v]), max(ranks[u], ranks[v]), order)
+                   for u, v, order in mol.edges(data='order', default=0))
+    description = ','.join(atoms) + '|' + ','.join('{}-{}:{}'.format(*bond) for bond in bonds)
+    return hashlib.sha1(description.encode()).hexdigest(), by_rank
+
+
+class TemplateLibrary:
+    """
+    Automorphisms of compounds by canonical structure, stored in an SQLite
+    database at `path`.
+
+    Parameters
+    ----------
+    path : str
+        The database file, created if it does not exist.
+    max_entries : int
+        Number of entries kept by :meth:`evict`, the least recently used
+        are removed. All are kept if None.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups answered from the library, and not, in this
+        process.
+    """
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+
+    def __getstate__(self):
+        # sent to worker processes, which open their own connection
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                           '(structure TEXT PRIMARY KEY, data BLOB, used REAL)')
+        expected = {'library_version': str(LIBRARY_VERSION),
+                    'custom_pysmiles_version': custom_pysmiles.__version__}
+        found = dict(connection.execute('SELECT key, value FROM meta'))
+        if found != expected:
+            if found:
+                LOGGER.info("Template library %s was written by %s, dropping its entries", self.path, found)
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM entries')
+            connection.execute('DELETE FROM meta')
+            connection.executemany('INSERT INTO meta VALUES (?, ?)', expected.items())
+            connection.execute('COMMIT')
+        self._connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get(self, structure):
+        """
+        Returns the automorphisms stored for the canonical `structure`, as
+        tuples of the images of the canonical ranks. None if there are none.
+        Marks the entry as used.
+        """
+        connection = self._connect()
+        row = connection.execute('SELECT data FROM entries WHERE structure = ?', (structure,)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE entries SET used = ? WHERE structure = ?', (time.time(), structure))
+        return pickle.loads(row[0])
+
+    def put(self, structure, entry):
+        """
+        Stores the automorphisms `entry` for the canonical `structure`.
+        """
+        self._connect().execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                (structure, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL), time.time()))
+
+    def automorphisms(self, mol):
+        """
+        Returns the automorphisms of `mol`, see :func:`atn.build.automorphisms`,
+        from the library if it has them, and stores them otherwise.
+
+        Permutations are always taken from the stored form, ordered by
+        canonical rank, so a build gives the same network whether the
+        library had the compound or not.
+
+        Parameters
+        ----------
+        mol : nx.Graph
+            The heavy atom graph of a compound.
+
+        Returns
+        -------
+        list[dict]
+        """
+        structure, by_rank = canonical_structure(mol)
+        found = self.get(structure)
+        if found is None:
+            self.misses += 1
+            ranks = {node: rank for rank, node in enumerate(by_rank)}
+            found = sorted(tuple(ranks[permutation[node]] for node in by_rank) for permutation in automorphisms(mol))
+            self.put(structure, found)
+        else:
+            self.hits += 1
+        return [dict(zip(by_rank, (by_rank[rank] for rank in images))) for images in found]
+
+    def evict(self, max_entries=None):
+        """
+        Removes the least recently used entries, keeping `max_entries`, or
+        the `max_entries` of the library if None.
+
+        Returns
+        -------
+        int
+            The number of removed entries.
+        """
+        max_entries = self.max_entries if max_entries is None else max_entries
+        if max_entries is None:
+            return 0
+        cursor = self._connect().execute(
+            'DELETE FROM entries WHERE structure NOT IN '
+            '(SELECT structure FROM entries ORDER BY used DESC LIMIT ?)', (max_entries,))
+        return cursor.rowcount
+
+    def compact(self):
+        """
+        Releases the space of removed entries.
+        """
+        connection = self._connect()
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.execute('VACUUM')
+
+    def close(self):
+        """
+        Evicts entries beyond `max_entries`, compacts the database if any
+        were evicted, and closes it.
+        """
+        if self._connection is None:
+            return
+        removed = self.evict()
+        if removed:
+            LOGGER.info("Evicted %d entries from template library %s", removed, self.path)
+            self.compact()
+        self._connection.close()
+        self._connection = None
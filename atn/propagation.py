@@ -0,0 +1,159 @@
+"""
+Label propagation of many tracers at once on the directed ATN.
+
+The reaction and symmetry edges are turned into a sparse transition matrix
+once. A batch of tracers is an atoms x tracers block whose newly labelled
+entries are multiplied with the matrix until no new atom gets labelled, so
+all tracers share every sparse product.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .reachability import atom_order, directed_arrays, read_directed_arrays
+from .types import TransitionType
+
+LABEL_TRANSITIONS = (TransitionType.REACTION.value, TransitionType.SYMMETRY.value)
+
+
+class LabelPropagator:
+    """
+    Propagates tracer labels along the edges of a directed ATN.
+
+    Parameters
+    ----------
+    arrays : atn.reachability.DirectedArrays
+        The edges to propagate along, usually only reaction and symmetry
+        edges. Use :meth:`from_graph` and :meth:`from_file` to get them from
+        an ATN.
+
+    Attributes
+    ----------
+    nodes : list[str]
+        The atoms, rows of all label matrices follow this order.
+    compound_names : list[str]
+        The compounds, rows of :meth:`compound_labels` follow this order.
+    matrix : scipy.sparse.csr_matrix
+        The transition matrix, ``matrix[v, u]`` is 1 if label moves from atom
+        `u` to atom `v`.
+    """
+
+    def __init__(self, arrays):
+        self.nodes = list(arrays.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        n_nodes = len(self.nodes)
+        self.elements = list(arrays.elements)
+
+        self.compound_names = sorted({name for name in arrays.compounds if name is not None})
+        self._compound_codes = {name: i for i, name in enumerate(self.compound_names)}
+        self.node_compound = np.array([self._compound_codes.get(name, -1) for name in arrays.compounds],
+                                      dtype=np.int64)
+
+        indptr = np.asarray(arrays.indptr, dtype=np.int64)
+        sources = np.repeat(np.arange(n_nodes), np.diff(indptr))
+        targets = np.asarray(arrays.indices, dtype=np.int64)
+        # duplicates are summed, only whether an entry is non-zero matters
+        self.matrix = csr_matrix((np.ones(len(targets), dtype=np.int32), (targets, sources)),
+                                 shape=(n_nodes, n_nodes))
+
+        in_compound = self.node_compound >= 0
+        self._incidence = csr_matrix((np.ones(in_compound.sum(), dtype=np.int32),
+                                      (self.node_compound[in_compound], np.flatnonzero(in_compound))),
+                                     shape=(len(self.compound_names), n_nodes))
+
+    @classmethod
+    def from_graph(cls, ATN, transitions=LABEL_TRANSITIONS):
+        """
+        Builds the propagator of a directed ATN graph, following the edges
+        whose 'transition' is in `transitions`.
+        """
+        return cls(directed_arrays(ATN, transitions))
+
+    @classmethod
+    def from_file(cls, path, transitions=LABEL_TRANSITIONS):
+        """
+        Builds the propagator of a directed ATN file, a GML file or a
+        ``.npz`` bundle, following the edges whose 'transition' is in
+        `transitions`.
+        """
+        return cls(read_directed_arrays(path, transitions))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def compound_atoms(self, compound, element=None):
+        """
+        Returns the atoms of `compound` in SMILES order, only those of
+        `element` if given. ``compound_atoms('glucose', 'C')`` are the atoms
+        labelled by U-13C glucose.
+        """
+        if compound not in self._compound_codes:
+            raise KeyError('Unknown compound {}'.format(compound))
+        atoms = [self.nodes[i] for i in np.flatnonzero(self.node_compound == self._compound_codes[compound])
+                 if element is None or self.elements[i] == element]
+        return sorted(atoms, key=atom_order)
+
+    def tracer_matrix(self, tracers):
+        """
+        Returns the initial label matrix of `tracers`.
+
+        Parameters
+        ----------
+        tracers : collections.abc.Sequence[collections.abc.Iterable[str]]
+            The labelled atoms of every tracer.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean atoms x tracers matrix.
+        """
+        labels = np.zeros((len(self.nodes), len(tracers)), dtype=bool)
+        for column, atoms in enumerate(tracers):
+            labels[[self.node_index[atom] for atom in atoms], column] = True
+        return labels
+
+    def propagate(self, tracers, steps=None):
+        """
+        Propagates all `tracers` at once.
+
+        Parameters
+        ----------
+        tracers : collections.abc.Sequence[collections.abc.Iterable[str]] or np.ndarray
+            The labelled atoms of every tracer, or an initial label matrix as
+            returned by :meth:`tracer_matrix`.
+        steps : int
+            Maximal number of transitions label moves along. If None, label
+            is propagated until no further atom gets labelled.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean atoms x tracers matrix of the atoms that can carry label
+            of each tracer.
+        """
+        labels = tracers if isinstance(tracers, np.ndarray) else self.tracer_matrix(tracers)
+        labels = labels.astype(bool)
+        # only atoms labelled in the last step can label new ones; the
+        # frontier is a thin slice of the block, so it is kept sparse
+        frontier = csr_matrix(labels, dtype=np.int32)
+        step = 0
+        while frontier.nnz and (steps is None or step < steps):
+            reached = (self.matrix @ frontier).tocoo()
+            new = ~labels[reached.row, reached.col]
+            rows, columns = reached.row[new], reached.col[new]
+            labels[rows, columns] = True
+            frontier = csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=labels.shape)
+            step += 1
+        return labels
+
+    def compound_labels(self, labels):
+        """
+        Aggregates a label matrix of :meth:`propagate` per compound.
+
+        Returns
+        -------
+        np.ndarray
+            Compounds x tracers matrix with the number of labelled atoms,
+            rows follow `compound_names`.
+        """
+        return self._incidence @ labels.astype(np.int32)
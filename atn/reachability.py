@@ -0,0 +1,284 @@
+"""
+Indexed reachability queries on the directed ATN written by
+`04_generate_ATN_directed.py`: which atoms can receive label from an atom,
+and which compounds from a compound.
+
+The strongly connected components of the ATN are condensed into a DAG. Every
+component stores the components it reaches as bitset (a Python int), filled
+in reverse topological order, so a query is a bit test or a walk over the
+set bits of one integer.
+"""
+
+from collections import deque, namedtuple
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .bundle import read_bundle_arrays
+
+
+def _bits(value):
+    """
+    Returns the positions of the set bits of a non-negative int.
+    """
+    if not value:
+        return np.array([], dtype=np.int64)
+    raw = np.frombuffer(value.to_bytes((value.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little'))
+
+
+def atom_order(node):
+    """
+    Sort key of ATN nodes ('<compound id>_<atom index>') by atom index, the
+    SMILES order of a compound's atoms.
+    """
+    _, _, local = str(node).rpartition('_')
+    return int(local) if local.isdigit() else -1
+
+
+DirectedArrays = namedtuple('DirectedArrays', ['nodes', 'indptr', 'indices', 'compounds', 'elements',
+                                               'transitions', 'reaction_ids', 'automorphisms'],
+                            defaults=(None,))
+DirectedArrays.__doc__ = """
+The edges of a directed ATN in CSR form, `indices` into the list `nodes`, with
+the compound name and element of every node (None where missing) and the
+'transition' and reaction ids (a tuple of int) of every edge. `automorphisms`
+holds the 'automorphisms' attribute of every node, the images of a
+symmetric atom under generators of its compound's automorphism group.
+"""
+
+
+def _reaction_ids(value):
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return tuple(int(rid) for rid in value.split(',') if rid)
+    if isinstance(value, int):
+        return (value,)
+    return tuple(int(rid) for rid in value)
+
+
+def directed_arrays(ATN, transitions=None):
+    """
+    Returns the edges of a directed ATN graph, e.g. read with `nx.read_gml` or
+    :func:`atn.bundle.read_bundle`, as :class:`DirectedArrays`.
+
+    Parameters
+    ----------
+    ATN : nx.DiGraph
+        The directed ATN.
+    transitions : collections.abc.Container[str]
+        Values of the 'transition' edge attribute to keep, e.g.
+        ``{'Reaction'}`` to leave out symmetries. Defaults to all edges.
+    """
+    nodes = list(ATN)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    indptr = [0]
+    indices = []
+    edge_transitions = []
+    reaction_ids = []
+    for node in nodes:
+        for target, attrs in ATN.adj[node].items():
+            if transitions is None or attrs.get('transition') in transitions:
+                indices.append(node_index[target])
+                edge_transitions.append(attrs.get('transition'))
+                reaction_ids.append(_reaction_ids(attrs.get('reaction_ids')))
+        indptr.append(len(indices))
+    return DirectedArrays(nodes, np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64),
+                          [ATN.nodes[node].get('compound_name') for node in nodes],
+                          [ATN.nodes[node].get('element') for node in nodes],
+                          edge_transitions, reaction_ids,
+                          [ATN.nodes[node].get('automorphisms') for node in nodes])
+
+
+def _node_column(arrays, name):
+    column = arrays.node_attrs.get(name)
+    if column is None:
+        return [None] * len(arrays.nodes)
+    # np.ma.filled treats None as the default fill value, mask explicitly
+    return [None if missing else value
+            for value, missing in zip(column.data.tolist(), np.ma.getmaskarray(column))]
+
+
+def read_directed_arrays(path, transitions=None):
+    """
+    Reads a directed ATN file, a GML file or a ``.npz`` bundle, as
+    :class:`DirectedArrays`, see :func:`directed_arrays`. Bundles are used
+    without building a graph.
+    """
+    if not path.endswith('.npz'):
+        return directed_arrays(nx.read_gml(path), transitions)
+    arrays = read_bundle_arrays(path)
+    if not arrays.directed:
+        raise ValueError('{} holds an undirected ATN'.format(path))
+    indptr, indices = arrays.indptr, arrays.indices
+    edge_transitions = np.ma.filled(arrays.edge_attrs['transition'].astype(object), None)
+    if 'reaction_ids' in arrays.edge_attrs:
+        offsets, values = arrays.edge_attrs['reaction_ids']
+        values = values.tolist()
+        reaction_ids = [tuple(values[start:end]) for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    else:
+        reaction_ids = [()] * len(indices)
+    if transitions is not None:
+        keep = np.isin(edge_transitions.astype(str), list(transitions))
+        rows = np.repeat(np.arange(len(arrays.nodes)), np.diff(indptr))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=len(arrays.nodes)))])
+        indices = indices[keep]
+        edge_transitions = edge_transitions[keep]
+        reaction_ids = [rids for rids, kept in zip(reaction_ids, keep) if kept]
+    return DirectedArrays(arrays.nodes.tolist(), indptr, indices,
+                          _node_column(arrays, 'compound_name'), _node_column(arrays, 'element'),
+                          edge_transitions.tolist(), reaction_ids, _node_column(arrays, 'automorphisms'))
+
+
+class ReachabilityIndex:
+    """
+    Reachability of the atoms of a directed ATN.
+
+    Parameters
+    ----------
+    nodes : collections.abc.Sequence[str]
+        The node labels.
+    indptr, indices : np.ndarray
+        The edges in CSR form, indices into `nodes`.
+    compounds : collections.abc.Sequence[str]
+        The compound name of every node, None for nodes without compound.
+
+    Every atom reaches itself. Use :meth:`from_graph` and :meth:`from_file` to
+    build the index from an ATN.
+    """
+
+    def __init__(self, nodes, indptr, indices, compounds):
+        self.nodes = list(nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        n_nodes = len(self.nodes)
+
+        names = sorted({name for name in compounds if name is not None})
+        self.compound_names = names
+        self._compound_codes = {name: i for i, name in enumerate(names)}
+        self.node_compound = np.array([self._compound_codes.get(name, -1) for name in compounds], dtype=np.int64)
+
+        adjacency = csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(n_nodes, n_nodes))
+        n_components, labels = connected_components(adjacency, directed=True, connection='strong')
+
+        # condensation DAG, numbered in topological order
+        sources = np.repeat(np.arange(n_nodes), np.diff(indptr))
+        cu = labels[sources]
+        cv = labels[np.asarray(indices, dtype=np.int64)]
+        between = cu != cv
+        dag = np.unique(np.stack([cu[between], cv[between]], axis=1), axis=0)
+        successors = [[] for _ in range(n_components)]
+        indegree = np.zeros(n_components, dtype=np.int64)
+        for u, v in dag.tolist():
+            successors[u].append(v)
+            indegree[v] += 1
+        order = []
+        queue = deque(np.flatnonzero(indegree == 0).tolist())
+        while queue:
+            c = queue.popleft()
+            order.append(c)
+            for v in successors[c]:
+                indegree[v] -= 1
+                if not indegree[v]:
+                    queue.append(v)
+        rank = np.empty(n_components, dtype=np.int64)
+        rank[order] = np.arange(n_components)
+
+        self.component = rank[labels]
+        reach = [0] * n_components
+        for c in reversed(order):
+            bits = 1 << int(rank[c])
+            for v in successors[c]:
+                bits |= reach[rank[v]]
+            reach[rank[c]] = bits
+        self._reach = reach
+
+        by_component = np.argsort(self.component, kind='stable')
+        self._members = np.split(by_component, np.cumsum(np.bincount(self.component, minlength=n_components))[:-1])
+
+    @classmethod
+    def from_graph(cls, ATN, transitions=None):
+        """
+        Builds the index of a directed ATN graph, see :func:`directed_arrays`.
+        """
+        arrays = directed_arrays(ATN, transitions)
+        return cls(arrays.nodes, arrays.indptr, arrays.indices, arrays.compounds)
+
+    @classmethod
+    def from_file(cls, path, transitions=None):
+        """
+        Builds the index of a directed ATN file, see
+        :func:`read_directed_arrays`.
+        """
+        arrays = read_directed_arrays(path, transitions)
+        return cls(arrays.nodes, arrays.indptr, arrays.indices, arrays.compounds)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _component_of(self, node):
+        return int(self.component[self.node_index[node]])
+
+    def can_reach(self, source, target):
+        """
+        Returns whether label on atom `source` can reach atom `target`.
+        """
+        return bool(self._reach[self._component_of(source)] >> self._component_of(target) & 1)
+
+    def can_reach_many(self, pairs):
+        """
+        Answers :meth:`can_reach` for all ``(source, target)`` `pairs`.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array, one entry per pair.
+        """
+        reach = self._reach
+        component = self.component
+        node_index = self.node_index
+        return np.fromiter((reach[component[node_index[s]]] >> int(component[node_index[t]]) & 1 for s, t in pairs),
+                           dtype=bool)
+
+    def _reached_nodes(self, bits):
+        components = _bits(bits)
+        if not len(components):
+            return components
+        return np.concatenate([self._members[c] for c in components])
+
+    def reachable(self, source):
+        """
+        Returns the atoms label on atom `source` can reach, `source` included.
+        """
+        return [self.nodes[i] for i in self._reached_nodes(self._reach[self._component_of(source)])]
+
+    def reachable_many(self, sources):
+        """
+        Answers :meth:`reachable` for every atom in `sources`.
+        """
+        return [self.reachable(source) for source in sources]
+
+    def _compound_bits(self, compound):
+        if compound not in self._compound_codes:
+            raise KeyError('Unknown compound {}'.format(compound))
+        atoms = np.flatnonzero(self.node_compound == self._compound_codes[compound])
+        bits = 0
+        for c in np.unique(self.component[atoms]).tolist():
+            bits |= self._reach[c]
+        return bits
+
+    def labelled_compounds(self, compound):
+        """
+        Returns the names of the compounds that receive label from any atom of
+        `compound`, `compound` itself included.
+        """
+        codes = np.unique(self.node_compound[self._reached_nodes(self._compound_bits(compound))])
+        return [self.compound_names[code] for code in codes.tolist() if code >= 0]
+
+    def labelled_compounds_many(self, compounds):
+        """
+        Answers :meth:`labelled_compounds` for every compound in `compounds`.
+        """
+        return [self.labelled_compounds(compound) for compound in compounds]
@@ -0,0 +1,244 @@
+"""
+Per-sample views of an ATN built from a file of sampled models.
+
+The union ATN of all samples is built once. Which of its transition edges a
+sample contains follows from the reactions of the sample, so only a reaction
+x sample and an edge x sample bit matrix are kept.
+"""
+
+import os
+
+import networkx as nx
+import numpy as np
+
+from .transitions import TransitionIndex
+from .export import write_atn
+
+
+class SampleIndex:
+    """
+    Sample membership of the reactions and transition edges of an ATN.
+
+    Reactions without a sample list are part of every sample. Bonds, symmetry
+    and hydrogen group edges belong to a sample if their compound does.
+
+    Parameters
+    ----------
+    builder : atn.build.ATNBuilder
+        The builder of the union ATN, its reactions carry the sample lists.
+
+    Attributes
+    ----------
+    sample_ids : np.ndarray
+        The samples, sorted. Columns of all matrices follow this order.
+    reaction_ids : list[int]
+        The reactions, rows of the reaction matrix follow this order.
+    edges : list[tuple]
+        The transition edges in stored orientation, rows of the edge matrix
+        follow this order.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        reactions = builder.reactions
+        sample_ids = sorted({sample for reaction in reactions.values() for sample in reaction.samples or ()})
+        if not sample_ids:
+            raise ValueError('The reactions of the ATN carry no sample lists')
+        self.sample_ids = np.array(sample_ids, dtype=np.int64)
+        self.reaction_ids = sorted(reactions)
+        self._reaction_rows = {rid: row for row, rid in enumerate(self.reaction_ids)}
+
+        reaction_matrix = np.zeros((len(self.reaction_ids), len(sample_ids)), dtype=bool)
+        for row, rid in enumerate(self.reaction_ids):
+            samples = reactions[rid].samples
+            if samples is None:
+                reaction_matrix[row] = True
+            else:
+                reaction_matrix[row, np.searchsorted(self.sample_ids, samples)] = True
+
+        # every transition edge has at least one reaction, so no segment is empty
+        transitions = builder.transitions
+        self.edges = list(transitions)
+        self._edge_rows = {edge: row for row, edge in enumerate(self.edges)}
+        rows = [[self._reaction_rows[rid] for rid in transitions.edge_reactions(u, v)] for u, v in self.edges]
+        starts = np.cumsum([0] + [len(r) for r in rows[:-1]], dtype=np.int64)
+        incidence = np.fromiter((row for r in rows for row in r), np.int64)
+        if self.edges:
+            edge_matrix = np.logical_or.reduceat(reaction_matrix[incidence], starts, axis=0)
+        else:
+            edge_matrix = np.zeros((0, len(sample_ids)), dtype=bool)
+
+        self._reaction_bits = np.packbits(reaction_matrix, axis=1)
+        self._edge_bits = np.packbits(edge_matrix, axis=1)
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def _column(self, sample):
+        column = np.searchsorted(self.sample_ids, sample)
+        if column == len(self.sample_ids) or self.sample_ids[column] != sample:
+            raise KeyError('Unknown sample {}'.format(sample))
+        return int(column)
+
+    @staticmethod
+    def _bit_column(bits, column):
+        return (bits[:, column >> 3] >> (7 - (column & 7))) & 1 == 1
+
+    def _unpack(self, bits, samples):
+        matrix = np.unpackbits(bits, axis=1, count=len(self.sample_ids)).astype(bool)
+        if samples is None:
+            return matrix
+        return matrix[:, [self._column(sample) for sample in samples]]
+
+    def reaction_matrix(self, samples=None):
+        """
+        Returns the reaction x sample membership matrix.
+
+        Parameters
+        ----------
+        samples : collections.abc.Iterable[int]
+            The samples to return columns for. Defaults to all samples.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean matrix, rows follow `reaction_ids`.
+        """
+        return self._unpack(self._reaction_bits, samples)
+
+    def edge_matrix(self, samples=None):
+        """
+        Returns the transition edge x sample membership matrix.
+
+        Parameters
+        ----------
+        samples : collections.abc.Iterable[int]
+            The samples to return columns for. Defaults to all samples.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean matrix, rows follow `edges`.
+        """
+        return self._unpack(self._edge_bits, samples)
+
+    def edge_mask(self, sample):
+        """
+        Returns which transition edges, in the order of `edges`, are part of
+        `sample`.
+        """
+        return self._bit_column(self._edge_bits, self._column(sample))
+
+    def sample_reactions(self, sample):
+        """
+        Returns the ids of the reactions of `sample`.
+        """
+        mask = self._bit_column(self._reaction_bits, self._column(sample))
+        return [rid for rid, active in zip(self.reaction_ids, mask) if active]
+
+    def edge_samples(self, u, v):
+        """
+        Returns the samples containing the transition edge between `u` and `v`.
+        """
+        row = self._edge_rows.get((u, v), self._edge_rows.get((v, u)))
+        if row is None:
+            return np.array([], dtype=np.int64)
+        return self.sample_ids[np.unpackbits(self._edge_bits[row], count=len(self.sample_ids)).astype(bool)]
+
+    def edge_counts(self):
+        """
+        Returns for every transition edge the number of samples containing it.
+        """
+        return np.unpackbits(self._edge_bits, axis=1, count=len(self.sample_ids)).sum(axis=1)
+
+    def sample_sizes(self):
+        """
+        Returns for every sample the number of its transition edges.
+        """
+        return np.unpackbits(self._edge_bits, axis=1, count=len(self.sample_ids)).sum(axis=0)
+
+    def core_edges(self, fraction=1.0):
+        """
+        Returns the transition edges contained in at least `fraction` of all
+        samples.
+        """
+        keep = self.edge_counts() >= fraction * len(self.sample_ids)
+        return [edge for edge, kept in zip(self.edges, keep) if kept]
+
+    def transitions(self, sample):
+        """
+        Returns a :class:`TransitionIndex` holding only the reactions of
+        `sample`. The work is proportional to the size of the sample.
+        """
+        index = TransitionIndex()
+        for rid in self.sample_reactions(sample):
+            for source, target in self.builder.transitions.reaction_edges(rid):
+                index.add(source, target, rid)
+        return index
+
+    def compounds(self, sample):
+        """
+        Returns the names of the compounds referenced by `sample`.
+        """
+        reaction_compounds = self.builder.reaction_compounds
+        return set().union(*(reaction_compounds.get(rid, ()) for rid in self.sample_reactions(sample)))
+
+    def compound_key(self, sample):
+        """
+        Returns the compound key restricted to the compounds of `sample`.
+        """
+        templates = self.builder.templates
+        cids = {templates[name].cid for name in self.compounds(sample)}
+        return {cid: compound for cid, compound in self.builder.compoundId_to_compound.items() if cid in cids}
+
+    def view(self, sample):
+        """
+        Returns the ATN of `sample` as read-only view of the union ATN.
+
+        Nodes are the atoms of the compounds of the sample and the free
+        hydrogen nodes of its reactions. Transition edges are kept if a
+        reaction of the sample induces them. Directions of the union ATN are
+        left as they are, the exporters derive them from the transitions
+        returned by :meth:`transitions`.
+        """
+        ATN = self.builder.ATN
+        compounds = self.compounds(sample)
+        free_H = {"react_"+str(rid)+"_free_H" for rid in self.sample_reactions(sample)}
+        mask = self.edge_mask(sample)
+        edge_rows = self._edge_rows
+
+        def filter_node(n):
+            return n in free_H or ATN.nodes[n].get('compound_name') in compounds
+
+        def filter_edge(u, v):
+            row = edge_rows.get((u, v), edge_rows.get((v, u)))
+            return row is None or mask[row]
+
+        return nx.subgraph_view(ATN, filter_node=filter_node, filter_edge=filter_edge)
+
+    def save(self, path):
+        """
+        Writes the sample masks as ``.npz`` file with the arrays
+        ``sample_ids``, ``reaction_ids``, ``reaction_bits``, ``edge_source``,
+        ``edge_target`` and ``edge_bits``. The bit matrices are packed along
+        the sample axis, see `np.packbits`.
+        """
+        with open(path, 'wb') as mask_file:
+            np.savez_compressed(mask_file,
+                                sample_ids=self.sample_ids,
+                                reaction_ids=np.array(self.reaction_ids, dtype=np.int64),
+                                reaction_bits=self._reaction_bits,
+                                edge_source=np.array([str(u) for u, _ in self.edges], dtype=str),
+                                edge_target=np.array([str(v) for _, v in self.edges], dtype=str),
+                                edge_bits=self._edge_bits)
+
+
+def write_sample_atns(index, samples, output, directed):
+    """
+    Writes the ATN of every sample in `samples` next to `output`, the name
+    gets ``.sample<id>`` before the extension.
+    """
+    root, ext = os.path.splitext(output)
+    for sample in samples:
+        write_atn(index.view(sample), index.transitions(sample), index.compound_key(sample),
+                  '{}.sample{}{}'.format(root, sample, ext), directed)
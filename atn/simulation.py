@@ -0,0 +1,511 @@
+"""
+Steady state 13C labelling simulation on the directed ATN.
+
+Given the fluxes of the reactions, the enrichment of every atom is the flux
+weighted mean of the atoms it receives label from. Atoms of substrates are
+fixed by the tracers, all other atoms follow from one sparse linear system
+per flux vector, with one column per tracer.
+
+The system only contains atoms that label can reach with the active
+reactions, so the matrix structure depends on which reactions carry flux.
+It is derived once per such sparsity pattern and reused for all flux vectors
+sharing it; a flux vector then only costs assembling and factorising the
+values.
+
+Mass isotopomer distributions depend on which atoms are labelled together,
+which atom enrichments do not tell. They are simulated on the EMU network of
+the measured compounds (:mod:`atn.emu`) by :class:`MassIsotopomerSimulator`.
+"""
+
+import logging
+from collections import Counter
+
+import numpy as np
+from scipy.sparse import csr_matrix, csc_matrix
+from scipy.sparse.csgraph import breadth_first_order, connected_components
+from scipy.sparse.linalg import splu
+
+from .build import read_mapped_reactions, reaction_sides
+from .emu import EMUNetwork
+from .reachability import atom_order, read_directed_arrays
+from .types import TransitionType
+
+LOGGER = logging.getLogger(__name__)
+
+SIMULATION_TRANSITIONS = (TransitionType.REACTION.value, TransitionType.SYMMETRY.value)
+
+
+class _Pattern:
+    """
+    The structure of the linear system for one set of active reaction
+    directions.
+    """
+
+    def __init__(self, simulator, active):
+        n_nodes = len(simulator.nodes)
+        inputs = simulator.is_input
+
+        # atoms label can reach from the substrates
+        entries = active[simulator.entry_slot]
+        graph = csr_matrix((np.ones(entries.sum() + inputs.sum(), dtype=np.int8),
+                            (np.concatenate([simulator.entry_col[entries], np.full(inputs.sum(), n_nodes)]),
+                             np.concatenate([simulator.entry_row[entries], np.flatnonzero(inputs)]))),
+                           shape=(n_nodes + 1, n_nodes + 1))
+        reached = breadth_first_order(graph, n_nodes, directed=True, return_predecessors=False)
+        unknown = np.zeros(n_nodes + 1, dtype=bool)
+        unknown[reached] = True
+        unknown = unknown[:n_nodes] & ~inputs
+        self.unknowns = np.flatnonzero(unknown)
+        local = np.full(n_nodes, -1, dtype=np.int64)
+        local[self.unknowns] = np.arange(len(self.unknowns))
+        n_unknowns = len(self.unknowns)
+
+        # matrix entries: the production of every unknown on the diagonal,
+        # its inflow from other unknowns off the diagonal
+        internal = entries & unknown[simulator.entry_row] & unknown[simulator.entry_col]
+        self.internal = np.flatnonzero(internal)
+        rows = np.concatenate([np.arange(n_unknowns), local[simulator.entry_row[internal]]])
+        cols = np.concatenate([np.arange(n_unknowns), local[simulator.entry_col[internal]]])
+        keys, self.inverse = np.unique(cols * n_unknowns + rows, return_inverse=True)
+        self.indices = keys % n_unknowns if n_unknowns else keys
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(keys // max(n_unknowns, 1),
+                                                                 minlength=n_unknowns))])
+        self.shape = (n_unknowns, n_unknowns)
+
+        # inflow from substrate atoms goes to the right hand side
+        external = entries & unknown[simulator.entry_row] & inputs[simulator.entry_col]
+        self.external = np.flatnonzero(external)
+        self.external_rows = local[simulator.entry_row[external]]
+        self.external_cols = simulator.input_index[simulator.entry_col[external]]
+
+
+class LabellingSimulator:
+    """
+    Simulates steady state atom enrichments for given fluxes and tracers.
+
+    Parameters
+    ----------
+    arrays : atn.reachability.DirectedArrays
+        The reaction and symmetry edges of a directed ATN with their reaction
+        ids.
+    reactions : collections.abc.Iterable[atn.build.MappedReaction]
+        The reactions of the ATN, their index is the reaction id used on the
+        edges and in the flux vectors. They give the educts and products that
+        orient the edges.
+    substrates : collections.abc.Iterable[str]
+        The compounds fed to the system, their atoms carry the tracers.
+    renamed_compounds : collections.abc.Container
+        Compounds renamed while building the ATN, see
+        :func:`atn.build.reaction_sides`.
+
+    Fluxes are indexed by reaction id. A positive flux runs from educts to
+    products, a negative one backwards; the optional exchange flux runs in
+    both directions. A compound listed several times in a reaction counts
+    with its stoichiometry: the atoms of a product receive the inflow of all
+    its molecules, shared by the educt atoms they are mapped from.
+    """
+
+    def __init__(self, arrays, reactions, substrates, renamed_compounds=()):
+        self._arrays = arrays
+        self.nodes = list(arrays.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.elements = list(arrays.elements)
+        n_nodes = len(self.nodes)
+
+        self.compound_names = sorted({name for name in arrays.compounds if name is not None})
+        self._compound_codes = codes = {name: i for i, name in enumerate(self.compound_names)}
+        self.node_compound = np.array([codes.get(name, -1) for name in arrays.compounds], dtype=np.int64)
+
+        # educt and product compounds of every reaction
+        self._sides = sides = {}
+        for reaction in reactions:
+            split = reaction_sides(reaction, renamed_compounds)
+            if split is not None:
+                sides[reaction.index] = tuple(Counter(codes[name] for name, _ in side if name in codes)
+                                              for side in split)
+        self.n_reactions = max(sides, default=-1) + 1
+
+        # slots are reaction directions: 2 * rid forward, 2 * rid + 1 backward
+        production = []
+        for rid, (educts, products) in sides.items():
+            production.extend((code, 2 * rid, count) for code, count in products.items())
+            production.extend((code, 2 * rid + 1, count) for code, count in educts.items())
+        production = np.array(production, dtype=np.int64).reshape(-1, 3)
+        self._production_compound, self._production_slot = production[:, 0], production[:, 1]
+        self._production_count = production[:, 2]
+
+        # label entries: atom row receives label from atom col with the flux
+        # of slot times factor. The molecules of a product share the inflow of
+        # its atoms: an atom gets as many molecules of inflow per slot as the
+        # reaction forms, split over the atoms it is mapped from. Symmetric
+        # atoms share their inflow
+        sources = np.repeat(np.arange(n_nodes), np.diff(arrays.indptr)).tolist()
+        targets = np.asarray(arrays.indices).tolist()
+        symmetric = []
+        edges = []
+        unoriented = Counter()
+        for u, v, transition, reaction_ids in zip(sources, targets, arrays.transitions, arrays.reaction_ids):
+            if transition == TransitionType.SYMMETRY.value:
+                symmetric.append((u, v))
+                continue
+            cu, cv = self.node_compound[u], self.node_compound[v]
+            for rid in reaction_ids:
+                educts, products = sides.get(rid, ((), ()))
+                if cu in educts and cv in products:
+                    edges.append((v, u, 2 * rid, products[cv]))
+                elif cu in products and cv in educts:
+                    edges.append((v, u, 2 * rid + 1, educts[cv]))
+                else:
+                    unoriented[rid] += 1
+        if unoriented:
+            LOGGER.warning("Ignoring %d reaction edges that do not run between educts and products",
+                           sum(unoriented.values()))
+        origins = Counter((v, slot) for v, _, slot, _ in edges)
+
+        pairs = np.array(symmetric, dtype=np.int64).reshape(-1, 2)
+        _, orbit = connected_components(csr_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                                                   shape=(n_nodes, n_nodes)), directed=False)
+        members = {}
+        for node, label in enumerate(orbit.tolist()):
+            members.setdefault(label, []).append(node)
+        entries = [(target, source, slot, count / origins[v, slot] / len(members[orbit[v]]))
+                   for v, source, slot, count in edges for target in members[orbit[v]]]
+        entries = np.array(entries, dtype=np.float64).reshape(-1, 4)
+        self.entry_row = entries[:, 0].astype(np.int64)
+        self.entry_col = entries[:, 1].astype(np.int64)
+        self.entry_slot = entries[:, 2].astype(np.int64)
+        self.entry_factor = entries[:, 3]
+
+        self.substrates = sorted(set(substrates))
+        self.is_input = np.isin(self.node_compound, [codes[name] for name in self.substrates if name in codes])
+        self.inputs = np.flatnonzero(self.is_input)
+        self.input_index = np.full(n_nodes, -1, dtype=np.int64)
+        self.input_index[self.inputs] = np.arange(len(self.inputs))
+        self._patterns = {}
+
+    @classmethod
+    def from_files(cls, atnpath, mappedsmiles, substrates, renamed_compounds=()):
+        """
+        Builds the simulator of a directed ATN file (GML or ``.npz`` bundle)
+        and the mapped SMILES file it was generated from.
+        """
+        return cls(read_directed_arrays(atnpath, SIMULATION_TRANSITIONS), read_mapped_reactions(mappedsmiles),
+                   substrates, renamed_compounds)
+
+    def compound_atoms(self, compound, element=None):
+        """
+        Returns the atoms of `compound` in SMILES order, only those of
+        `element` if given.
+        """
+        if compound not in self._compound_codes:
+            raise KeyError('Unknown compound {}'.format(compound))
+        atoms = [self.nodes[i] for i in np.flatnonzero(self.node_compound == self._compound_codes[compound])
+                 if element is None or self.elements[i] == element]
+        return sorted(atoms, key=atom_order)
+
+    def emu_network(self, max_emus=100000, excluded_reactions=()):
+        """
+        Returns an empty EMU network of the ATN with the substrates as
+        inputs, for :class:`MassIsotopomerSimulator`. See
+        :class:`atn.emu.EMUNetwork` for the parameters.
+        """
+        return EMUNetwork(self._arrays, self.substrates, max_emus, excluded_reactions)
+
+    def tracer_matrix(self, tracers):
+        """
+        Returns the enrichments of the substrate atoms.
+
+        Parameters
+        ----------
+        tracers : collections.abc.Sequence[dict or collections.abc.Iterable]
+            For every tracer the enrichment of the labelled substrate atoms,
+            as dict atom to enrichment or as atoms that are fully labelled.
+
+        Returns
+        -------
+        np.ndarray
+            Substrate atoms x tracers matrix, rows follow `inputs`.
+        """
+        labels = np.zeros((len(self.inputs), len(tracers)))
+        for column, tracer in enumerate(tracers):
+            items = tracer.items() if isinstance(tracer, dict) else ((atom, 1.0) for atom in tracer)
+            for atom, enrichment in items:
+                row = self.input_index[self.node_index[atom]]
+                if row < 0:
+                    raise ValueError('{} is not an atom of a substrate'.format(atom))
+                labels[row, column] = enrichment
+        return labels
+
+    def _slot_fluxes(self, fluxes, exchange):
+        fluxes = np.asarray(fluxes, dtype=np.float64)
+        if len(fluxes) < self.n_reactions:
+            raise ValueError('Expected fluxes for {} reactions, got {}'.format(self.n_reactions, len(fluxes)))
+        slots = np.empty(2 * self.n_reactions)
+        slots[0::2] = np.maximum(fluxes[:self.n_reactions], 0)
+        slots[1::2] = np.maximum(-fluxes[:self.n_reactions], 0)
+        if exchange is not None:
+            slots += np.repeat(np.asarray(exchange, dtype=np.float64)[:self.n_reactions], 2)
+        return slots
+
+    def _production(self, slots):
+        # molecules of every compound formed per time
+        return np.bincount(self._production_compound, weights=slots[self._production_slot] * self._production_count,
+                           minlength=len(self.compound_names))
+
+    def _pattern(self, slots):
+        active = slots > 0
+        key = np.packbits(active).tobytes()
+        pattern = self._patterns.get(key)
+        if pattern is None:
+            pattern = self._patterns[key] = _Pattern(self, active)
+        return pattern
+
+    def simulate(self, fluxes, tracers, exchange=None):
+        """
+        Returns the steady state enrichment of all atoms.
+
+        Parameters
+        ----------
+        fluxes : np.ndarray
+            Net flux of every reaction, indexed by reaction id.
+        tracers : np.ndarray or collections.abc.Sequence
+            Substrate enrichments as returned by :meth:`tracer_matrix`, or
+            tracers as accepted by it.
+        exchange : np.ndarray
+            Exchange flux of every reaction, added in both directions.
+
+        Returns
+        -------
+        np.ndarray
+            Atoms x tracers enrichment matrix, rows follow `nodes`. Atoms
+            label cannot reach are 0.
+        """
+        labels = tracers if isinstance(tracers, np.ndarray) else self.tracer_matrix(tracers)
+        slots = self._slot_fluxes(fluxes, exchange)
+        pattern = self._pattern(slots)
+
+        enrichment = np.zeros((len(self.nodes), labels.shape[1]))
+        enrichment[self.inputs] = labels
+        if not len(pattern.unknowns):
+            return enrichment
+
+        production = self._production(slots)
+        weights = slots[self.entry_slot] * self.entry_factor
+        data = np.bincount(pattern.inverse,
+                           weights=np.concatenate([production[self.node_compound[pattern.unknowns]],
+                                                   -weights[pattern.internal]]),
+                           minlength=len(pattern.indices))
+        matrix = csc_matrix((data, pattern.indices, pattern.indptr), shape=pattern.shape)
+        inflow = csr_matrix((weights[pattern.external], (pattern.external_rows, pattern.external_cols)),
+                            shape=(pattern.shape[0], len(self.inputs)))
+        try:
+            solved = splu(matrix).solve(np.asarray(inflow @ labels))
+        except RuntimeError as error:
+            raise ValueError('The labelling system of these fluxes is singular: {}'.format(error)) from error
+        enrichment[pattern.unknowns] = solved.reshape(len(pattern.unknowns), -1)
+        return enrichment
+
+    def simulate_many(self, flux_matrix, tracers, exchange=None):
+        """
+        Runs :meth:`simulate` for every row of `flux_matrix` (and of
+        `exchange`, if given). Flux vectors with the same active reactions
+        share the structure of their system.
+
+        Returns
+        -------
+        np.ndarray
+            Flux vectors x atoms x tracers enrichments.
+        """
+        labels = tracers if isinstance(tracers, np.ndarray) else self.tracer_matrix(tracers)
+        flux_matrix = np.atleast_2d(flux_matrix)
+        return np.stack([self.simulate(fluxes, labels, None if exchange is None else exchange[row])
+                         for row, fluxes in enumerate(flux_matrix)])
+
+
+def _convolve(mids, size):
+    """
+    Returns the MID of the atoms of all `mids` (tracers x (atoms + 1)
+    matrices) together with unlabelled atoms up to `size` atoms.
+    """
+    combined = mids[0]
+    for mid in mids[1:]:
+        convolved = np.zeros((combined.shape[0], combined.shape[1] + mid.shape[1] - 1))
+        for shift in range(mid.shape[1]):
+            convolved[:, shift:shift + combined.shape[1]] += combined * mid[:, shift:shift + 1]
+        combined = convolved
+    padded = np.zeros((combined.shape[0], size + 1))
+    padded[:, :combined.shape[1]] = combined
+    return padded
+
+
+class MassIsotopomerSimulator:
+    """
+    Simulates exact steady state mass isotopomer distributions (MIDs) of the
+    EMUs of an EMU network.
+
+    The MID of an EMU is the flux weighted mean over the EMU reactions
+    forming it of the convolution of their precursor MIDs, see
+    :mod:`atn.emu`. EMUs of one size form a sparse linear system; larger
+    EMUs are combined from smaller ones, so the systems are solved from the
+    smallest size up. Unlike combining atom enrichments, this keeps the
+    correlation of atoms labelled together, e.g. by uniformly labelled
+    tracers.
+
+    Parameters
+    ----------
+    simulator : LabellingSimulator
+        The simulator of the ATN, it orients the reactions and gives the
+        production of the compounds.
+    network : atn.emu.EMUNetwork
+        EMU network of the same ATN and substrates with all measured EMUs
+        added, see :meth:`LabellingSimulator.emu_network`.
+
+    A substrate is a mix of unlabelled molecules and molecules labelled at
+    the tracer atoms, so all labelled atoms of a substrate share one
+    enrichment. Inflow the EMU reactions do not account for, from atoms
+    without labelled origin or from reactions excluded from the network, is
+    unlabelled.
+    """
+
+    def __init__(self, simulator, network):
+        if network.nodes != simulator.nodes or network.substrates != set(simulator.substrates):
+            raise ValueError('The EMU network does not belong to the ATN and substrates of the simulator')
+        self.simulator = simulator
+        self.network = network
+        self.sizes = network.sizes()
+        codes = simulator._compound_codes
+        self.emu_compound = np.array([codes[emu.compound] for emu in network.emus], dtype=np.int64)
+
+        # the reaction direction forming every EMU reaction
+        reactions = []
+        unoriented = 0
+        for number, reaction in enumerate(network.reactions):
+            educts, products = simulator._sides.get(reaction.reaction_id, ((), ()))
+            product = self.emu_compound[reaction.product]
+            source = self.emu_compound[reaction.precursors[0]]
+            if source in educts and product in products:
+                reactions.append((number, 2 * reaction.reaction_id))
+            elif source in products and product in educts:
+                reactions.append((number, 2 * reaction.reaction_id + 1))
+            else:
+                unoriented += 1
+        if unoriented:
+            LOGGER.warning("Ignoring %d EMU reactions that do not run between educts and products", unoriented)
+        self.reactions = [network.reactions[number] for number, _ in reactions]
+        self.reaction_slot = np.array([slot for _, slot in reactions], dtype=np.int64)
+        self.reaction_weight = np.array([reaction.weight for reaction in self.reactions], dtype=np.float64)
+        self.reaction_product = np.array([reaction.product for reaction in self.reactions], dtype=np.int64)
+        self._edges = np.array([(precursor, reaction.product) for reaction in self.reactions
+                                for precursor in reaction.precursors], dtype=np.int64).reshape(-1, 2)
+        self._edge_reaction = np.repeat(np.arange(len(self.reactions)),
+                                        [len(reaction.precursors) for reaction in self.reactions])
+
+        # substrate rows of the atoms of every input EMU and its images
+        self.inputs = [index for index in network.inputs if network.emus[index].compound in network.substrates]
+        self._input_rows = [[simulator.input_index[[simulator.node_index[atom] for atom in image]]
+                             for image in network.images(index)] for index in self.inputs]
+
+    def _substrate_mids(self, labels):
+        simulator = self.simulator
+        compounds = simulator.node_compound[simulator.inputs]
+        enrichment = np.zeros((len(simulator.compound_names), labels.shape[1]))
+        np.maximum.at(enrichment, compounds, labels)
+        if np.any((labels != 0) & (labels != enrichment[compounds])):
+            raise ValueError('Mass isotopomers need the labelled atoms of a substrate to share one enrichment')
+        labelled = labels > 0
+        mids = []
+        for index, images in zip(self.inputs, self._input_rows):
+            fraction = enrichment[self.emu_compound[index]]
+            mid = np.zeros((labels.shape[1], self.sizes[index] + 1))
+            for rows in images:
+                mid[np.arange(labels.shape[1]), labelled[rows].sum(axis=0)] += fraction / len(images)
+            mid[:, 0] += 1 - fraction
+            mids.append(mid)
+        return mids
+
+    def _reached(self, flux):
+        # EMUs label can reach from the substrates with the active reactions
+        n_emus = len(self.sizes)
+        edges = self._edges[flux[self._edge_reaction] > 0]
+        graph = csr_matrix((np.ones(len(edges) + len(self.inputs), dtype=np.int8),
+                            (np.concatenate([edges[:, 0], np.full(len(self.inputs), n_emus)]),
+                             np.concatenate([edges[:, 1], self.inputs]))),
+                           shape=(n_emus + 1, n_emus + 1))
+        reached = np.zeros(n_emus + 1, dtype=bool)
+        reached[breadth_first_order(graph, n_emus, directed=True, return_predecessors=False)] = True
+        return reached[:n_emus]
+
+    def simulate(self, fluxes, tracers, exchange=None):
+        """
+        Returns the steady state MIDs of all EMUs.
+
+        Parameters
+        ----------
+        fluxes, tracers, exchange
+            As for :meth:`LabellingSimulator.simulate`.
+
+        Returns
+        -------
+        list[np.ndarray]
+            For every EMU a tracers x (number of atoms + 1) matrix, M+0 to
+            M+n. EMUs label cannot reach are unlabelled.
+        """
+        simulator = self.simulator
+        labels = tracers if isinstance(tracers, np.ndarray) else simulator.tracer_matrix(tracers)
+        n_tracers = labels.shape[1]
+        slots = simulator._slot_fluxes(fluxes, exchange)
+        flux = slots[self.reaction_slot] * self.reaction_weight
+        production = simulator._production(slots)[self.emu_compound]
+        inflow = np.bincount(self.reaction_product, weights=flux, minlength=len(self.sizes))
+
+        mids = [None] * len(self.sizes)
+        for index, mid in zip(self.inputs, self._substrate_mids(labels)):
+            mids[index] = mid
+        unknown = self._reached(flux)
+        unknown[self.inputs] = False
+        for index in np.flatnonzero(~unknown):
+            if mids[index] is None:
+                mids[index] = np.zeros((n_tracers, self.sizes[index] + 1))
+                mids[index][:, 0] = 1.0
+
+        forming = {}
+        for number in np.flatnonzero(flux > 0):
+            forming.setdefault(self.reaction_product[number], []).append(number)
+        for size in np.unique(self.sizes[unknown]):
+            level = np.flatnonzero(unknown & (self.sizes == size))
+            local = {index: i for i, index in enumerate(level.tolist())}
+            rows, cols, data = list(range(len(level))), list(range(len(level))), production[level].tolist()
+            # inflow without EMU reaction is unlabelled
+            rhs = np.zeros((len(level), n_tracers, size + 1))
+            rhs[:, :, 0] = (production[level] - inflow[level])[:, None]
+            for row, index in enumerate(level.tolist()):
+                for number in forming.get(index, ()):
+                    precursors = self.reactions[number].precursors
+                    if len(precursors) == 1 and precursors[0] in local:
+                        rows.append(row)
+                        cols.append(local[precursors[0]])
+                        data.append(-flux[number])
+                    else:
+                        rhs[row] += flux[number] * _convolve([mids[precursor] for precursor in precursors], size)
+            matrix = csc_matrix((data, (rows, cols)), shape=(len(level), len(level)))
+            try:
+                solved = splu(matrix).solve(rhs.reshape(len(level), -1))
+            except RuntimeError as error:
+                raise ValueError('The EMU system of these fluxes is singular: {}'.format(error)) from error
+            for index, mid in zip(level.tolist(), solved.reshape(len(level), n_tracers, size + 1)):
+                mids[index] = mid
+        return mids
+
+    def simulate_many(self, flux_matrix, tracers, exchange=None):
+        """
+        Runs :meth:`simulate` for every row of `flux_matrix` (and of
+        `exchange`, if given).
+
+        Returns
+        -------
+        list[list[np.ndarray]]
+            The MIDs of every flux vector.
+        """
+        labels = tracers if isinstance(tracers, np.ndarray) else self.simulator.tracer_matrix(tracers)
+        return [self.simulate(fluxes, labels, None if exchange is None else exchange[row])
+                for row, fluxes in enumerate(np.atleast_2d(flux_matrix))]
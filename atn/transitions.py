@@ -0,0 +1,245 @@
+"""
+Compact storage for the reactions that induce the transition edges of an ATN.
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+def _insert_sorted(values, value):
+    """
+    Inserts `value` into the sorted array `values` unless it is present.
+
+    Returns
+    -------
+    bool
+        Whether `value` was inserted.
+    """
+    # Reactions are processed in order, so appending is the common case.
+    if not values or values[-1] < value:
+        values.append(value)
+        return True
+    pos = bisect_left(values, value)
+    if pos < len(values) and values[pos] == value:
+        return False
+    values.insert(pos, value)
+    return True
+
+
+class TransitionIndex:
+    """
+    Reaction membership of the transition edges of an ATN.
+
+    Each transition edge is stored once, in the orientation in which it was
+    first recorded, and gets a dense integer id. Reactions moving an atom along
+    that orientation are kept in the edge's forward array, reactions moving it
+    the other way in the backward array. Both are sorted `array` objects of
+    reaction indices. An inverted index maps every reaction to the signed ids
+    of the edges it induces (``~edge_id`` for backward transitions).
+
+    Reaction ids are only turned into strings by :meth:`format`, which is
+    meant to be called when the ATN is exported.
+
+    Removing a reaction only touches the edges it induces. Ids of edges left
+    without any reaction are reused.
+    """
+
+    TYPECODE = 'l'
+
+    def __init__(self):
+        self._edge_ids = {}
+        self._edges = []
+        self._forward = []
+        self._backward = []
+        self._reaction_edges = {}
+        self._free_ids = []
+
+    def __len__(self):
+        return len(self._edge_ids)
+
+    def __iter__(self):
+        return (edge for edge in self._edges if edge is not None)
+
+    def __contains__(self, edge):
+        return self.edge_id(*edge) is not None
+
+    def edge_id(self, source, target):
+        """
+        Returns the id of the edge between `source` and `target`, or None.
+        """
+        eid = self._edge_ids.get((source, target))
+        if eid is None:
+            eid = self._edge_ids.get((target, source))
+        return eid
+
+    def add(self, source, target, reaction_id):
+        """
+        Records that reaction `reaction_id` moves an atom from `source` to
+        `target`.
+
+        Parameters
+        ----------
+        source : hashable
+            The ATN node the atom comes from.
+        target : hashable
+            The ATN node the atom goes to.
+        reaction_id : int
+            Index of the reaction in the mapped SMILES file.
+
+        Returns
+        -------
+        int
+            The id of the edge.
+        """
+        reaction_id = int(reaction_id)
+        eid = self._edge_ids.get((source, target))
+        if eid is not None:
+            reactions = self._forward[eid]
+            signed = eid
+        else:
+            eid = self._edge_ids.get((target, source))
+            if eid is None:
+                if self._free_ids:
+                    eid = self._free_ids.pop()
+                    self._edges[eid] = (source, target)
+                else:
+                    eid = len(self._edges)
+                    self._edges.append((source, target))
+                    self._forward.append(array(self.TYPECODE))
+                    self._backward.append(array(self.TYPECODE))
+                self._edge_ids[(source, target)] = eid
+                reactions = self._forward[eid]
+                signed = eid
+            else:
+                reactions = self._backward[eid]
+                signed = ~eid
+        if _insert_sorted(reactions, reaction_id):
+            self._reaction_edges.setdefault(reaction_id, array(self.TYPECODE)).append(signed)
+        return eid
+
+    def remove_reaction(self, reaction_id):
+        """
+        Removes reaction `reaction_id` from all edges it induces.
+
+        Returns
+        -------
+        tuple(list, list)
+            The edges that still carry other reactions, and the edges that are
+            left without any reaction and were dropped from the index. Both in
+            stored orientation.
+        """
+        reaction_id = int(reaction_id)
+        touched = {}
+        for signed in self._reaction_edges.pop(reaction_id, ()):
+            eid = signed if signed >= 0 else ~signed
+            reactions = self._forward[eid] if signed >= 0 else self._backward[eid]
+            del reactions[bisect_left(reactions, reaction_id)]
+            touched[eid] = None
+        kept = []
+        dropped = []
+        for eid in touched:
+            edge = self._edges[eid]
+            if self._forward[eid] or self._backward[eid]:
+                kept.append(edge)
+                continue
+            del self._edge_ids[edge]
+            self._edges[eid] = None
+            self._free_ids.append(eid)
+            dropped.append(edge)
+        return kept, dropped
+
+    def endpoints(self, eid):
+        """
+        Returns the edge with id `eid` in its stored orientation.
+        """
+        return self._edges[eid]
+
+    def reactions(self, source, target):
+        """
+        Returns the reactions moving an atom from `source` to `target`.
+
+        Returns
+        -------
+        array
+            Sorted reaction indices. Empty if there are none.
+        """
+        eid = self._edge_ids.get((source, target))
+        if eid is not None:
+            return self._forward[eid]
+        eid = self._edge_ids.get((target, source))
+        if eid is not None:
+            return self._backward[eid]
+        return array(self.TYPECODE)
+
+    def edge_reactions(self, u, v):
+        """
+        Returns the reactions on the edge between `u` and `v`, regardless of
+        their direction.
+
+        Returns
+        -------
+        list[int]
+            Sorted reaction indices.
+        """
+        return sorted(set(self.reactions(u, v)).union(self.reactions(v, u)))
+
+    def directions(self, u, v):
+        """
+        Returns whether any reaction moves atoms from `u` to `v`, and whether
+        any reaction moves atoms from `v` to `u`.
+
+        Returns
+        -------
+        tuple(bool, bool)
+        """
+        return bool(self.reactions(u, v)), bool(self.reactions(v, u))
+
+    def reaction_ids(self):
+        """
+        Returns all reactions that induce at least one transition edge.
+        """
+        return sorted(self._reaction_edges)
+
+    def reaction_edges(self, reaction_id):
+        """
+        Returns the transitions induced by reaction `reaction_id`.
+
+        Returns
+        -------
+        list[tuple]
+            The ``(source, target)`` pairs along which the reaction moves atoms.
+        """
+        edges = []
+        for signed in self._reaction_edges.get(int(reaction_id), ()):
+            if signed >= 0:
+                edges.append(self._edges[signed])
+            else:
+                target, source = self._edges[~signed]
+                edges.append((source, target))
+        return edges
+
+    def format(self, source, target, sep=','):
+        """
+        Formats reaction ids for export.
+
+        Parameters
+        ----------
+        source : hashable
+            First node of the edge.
+        target : hashable
+            Second node of the edge.
+        sep : str
+            Separator placed between reaction ids.
+
+        Returns
+        -------
+        str
+            The reactions moving atoms from `source` to `target`.
+        """
+        return sep.join(map(str, self.reactions(source, target)))
+
+    def format_undirected(self, u, v, sep=','):
+        """
+        Formats all reaction ids on the edge between `u` and `v` for export.
+        """
+        return sep.join(map(str, self.edge_reactions(u, v)))
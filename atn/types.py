@@ -0,0 +1,36 @@
+"""
+Edge types of atom transition networks. Kept free of dependencies, so that
+modules working on written networks do not import RDKit.
+"""
+
+import enum
+
+
+@enum.unique
+class TransitionType(str, enum.Enum):
+    """Possible transition types of ATN edges in the directed output"""
+    NO_TRANSITION = "ChemicalBond"
+    SYMMETRY = "Symmetry"
+    REACTION = "Reaction"
+    HYDROGEN_GROUP = "HydrogenGroup"
+    HYDROGEN_REACTION = "HydrogenReaction"
+    HYDROGEN_FREE = "HydrogenFreedReaction"
+
+
+@enum.unique
+class TransitionCode(enum.IntEnum):
+    """Possible transition types of ATN edges in the undirected output"""
+    NO_TRANSITION = 0
+    SYMMETRY = 1
+    REACTION = 2
+    HYDROGEN_GROUP = 3
+    HYDROGEN_REACTION = 4
+    HYDROGEN_FREE = 5
+
+
+@enum.unique
+class DirectionType(enum.IntEnum):
+    """Possible directions of ATN edges"""
+    UNDIRECTED = 0
+    BIDIRECTED = 1
+    DIRECTED = 2
@@ -0,0 +1,213 @@
+"""
+Reaction-indexed views of the directed ATN.
+
+An inverted index from reaction id to edge positions (stored in bundles, see
+:mod:`atn.bundle`, or derived from the 'reaction_ids' of the edges) turns a
+pathway or a knockout into an edge mask over the shared CSR arrays. Views
+are these masks; reachability runs on them without copying the network.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order
+
+from .bundle import reaction_index, read_bundle_arrays
+from .reachability import ReachabilityIndex, directed_arrays, read_directed_arrays
+
+KnockoutResult = namedtuple('KnockoutResult', ['reactions', 'reached', 'targets_reached'])
+KnockoutResult.__doc__ = """
+The effect of knocking out `reactions`: the number of atoms label still
+`reached` from the sources, and whether any target was reached.
+"""
+
+
+class ATNViews:
+    """
+    Creates pathway and knockout views of a directed ATN.
+
+    Parameters
+    ----------
+    arrays : atn.reachability.DirectedArrays
+        All edges of the directed ATN with their reaction ids.
+    index : tuple(np.ndarray, np.ndarray, np.ndarray)
+        The reaction index ``(ids, offsets, edges)`` of the edges, see
+        :func:`atn.bundle.reaction_index`. Derived from `arrays` if None.
+    """
+
+    def __init__(self, arrays, index=None):
+        self.arrays = arrays
+        self.nodes = list(arrays.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.indptr = np.asarray(arrays.indptr, dtype=np.int64)
+        self.indices = np.asarray(arrays.indices, dtype=np.int64)
+        self.sources = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+        self.transitions = np.array([str(transition) for transition in arrays.transitions], dtype=str)
+
+        counts = np.fromiter((len(rids) for rids in arrays.reaction_ids), np.int64, len(self.indices))
+        self._reaction_count = counts
+        if index is None:
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            values = np.fromiter((rid for rids in arrays.reaction_ids for rid in rids), np.int64, offsets[-1])
+            index = reaction_index(offsets, values)
+        self.reaction_ids, self._offsets, self._edges = index
+        self._slot = {rid: i for i, rid in enumerate(self.reaction_ids.tolist())}
+
+    @classmethod
+    def from_graph(cls, ATN):
+        """
+        Builds the views of a directed ATN graph.
+        """
+        return cls(directed_arrays(ATN))
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Builds the views of a directed ATN file, a GML file or a ``.npz``
+        bundle. The reaction index of a bundle is used if it has one.
+        """
+        index = read_bundle_arrays(path).reaction_index if path.endswith('.npz') else None
+        return cls(read_directed_arrays(path), index)
+
+    def reaction_edges(self, reactions):
+        """
+        Returns the positions of the edges of `reactions`, an edge is listed
+        once for every reaction.
+        """
+        slots = [self._slot[rid] for rid in reactions if rid in self._slot]
+        if not slots:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([self._edges[self._offsets[slot]:self._offsets[slot + 1]] for slot in slots])
+
+    def _base(self, transitions):
+        if transitions is None:
+            return np.ones(len(self.indices), dtype=bool)
+        return np.isin(self.transitions, list(transitions))
+
+    def full(self, transitions=None):
+        """
+        Returns the view of the whole ATN, restricted to edges whose
+        'transition' is in `transitions` if given.
+        """
+        return ATNView(self, self._base(transitions))
+
+    def pathway(self, reactions, transitions=None):
+        """
+        Returns the view of the ATN restricted to `reactions`: their edges
+        and the edges belonging to no reaction, like symmetries.
+        """
+        keep = self._reaction_count == 0
+        keep[self.reaction_edges(reactions)] = True
+        return ATNView(self, self._base(transitions) & keep)
+
+    def _knocked(self, reactions):
+        edges = self.reaction_edges(set(reactions))
+        knocked = np.bincount(edges, minlength=len(self.indices))
+        return (knocked == self._reaction_count) & (self._reaction_count > 0)
+
+    def knockout(self, reactions, transitions=None):
+        """
+        Returns the view of the ATN without `reactions`. Edges are removed
+        once all of their reactions are knocked out.
+        """
+        return ATNView(self, self._base(transitions) & ~self._knocked(reactions))
+
+    def knockout_batch(self, knockouts, sources, targets=(), transitions=None):
+        """
+        Evaluates many knockouts for label starting at `sources`.
+
+        Knockouts not touching any edge label can reach in the full view
+        cannot change the result and are answered without a search.
+
+        Parameters
+        ----------
+        knockouts : collections.abc.Iterable[collections.abc.Iterable[int]]
+            Sets of reactions knocked out together, e.g. single and double
+            knockouts.
+        sources, targets : collections.abc.Iterable[str]
+            Labelled atoms and atoms of interest.
+
+        Returns
+        -------
+        list[KnockoutResult]
+        """
+        base = self._base(transitions)
+        full = ATNView(self, base)
+        source_rows = [self.node_index[node] for node in sources]
+        target_rows = np.array([self.node_index[node] for node in targets], dtype=np.int64)
+        reached = full._reached(source_rows)
+        used = reached[self.sources] & base
+        reference = KnockoutResult(None, int(reached.sum()), bool(reached[target_rows].any()))
+
+        results = []
+        for reactions in knockouts:
+            reactions = tuple(reactions)
+            knocked = self._knocked(reactions)
+            if not (knocked & used).any():
+                results.append(reference._replace(reactions=reactions))
+                continue
+            view_reached = ATNView(self, base & ~knocked)._reached(source_rows)
+            results.append(KnockoutResult(reactions, int(view_reached.sum()), bool(view_reached[target_rows].any())))
+        return results
+
+
+class ATNView:
+    """
+    An edge mask over the arrays of :class:`ATNViews`.
+    """
+
+    def __init__(self, views, mask):
+        self.views = views
+        self.mask = mask
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    def csr(self):
+        """
+        Returns the edges of the view in CSR form, ``(indptr, indices)``.
+        """
+        counts = np.bincount(self.views.sources[self.mask], minlength=len(self.views.nodes))
+        return np.concatenate([[0], np.cumsum(counts)]), self.views.indices[self.mask]
+
+    def edges(self):
+        """
+        Returns the edges of the view as pairs of node labels.
+        """
+        nodes = self.views.nodes
+        return [(nodes[u], nodes[v]) for u, v in zip(self.views.sources[self.mask].tolist(),
+                                                     self.views.indices[self.mask].tolist())]
+
+    def _reached(self, source_rows):
+        # a virtual node pointing to all sources gives a multi source search
+        n_nodes = len(self.views.nodes)
+        indptr, indices = self.csr()
+        indptr = np.concatenate([indptr, [indptr[-1] + len(source_rows)]])
+        indices = np.concatenate([indices, np.asarray(source_rows, dtype=np.int64)])
+        graph = csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(n_nodes + 1, n_nodes + 1))
+        reached = np.zeros(n_nodes + 1, dtype=bool)
+        reached[breadth_first_order(graph, n_nodes, directed=True, return_predecessors=False)] = True
+        return reached[:n_nodes]
+
+    def reachable(self, sources):
+        """
+        Returns the atoms label on `sources` can reach in the view, `sources`
+        included.
+        """
+        reached = self._reached([self.views.node_index[node] for node in sources])
+        return [self.views.nodes[i] for i in np.flatnonzero(reached)]
+
+    def can_reach(self, source, target):
+        """
+        Returns whether label on `source` can reach `target` in the view.
+        """
+        return bool(self._reached([self.views.node_index[source]])[self.views.node_index[target]])
+
+    def reachability(self):
+        """
+        Returns a :class:`atn.reachability.ReachabilityIndex` of the view, for
+        many queries on the same view.
+        """
+        indptr, indices = self.csr()
+        return ReachabilityIndex(self.views.nodes, indptr, indices, self.views.arrays.compounds)
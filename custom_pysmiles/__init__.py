@@ -17,7 +17,16 @@
 PySMILES: The lightweight python module for reading and writing SMILES strings.
 """
 
+# Bump when parsing or canonical output changes, libraries of prepared
+# compounds record it and are invalidated
+__version__ = '1.1.0'
+
+from .molecule import Molecule
 from .read_smiles import read_smiles
+from .read_many import read_smiles_many, SmilesError
+from .read_rdkit import read_rdkit_mol
 from .write_smiles import write_smiles
 from .smiles_helper import (fill_valence, add_explicit_hydrogens,
-                            remove_explicit_hydrogens, correct_aromatic_rings)
+                            remove_explicit_hydrogens, correct_aromatic_rings,
+                            add_explicit_hydrogens_many,
+                            remove_explicit_hydrogens_many)
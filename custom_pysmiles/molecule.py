@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Peter C Kroon
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Contains an array backed molecule, with the valence, aromaticity and
+hydrogen helpers vectorised over its atoms and bonds.
+"""
+
+import networkx as nx
+import numpy as np
+
+from .smiles_helper import VALENCES, AROMATIC_ATOMS, _hydrogen_keys
+
+# Element codes are atomic numbers, 0 is the unknown element '*'
+ELEMENTS = ('*',
+            'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg',
+            'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr',
+            'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br',
+            'Kr', 'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd',
+            'Ag', 'Cd', 'In', 'Sn', 'Sb', 'Te', 'I', 'Xe', 'Cs', 'Ba', 'La',
+            'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er',
+            'Tm', 'Yb', 'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au',
+            'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn', 'Fr', 'Ra', 'Ac', 'Th',
+            'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md',
+            'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn',
+            'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og')
+ELEMENT_CODES = {element: code for code, element in enumerate(ELEMENTS)}
+HYDROGEN = ELEMENT_CODES['H']
+
+# VALENCES per element code, padded with -1. Elements without valences only
+# have padding.
+_VALENCE_TABLE = np.full((len(ELEMENTS), max(map(len, VALENCES.values()))), -1)
+for _element, _valences in VALENCES.items():
+    _VALENCE_TABLE[ELEMENT_CODES[_element], :len(_valences)] = _valences
+_AROMATIC_CODES = np.array([ELEMENT_CODES[element] for element in AROMATIC_ATOMS])
+_LONE_PAIR_CODES = np.array([ELEMENT_CODES[element] for element in ('N', 'P', 'As')])
+_EXTRA_ELECTRON_CODES = np.array([ELEMENT_CODES[element] for element in ('O', 'S', 'Se')])
+
+
+class Molecule:
+    """
+    A molecule stored as arrays over its atoms and bonds.
+
+    Absent attributes are stored as -1, for 'hcount' this means the hydrogen
+    count is not known. Atom positions are the node keys, unless `labels` are
+    set.
+
+    Attributes
+    ----------
+    element : np.ndarray
+        Element codes, indices into `ELEMENTS`.
+    charge, hcount, isotope, atom_class : np.ndarray
+        The 'charge', 'hcount', 'isotope' and 'class' of every atom.
+    aromatic : np.ndarray
+        Whether the atoms are aromatic.
+    bracket : np.ndarray
+        Whether the atoms were written in brackets or as '*', this only
+        decides the order of node attributes in :meth:`to_networkx`.
+    stereo : np.ndarray
+        The 'stereo' of every atom, None if absent.
+    bonds : np.ndarray
+        The bonded atom positions, one row per bond, in the order the bonds
+        were made.
+    order : np.ndarray
+        The bond orders.
+    labels : list
+        The node keys of the atoms, None if they are the positions.
+    """
+
+    def __init__(self, element, charge, hcount, isotope, atom_class, aromatic,
+                 bracket, stereo, bonds, order, labels=None):
+        self.element = element
+        self.charge = charge
+        self.hcount = hcount
+        self.isotope = isotope
+        self.atom_class = atom_class
+        self.aromatic = aromatic
+        self.bracket = bracket
+        self.stereo = stereo
+        self.bonds = bonds
+        self.order = order
+        self.labels = labels
+
+    @classmethod
+    def from_atoms(cls, atoms, bonds):
+        """
+        Builds a molecule from parsed atoms and bonds.
+
+        Parameters
+        ----------
+        atoms : list[dict]
+            The atoms as returned by
+            :func:`~custom_pysmiles.smiles_helper.parse_atom`.
+        bonds : list[tuple(int, int, float)]
+            The bonds between atom positions with their orders.
+
+        Returns
+        -------
+        Molecule
+        """
+        try:
+            element = [ELEMENT_CODES[atom.get('element', '*')] for atom in atoms]
+        except KeyError as error:
+            raise ValueError('Unknown element {}'.format(error.args[0])) from None
+        bond_array = np.array([bond[:2] for bond in bonds], dtype=np.int64).reshape(-1, 2)
+        return cls(np.array(element, dtype=np.int16),
+                   np.array([atom['charge'] for atom in atoms], dtype=np.int16),
+                   np.array([atom.get('hcount', -1) for atom in atoms], dtype=np.int16),
+                   np.array([atom.get('isotope', -1) for atom in atoms], dtype=np.int32),
+                   np.array([atom.get('class', -1) for atom in atoms], dtype=np.int64),
+                   np.array([atom['aromatic'] for atom in atoms], dtype=bool),
+                   np.array(['hcount' in atom for atom in atoms], dtype=bool),
+                   np.array([atom.get('stereo') for atom in atoms], dtype=object),
+                   bond_array,
+                   np.array([bond[2] for bond in bonds], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.element)
+
+    def _atoms(self):
+        # The attributes of the atoms, in the key order parse_atom gives them
+        columns = zip(self.element.tolist(), self.charge.tolist(), self.hcount.tolist(),
+                      self.isotope.tolist(), self.atom_class.tolist(), self.aromatic.tolist(),
+                      self.bracket.tolist(), self.stereo.tolist())
+        for element, charge, hcount, isotope, class_, aromatic, bracket, stereo in columns:
+            if not bracket:
+                node = {'element': ELEMENTS[element], 'charge': charge, 'aromatic': aromatic}
+                if hcount >= 0:
+                    node['hcount'] = hcount
+                yield node
+                continue
+            node = {'charge': charge}
+            if hcount >= 0:
+                node['hcount'] = hcount
+            node['aromatic'] = aromatic
+            if isotope >= 0:
+                node['isotope'] = isotope
+            if element:
+                node['element'] = ELEMENTS[element]
+            if stereo is not None:
+                node['stereo'] = stereo
+            if class_ >= 0:
+                node['class'] = class_
+            yield node
+
+    def nodes(self):
+        """
+        Returns the node keys of the atoms.
+        """
+        return list(range(len(self))) if self.labels is None else list(self.labels)
+
+    def to_networkx(self):
+        """
+        Converts the molecule to the graph `read_smiles` gives, with the
+        same nodes, attributes and neighbour order.
+
+        Returns
+        -------
+        nx.Graph
+        """
+        nodes = self.nodes()
+        mol = nx.Graph()
+        mol.add_nodes_from(zip(nodes, self._atoms()))
+        # Orders are ints, apart from aromatic ones
+        mol.add_edges_from((nodes[idx], nodes[jdx], {'order': int(order) if order.is_integer() else order})
+                           for (idx, jdx), order in zip(self.bonds.tolist(), self.order.tolist()))
+        return mol
+
+    def _skeleton(self):
+        # Atom positions and bonds only, in the same order as to_networkx
+        mol = nx.Graph()
+        mol.add_nodes_from(range(len(self)))
+        mol.add_edges_from(self.bonds.tolist())
+        return mol
+
+    def degree(self):
+        """
+        Returns the number of bonds of every atom.
+        """
+        return np.bincount(self.bonds.ravel(), minlength=len(self))
+
+    def bond_sums(self, use_order=True):
+        """
+        Returns how many explicit bonds every atom has, see
+        :func:`~custom_pysmiles.smiles_helper._bonds`.
+        """
+        if not use_order:
+            return self.degree()
+        return np.bincount(self.bonds.ravel(), weights=np.repeat(self.order, 2), minlength=len(self))
+
+    def valence(self, minimum=0):
+        """
+        Returns the smallest valence of every atom that is at least `minimum`,
+        the largest if there is none, see
+        :func:`~custom_pysmiles.smiles_helper._valence`.
+        """
+        valences = _VALENCE_TABLE[self.element]
+        large = np.where(valences >= np.reshape(minimum, (-1, 1)), valences, np.inf).min(axis=1)
+        return np.maximum(np.where(np.isinf(large), valences.max(axis=1), large), 0)
+
+    def bonds_missing(self, use_order=True):
+        """
+        Returns how much every atom is under valence, see
+        :func:`~custom_pysmiles.smiles_helper.bonds_missing`.
+        """
+        bonds = self.bond_sums(use_order) + np.maximum(self.hcount, 0)
+        return np.trunc(self.valence(bonds) - bonds).astype(np.int64)
+
+    def fill_valence(self, respect_hcount=True, respect_bond_order=True, max_bond_order=3):
+        """
+        Sets the hydrogen count of all atoms that don't have it yet, see
+        :func:`~custom_pysmiles.smiles_helper.fill_valence`.
+        """
+        if not respect_bond_order:
+            self.increment_bond_orders(max_bond_order)
+        missing = np.maximum(self.bonds_missing(), 0)
+        fill = self.hcount < 0 if respect_hcount else np.ones(len(self), dtype=bool)
+        self.hcount[fill] = np.maximum(self.hcount[fill], 0) + missing[fill]
+
+    def _edge_order(self):
+        # The bonds in the order nx.Graph.edges lists them: by first atom,
+        # then by neighbour order
+        n_bonds = len(self.bonds)
+        ends = np.concatenate([self.bonds[:, 0], self.bonds[:, 1]])
+        which = np.concatenate([np.arange(n_bonds), np.arange(n_bonds)])
+        by_atom = np.lexsort((which, ends))
+        seen = np.zeros(n_bonds, dtype=bool)
+        edges = []
+        for bond in which[by_atom].tolist():
+            if not seen[bond]:
+                seen[bond] = True
+                edges.append(bond)
+        return edges
+
+    def increment_bond_orders(self, max_bond_order=3):
+        """
+        Increments bond orders up to what the atom's valence allows, see
+        :func:`~custom_pysmiles.smiles_helper.increment_bond_orders`.
+        """
+        missing = np.maximum(self.bonds_missing(), 0).tolist()
+        bonds = self.bonds.tolist()
+        for bond in self._edge_order():
+            idx, jdx = bonds[bond]
+            current_order = self.order[bond]
+            edge_missing = min(missing[idx], missing[jdx])
+            if current_order == 1.5:
+                continue
+            self.order[bond] = min(edge_missing + current_order, max_bond_order)
+            missing[idx] -= edge_missing
+            missing[jdx] -= edge_missing
+
+    def _hydrogen_neighbours(self):
+        # Per atom the number of hydrogen atoms bonded to it with order 1
+        single = self.order == 1
+        counts = np.zeros(len(self), dtype=np.int64)
+        for this, other in ((0, 1), (1, 0)):
+            hydrogen = single & (self.element[self.bonds[:, other]] == HYDROGEN)
+            counts += np.bincount(self.bonds[hydrogen, this], minlength=len(self))
+        return counts
+
+    def mark_aromatic_atoms(self, atoms=None):
+        """
+        Sets the aromatic flag of all atoms, see
+        :func:`~custom_pysmiles.smiles_helper.mark_aromatic_atoms`. Only the
+        cycle basis is found with networkx.
+
+        Parameters
+        ----------
+        atoms : collections.abc.Iterable[int]
+            The atom positions to act on. Will still analyse the full
+            molecule.
+        """
+        hcount = np.maximum(self.hcount, 0)
+        degree = self.degree() + hcount
+        hcount = hcount + self._hydrogen_neighbours()
+        maybe = np.isin(self.element, _AROMATIC_CODES) & ((degree == 2) | (degree == 3))
+        electrons = (np.isin(self.element, _LONE_PAIR_CODES) & (hcount == 1)).astype(np.int64)
+        electrons += np.isin(self.element, _EXTRA_ELECTRON_CODES)
+        electrons -= (self.charge == 1) & ~((self.element == ELEMENT_CODES['C']) & (hcount == 0))
+
+        aromatic = np.zeros(len(self), dtype=bool)
+        for cycle in nx.cycle_basis(self._skeleton()):
+            if maybe[cycle].all() and (len(cycle) + electrons[cycle].sum()) % 2 == 0:
+                aromatic[cycle] = True
+        if atoms is None:
+            self.aromatic = aromatic
+        else:
+            atoms = np.fromiter(atoms, dtype=np.int64)
+            self.aromatic[atoms] = aromatic[atoms]
+
+    def ring_bonds(self):
+        """
+        Returns which bonds are part of a ring, i.e. are not bridges.
+        """
+        bridges = {frozenset(edge) for edge in nx.bridges(self._skeleton())}
+        return np.array([frozenset(bond) not in bridges for bond in self.bonds.tolist()], dtype=bool)
+
+    def mark_aromatic_edges(self, rings=None):
+        """
+        Sets all ring bonds between aromatic atoms to 1.5, see
+        :func:`~custom_pysmiles.smiles_helper.mark_aromatic_edges`.
+
+        Parameters
+        ----------
+        rings : np.ndarray
+            Which bonds are ring bonds, found if not given.
+        """
+        if rings is None:
+            rings = self.ring_bonds()
+        both = self.aromatic[self.bonds[:, 0]] & self.aromatic[self.bonds[:, 1]]
+        self.order[rings & both] = 1.5
+
+    def _keep(self, keep):
+        # Removes the atoms not in `keep`, with their bonds
+        positions = np.flatnonzero(keep)
+        new = np.full(len(self), -1, dtype=np.int64)
+        new[positions] = np.arange(len(positions))
+        kept_bonds = keep[self.bonds].all(axis=1)
+        labels = self.nodes()
+        for name in ('element', 'charge', 'hcount', 'isotope', 'atom_class', 'aromatic', 'bracket', 'stereo'):
+            setattr(self, name, getattr(self, name)[positions])
+        self.bonds = new[self.bonds[kept_bonds]].reshape(-1, 2)
+        self.order = self.order[kept_bonds]
+        self.labels = [labels[position] for position in positions.tolist()]
+
+    def remove_explicit_hydrogens(self):
+        """
+        Removes all explicit, simple hydrogens, see
+        :func:`~custom_pysmiles.smiles_helper.remove_explicit_hydrogens`.
+        Remaining atoms keep their node keys.
+        """
+        simple = ((self.element == HYDROGEN) & (self.charge == 0) & (self.isotope < 0)
+                  & (self.degree() == 1))
+        remove = np.zeros(len(self), dtype=bool)
+        for this, other in ((0, 1), (1, 0)):
+            hydrogens, neighbours = self.bonds[:, this], self.bonds[:, other]
+            removed = (simple[hydrogens] & (self.element[neighbours] != HYDROGEN)
+                       & (self.order == 1))
+            remove[hydrogens[removed]] = True
+            self.hcount[neighbours[removed]] = np.maximum(self.hcount[neighbours[removed]], 0)
+            # once per removed hydrogen, also for repeated neighbours
+            np.add.at(self.hcount, neighbours[removed], 1)
+        self.hcount[self.hcount < 0] = 0
+        self._keep(~remove)
+
+    def add_explicit_hydrogens(self, prefix=""):
+        """
+        Adds explicit hydrogen atoms for the hydrogen count of every atom, see
+        :func:`~custom_pysmiles.smiles_helper.add_explicit_hydrogens`. The
+        hydrogen counts are removed.
+        """
+        counts = np.maximum(self.hcount, 0)
+        n_atoms, n_hydrogens = len(self), int(counts.sum())
+        labels = self.nodes()
+        labels += _hydrogen_keys(set(labels), prefix, n_hydrogens)
+        hydrogen = {'element': HYDROGEN, 'charge': 0, 'hcount': -1, 'isotope': -1, 'atom_class': -1,
+                    'aromatic': False, 'bracket': True, 'stereo': None}
+        for name, value in hydrogen.items():
+            values = getattr(self, name)
+            setattr(self, name, np.concatenate([values, np.full(n_hydrogens, value, dtype=values.dtype)]))
+        self.hcount[:] = -1
+        heavy = np.repeat(np.arange(n_atoms), counts)
+        self.bonds = np.concatenate([self.bonds, np.column_stack([heavy, np.arange(n_atoms, n_atoms + n_hydrogens)])])
+        self.order = np.concatenate([self.order, np.ones(n_hydrogens)])
+        self.labels = labels
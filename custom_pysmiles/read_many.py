@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Peter C Kroon
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Exposes functionality for parsing many SMILES strings at once, optionally in
+several processes.
+"""
+
+from collections import namedtuple
+import functools
+import logging
+import multiprocessing
+import time
+
+from .read_smiles import read_smiles
+
+LOGGER = logging.getLogger(__name__)
+
+SmilesError = namedtuple('SmilesError', ['index', 'smiles', 'error'])
+SmilesError.__doc__ = """
+The SMILES string at position `index` of a batch could not be parsed, `error`
+describes the exception raised.
+"""
+
+
+def _read_smiles_job(job, **kwargs):
+    """
+    Parses one SMILES string of a batch, returning a :class:`SmilesError`
+    instead of raising.
+    """
+    index, smiles = job
+    try:
+        return read_smiles(smiles, **kwargs)
+    except Exception as error:  # pylint: disable=broad-except
+        return SmilesError(index, smiles, '{}: {}'.format(type(error).__name__, error))
+
+
+def read_smiles_many(smiles_iterable, workers=1, chunksize=64, **kwargs):
+    """
+    Parses many SMILES strings. A string that can not be parsed does not stop
+    the batch, it gives a :class:`SmilesError` in its place. The number of
+    strings parsed per second is logged.
+
+    Parameters
+    ----------
+    smiles_iterable : collections.abc.Iterable[str]
+        The SMILES strings to parse.
+    workers : int
+        Number of processes parsing. With a single worker everything runs in
+        this process.
+    chunksize : int
+        Number of strings handed to a worker at once.
+    kwargs
+        Passed on to :func:`~custom_pysmiles.read_smiles.read_smiles`, e.g.
+        ``arrays=True`` for compact molecules.
+
+    Returns
+    -------
+    list[nx.Graph or custom_pysmiles.molecule.Molecule or SmilesError]
+        The molecules, or errors, in the order of `smiles_iterable`.
+    """
+    start = time.perf_counter()
+    jobs = enumerate(smiles_iterable)
+    job = functools.partial(_read_smiles_job, **kwargs)
+    if workers <= 1:
+        molecules = [job(item) for item in jobs]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            molecules = list(pool.imap(job, jobs, chunksize))
+    seconds = time.perf_counter() - start
+    errors = sum(isinstance(molecule, SmilesError) for molecule in molecules)
+    LOGGER.info("Parsed %d SMILES (%d errors) in %.2f s with %d workers, %.0f per second",
+                len(molecules), errors, seconds, max(workers, 1), len(molecules) / seconds if seconds else 0)
+    return molecules
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Peter C Kroon
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Exposes functionality for converting RDKit molecules, without writing and
+parsing a SMILES string in between. RDKit itself is not imported, only the
+methods of the molecule are used.
+"""
+
+import networkx as nx
+
+from .smiles_helper import mark_aromatic_edges
+
+# The orders read_smiles gives the bonds as written by RDKit, by the RDKit
+# bond order. Other bonds are written without a symbol read_smiles
+# understands, and get the default.
+BOND_ORDERS = {1.0: 1, 2.0: 2, 3.0: 3, 4.0: 4, 1.5: 1.5}
+
+
+def _output_order(rdmol, prop):
+    """
+    Returns the indices stored in the `prop` property of `rdmol` by the
+    SMILES writer, or None if there is none.
+    """
+    if not rdmol.HasProp(prop):
+        return None
+    return [int(idx) for idx in rdmol.GetProp(prop).strip('[]').split(',') if idx]
+
+
+def read_rdkit_mol(rdmol):
+    """
+    Converts an RDKit molecule to the graph `read_smiles` gives for the SMILES
+    RDKit writes of it with ``allHsExplicit=True``.
+
+    Nodes and bonds are added in the order of the SMILES last written from
+    `rdmol`, if any, so the graph equals the parsed SMILES including the
+    order of nodes and neighbours. Otherwise the RDKit atom and bond order is
+    used.
+
+    The fragments of a written SMILES are bonded with order 0, like
+    `read_smiles` does for the '.' between them.
+
+    Note
+    ----
+    Stereochemical information is discarded.
+
+    Parameters
+    ----------
+    rdmol : rdkit.Chem.Mol
+        The molecule to convert.
+
+    Returns
+    -------
+    nx.Graph
+        A graph describing a molecule. Nodes will have an 'element',
+        'aromatic', 'charge' and 'hcount', and if set in `rdmol` 'isotope' and
+        'class'. Edges will have an 'order'.
+    """
+    atom_order = _output_order(rdmol, '_smilesAtomOutputOrder')
+    bond_order = _output_order(rdmol, '_smilesBondOutputOrder')
+    written = atom_order is not None and bond_order is not None
+    if not written:
+        atom_order = range(rdmol.GetNumAtoms())
+        bond_order = range(rdmol.GetNumBonds())
+
+    nodes = []
+    idxs = {}
+    for idx, atom_idx in enumerate(atom_order):
+        atom = rdmol.GetAtomWithIdx(atom_idx)
+        # Same attributes, in the same order, as parse_atom
+        node = {'charge': atom.GetFormalCharge(), 'hcount': atom.GetTotalNumHs(),
+                'aromatic': atom.GetIsAromatic()}
+        if atom.GetIsotope():
+            node['isotope'] = atom.GetIsotope()
+        element = atom.GetSymbol()
+        if element != '*':
+            node['element'] = element
+        if atom.GetAtomMapNum():
+            node['class'] = atom.GetAtomMapNum()
+        nodes.append((idx, node))
+        idxs[atom_idx] = idx
+
+    ring_bonds = {bond_idx for ring in rdmol.GetRingInfo().BondRings() for bond_idx in ring}
+    bonds = []
+    rings = set()
+    for bond_idx in bond_order:
+        bond = rdmol.GetBondWithIdx(bond_idx)
+        idx, jdx = idxs[bond.GetBeginAtomIdx()], idxs[bond.GetEndAtomIdx()]
+        bonds.append((idx, jdx, BOND_ORDERS.get(bond.GetBondTypeAsDouble(), 1)))
+        if bond_idx in ring_bonds:
+            rings.add(frozenset((idx, jdx)))
+    if written:
+        bonds = _join_fragments(len(idxs), bonds)
+    mol = nx.Graph()
+    mol.add_nodes_from(nodes)
+    mol.add_edges_from((idx, jdx, {'order': order}) for idx, jdx, order in bonds)
+
+    # The bonds between fragments are not in rings
+    mark_aromatic_edges(mol, rings)
+    return mol
+
+
+def _join_fragments(n_atoms, bonds):
+    """
+    Adds the bonds of order 0 read_smiles makes for the '.' between the
+    fragments of a written SMILES, from the anchor at the end of a fragment
+    to the first atom of the next one.
+
+    Parameters
+    ----------
+    n_atoms : int
+        The number of atoms.
+    bonds : list[tuple(int, int, float)]
+        The bonds between atoms in SMILES order, in the order they are read.
+
+    Returns
+    -------
+    list[tuple(int, int, float)]
+        `bonds` with the bonds between fragments inserted where they are read.
+    """
+    # The bond that first reaches an atom from an earlier one is the bond
+    # to its anchor, ring closures come later.
+    parents = [None] * n_atoms
+    children = [[] for _ in range(n_atoms)]
+    for idx, jdx, _ in bonds:
+        idx, jdx = min(idx, jdx), max(idx, jdx)
+        if parents[jdx] is None:
+            parents[jdx] = idx
+            children[idx].append(jdx)
+    roots = [idx for idx in range(1, n_atoms) if parents[idx] is None]
+    if not roots:
+        return bonds
+
+    # Branches are closed at the end of a fragment, the anchor is the end of
+    # its main chain, reached through the last written children.
+    joins = []
+    start = 0
+    for root in roots:
+        anchor = start
+        while children[anchor]:
+            anchor = max(children[anchor])
+        joins.append((anchor, root, 0))
+        start = root
+    joined = []
+    for idx, jdx, order in bonds:
+        while joins and max(idx, jdx) >= joins[0][1]:
+            joined.append(joins.pop(0))
+        joined.append((idx, jdx, order))
+    return joined + joins
@@ -17,14 +17,17 @@
 Exposes functionality needed for parsing SMILES strings.
 """
 
+import re
 import enum
 import logging
 
 import networkx as nx
+import numpy as np
 
+from .molecule import Molecule
 from .smiles_helper import (add_explicit_hydrogens, remove_explicit_hydrogens,
                             parse_atom, fill_valence, mark_aromatic_edges,
-                            mark_aromatic_atoms)
+                            mark_aromatic_atoms, ring_edges)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -39,6 +42,23 @@ class TokenType(enum.Enum):
     EZSTEREO = 6
 
 
+# One alternative per token type, tried in this order. Characters matching
+# none of them are skipped, unless they are digits.
+_TOKEN_PATTERN = re.compile(r"""
+    (\[[^\]]*\]?)               # 1: bracket atom, unterminated at the end
+  | (Cl|Br|[BCNOPSFI*bcnosp])   # 2: organic subset atom
+  | ([-=#$:.])                  # 3: bond type
+  | (\()                        # 4: branch start
+  | (\))                        # 5: branch end
+  | ([/\\])                     # 6: E/Z marker
+  | %(.{0,2})                   # 7: two digit ring number
+  | ([0-9])                     # 8: ring number
+  | (.)                         # 9: anything else
+""", re.VERBOSE | re.DOTALL)
+_TOKEN_TYPES = (None, TokenType.ATOM, TokenType.ATOM, TokenType.BOND_TYPE,
+                TokenType.BRANCH_START, TokenType.BRANCH_END, TokenType.EZSTEREO)
+
+
 def _tokenize(smiles):
     """
     Iterates over a SMILES string, yielding tokens.
@@ -53,46 +73,82 @@ def _tokenize(smiles):
     tuple(TokenType, str)
         A tuple describing the type of token and the associated data
     """
-    organic_subset = 'B C N O P S F Cl Br I * b c n o s p'.split()
-    smiles = iter(smiles)
-    token = ''
-    peek = None
-    while True:
-        char = peek if peek else next(smiles, '')
-        peek = None
-        if not char:
-            break
-        if char == '[':
-            token = char
-            for char in smiles:
-                token += char
-                if char == ']':
-                    break
-            yield TokenType.ATOM, token
-        elif char in organic_subset:
-            peek = next(smiles, '')
-            if char + peek in organic_subset:
-                yield TokenType.ATOM, char + peek
-                peek = None
-            else:
-                yield TokenType.ATOM, char
-        elif char in '-=#$:.':
-            yield TokenType.BOND_TYPE, char
-        elif char == '(':
-            yield TokenType.BRANCH_START, '('
-        elif char == ')':
-            yield TokenType.BRANCH_END, ')'
-        elif char == '%':
-            # If smiles is too short this will raise a ValueError, which is
-            # (slightly) prettier than a StopIteration.
-            yield TokenType.RING_NUM, int(next(smiles, '') + next(smiles, ''))
-        elif char in '/\\':
-            yield TokenType.EZSTEREO, char
-        elif char.isdigit():
-            yield TokenType.RING_NUM, int(char)
-
-
-def read_smiles(smiles, keep_hydrogens_as_read=True, explicit_hydrogen=False, add_missing_hydrogen=False, zero_order_bonds=True, reinterpret_aromatic=False):
+    if not isinstance(smiles, str):
+        smiles = ''.join(smiles)
+    for match in _TOKEN_PATTERN.finditer(smiles):
+        group = match.lastindex
+        token = match.group(group)
+        if group < 7:
+            yield _TOKEN_TYPES[group], token
+        elif group < 9 or token.isdigit():
+            # If smiles is too short after a '%' this will raise a ValueError
+            yield TokenType.RING_NUM, int(token)
+
+
+def _ring_edges(parents, depths, closures):
+    """
+    Finds the ring bonds of a molecule from its parse tree: the ring closure
+    bonds and the tree bonds on the tree paths between their atoms. Covered
+    tree bonds are contracted, so every tree bond is walked at most once.
+
+    Parameters
+    ----------
+    parents : list
+        Per atom the atom it is bonded to in the parse tree, None for roots.
+    depths : list[int]
+        Per atom its depth in the parse tree.
+    closures : list[tuple(int, int)]
+        The ring closure bonds. Both atoms must be in the same tree.
+
+    Returns
+    -------
+    set[frozenset]
+        The ring bonds as pairs of atom indices.
+    """
+    tops = list(range(len(parents)))
+
+    def find(idx):
+        while tops[idx] != idx:
+            tops[idx] = tops[tops[idx]]
+            idx = tops[idx]
+        return idx
+
+    rings = set()
+    for idx, jdx in closures:
+        rings.add(frozenset((idx, jdx)))
+        idx, jdx = find(idx), find(jdx)
+        while idx != jdx:
+            if depths[idx] < depths[jdx]:
+                idx, jdx = jdx, idx
+            rings.add(frozenset((idx, parents[idx])))
+            tops[idx] = parents[idx]
+            idx = find(idx)
+    return rings
+
+
+def _prepare_arrays(mol, rings, keep_hydrogens_as_read, explicit_hydrogen,
+                    add_missing_hydrogen, reinterpret_aromatic):
+    """
+    Does what `read_smiles` does after parsing, on a
+    :class:`~custom_pysmiles.molecule.Molecule` with ring bonds `rings`.
+    """
+    mol.mark_aromatic_edges(rings)
+    if add_missing_hydrogen and not keep_hydrogens_as_read:
+        mol.fill_valence()
+    if reinterpret_aromatic:
+        mol.mark_aromatic_atoms()
+        mol.mark_aromatic_edges(rings)
+        aromatic = mol.aromatic[mol.bonds].all(axis=1)
+        mol.order[~aromatic & (mol.order == 1.5)] = 1
+    if not keep_hydrogens_as_read:
+        if explicit_hydrogen:
+            mol.add_explicit_hydrogens()
+        else:
+            mol.remove_explicit_hydrogens()
+    return mol
+
+
+def read_smiles(smiles, keep_hydrogens_as_read=True, explicit_hydrogen=False, add_missing_hydrogen=False, zero_order_bonds=True, reinterpret_aromatic=False, arrays=False):
     """
     Parses a SMILES string.
 
@@ -111,10 +167,13 @@ def read_smiles(smiles, keep_hydrogens_as_read=True, explicit_hydrogen=False, ad
     reinterprit_aromatic : bool
         Whether aromaticity should be determined from the created molecule,
         instead of taken from the SMILES string. WARNING: likely Wrong
+    arrays : bool
+        Whether to return a :class:`~custom_pysmiles.molecule.Molecule`
+        instead of a graph. Its `to_networkx` gives the graph.
 
     Returns
     -------
-    nx.Graph
+    nx.Graph or custom_pysmiles.molecule.Molecule
         A graph describing a molecule. Nodes will have an 'element', 'aromatic'
         and a 'charge', and if `explicit_hydrogen` is False a 'hcount'.
         Depending on the input, they will also have 'isotope' and 'class'
@@ -122,21 +181,36 @@ def read_smiles(smiles, keep_hydrogens_as_read=True, explicit_hydrogen=False, ad
         Edges will have an 'order'.
     """
     bond_to_order = {'-': 1, '=': 2, '#': 3, '$': 4, ':': 1.5, '.': 0}
-    mol = nx.Graph()
+    atoms = []
+    bonds = []
+    bonded = set()
     anchor = None
     idx = 0
     default_bond = 1
     next_bond = None
     branches = []
     ring_nums = {}
+    # The bonds between atoms and their anchors form a forest, the parse
+    # tree, with the atoms in preorder. Ring bonds are found from it.
+    parents = []
+    depths = []
+    roots = []
+    closures = []
     for tokentype, token in _tokenize(smiles):
         if tokentype == TokenType.ATOM:
-            mol.add_node(idx, **parse_atom(token))
+            atoms.append(parse_atom(token))
+            parents.append(None)
+            depths.append(0)
+            roots.append(idx)
             if anchor is not None:
                 if next_bond is None:
                     next_bond = default_bond
                 if next_bond or zero_order_bonds:
-                    mol.add_edge(anchor, idx, order=next_bond)
+                    bonds.append((anchor, idx, next_bond))
+                    bonded.add(frozenset((anchor, idx)))
+                    parents[idx] = anchor
+                    depths[idx] = depths[anchor] + 1
+                    roots[idx] = roots[anchor]
                 next_bond = None
             anchor = idx
             idx += 1
@@ -162,14 +236,16 @@ def read_smiles(smiles, keep_hydrogens_as_read=True, explicit_hydrogen=False, ad
                     raise ValueError('Conflicting bond orders for ring '
                                      'between indices {}'.format(token))
                 # idx is the index of the *next* atom we're adding. So: -1.
-                if mol.has_edge(idx-1, jdx):
+                if frozenset((idx-1, jdx)) in bonded:
                     raise ValueError('Edge specified by marker {} already '
                                      'exists'.format(token))
                 if idx-1 == jdx:
                     raise ValueError('Marker {} specifies a bond between an '
                                      'atom and itself'.format(token))
                 if next_bond or zero_order_bonds:
-                    mol.add_edge(idx - 1, jdx, order=next_bond)
+                    bonds.append((idx - 1, jdx, next_bond))
+                    bonded.add(frozenset((idx - 1, jdx)))
+                    closures.append((jdx, idx - 1))
                 next_bond = None
                 del ring_nums[token]
             else:
@@ -184,27 +260,47 @@ def read_smiles(smiles, keep_hydrogens_as_read=True, explicit_hydrogen=False, ad
     if ring_nums:
         raise KeyError('Unmatched ring indices {}'.format(list(ring_nums.keys())))
 
+    if arrays:
+        mol = Molecule.from_atoms(atoms, bonds)
+    else:
+        mol = nx.Graph()
+        mol.add_nodes_from(enumerate(atoms))
+        mol.add_edges_from((idx, jdx, {'order': order}) for idx, jdx, order in bonds)
+
     # Time to deal with aromaticity. This is a mess, because it's not super
     # clear what aromaticity information has been provided, and what should be
     # inferred. In addition, to what extend do we want to provide a "sane"
     # molecule, even if this overrides what the SMILES string specifies?
-    cycles = nx.cycle_basis(mol)
+    if all(roots[idx] == roots[jdx] for idx, jdx in closures):
+        rings = _ring_edges(parents, depths, closures)
+    else:
+        # Ring bonds between parse trees, only possible without zero order
+        # bonds.
+        skeleton = nx.Graph()
+        skeleton.add_nodes_from(range(idx))
+        skeleton.add_edges_from(bond[:2] for bond in bonds)
+        rings = ring_edges(skeleton)
     ring_idxs = set()
-    for cycle in cycles:
-        ring_idxs.update(cycle)
-    non_ring_idxs = set(mol.nodes) - ring_idxs
+    for edge in rings:
+        ring_idxs.update(edge)
+    non_ring_idxs = set(range(idx)) - ring_idxs
     for n_idx in non_ring_idxs:
-        if mol.nodes[n_idx].get('aromatic', False):
+        if atoms[n_idx].get('aromatic', False):
             raise ValueError("You specified an aromatic atom outside of a"
                              " ring. This is impossible")
-    
-    mark_aromatic_edges(mol)
+
+    if arrays:
+        return _prepare_arrays(mol, np.array([frozenset(bond[:2]) in rings for bond in bonds], dtype=bool),
+                               keep_hydrogens_as_read, explicit_hydrogen, add_missing_hydrogen,
+                               reinterpret_aromatic)
+
+    mark_aromatic_edges(mol, rings)
     
     if add_missing_hydrogen and not keep_hydrogens_as_read:
         fill_valence(mol)
     if reinterpret_aromatic:
         mark_aromatic_atoms(mol)
-        mark_aromatic_edges(mol)
+        mark_aromatic_edges(mol, rings)
         for idx, jdx in mol.edges:
             if ((not mol.nodes[idx].get('aromatic', False) or
                     not mol.nodes[jdx].get('aromatic', False))
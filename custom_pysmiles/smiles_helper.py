@@ -18,6 +18,7 @@ Contains helper functions for parsing and writing SMILES strings, as well as
 some convenience functions for adding hydrogens, and detecting aromaticity.
 """
 
+import functools
 import logging
 import re
 import operator
@@ -36,6 +37,9 @@ CLASS_PATTERN = r'(?::(?P<class>[\d]+))?'
 ATOM_PATTERN = re.compile(r'^\[' + ISOTOPE_PATTERN + ELEMENT_PATTERN +
                           STEREO_PATTERN + HCOUNT_PATTERN + CHARGE_PATTERN +
                           CLASS_PATTERN + r'\]$')
+# The atom class of a bracket atom, split off before parsing so atoms that
+# only differ by it share a cache entry.
+ATOM_CLASS_PATTERN = re.compile(r':(?P<class>[\d]+)\]$')
 
 VALENCES = {"B": (3,), "C": (4,), "N": (3, 5), "O": (2,), "P": (3, 5),
             "S": (2, 4, 6), "F": (1,), "Cl": (1,), "Br": (1,), "I": (1,)}
@@ -63,6 +67,29 @@ def parse_atom(atom):
         A dictionary containing at least 'element', 'aromatic', and 'charge'. If
         present, will also contain 'hcount', 'isotope', and 'class'.
     """
+    atom_key, class_ = atom, None
+    if atom.startswith('['):
+        match = ATOM_CLASS_PATTERN.search(atom)
+        if match is not None:
+            atom_key = atom[:match.start()] + ']'
+            class_ = int(match.group('class'))
+    parsed = _parse_atom(atom_key)
+    # An atom can't have two classes
+    if parsed is None or (class_ is not None and 'class' in parsed):
+        raise ValueError('The atom {} is malformatted'.format(atom))
+    # The cached dict is shared, callers get their own copy
+    out = parsed.copy()
+    if class_ is not None:
+        out['class'] = class_
+    return out
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_atom(atom):
+    """
+    Does the work of :func:`parse_atom` for atoms without class. Returns None
+    if `atom` is malformatted.
+    """
     defaults = {'charge': 0, 'hcount': 0, 'aromatic': False}
     if not atom.startswith('[') and not atom.endswith(']'):
         if atom != '*':
@@ -71,28 +98,18 @@ def parse_atom(atom):
             return {'element': atom.capitalize(), 'charge': 0,
                     'aromatic': atom.islower()}
         else:
-            return defaults.copy()
+            return defaults
     match = ATOM_PATTERN.match(atom)
     if match is None:
-        raise ValueError('The atom {} is malformatted'.format(atom))
-    out = defaults.copy()
+        return None
+    out = defaults
     out.update({k: v for k, v in match.groupdict().items() if v is not None})
 
     if out.get('element', 'X').islower():
         out['aromatic'] = True
 
-    parse_helpers = {
-        'isotope': int,
-        'element': str.capitalize,
-        'stereo': lambda x: x,
-        'hcount': parse_hcount,
-        'charge': parse_charge,
-        'class': int,
-        'aromatic': lambda x: x,
-    }
-
     for attr, val_str in out.items():
-        out[attr] = parse_helpers[attr](val_str)
+        out[attr] = _PARSE_HELPERS[attr](val_str)
 
     if out['element'] == '*':
         del out['element']
@@ -216,16 +233,49 @@ def parse_charge(charge_str):
     return charge
 
 
+_PARSE_HELPERS = {
+    'isotope': int,
+    'element': str.capitalize,
+    'stereo': lambda x: x,
+    'hcount': parse_hcount,
+    'charge': parse_charge,
+    'class': int,
+    'aromatic': lambda x: x,
+}
+
+
+def _hydrogen_keys(mol, prefix, count):
+    """
+    Returns `count` new node keys for hydrogens in `mol`: `prefix` followed by
+    the numbers from the number of nodes plus one upwards, skipping keys that
+    are already in `mol`.
+    """
+    keys = []
+    number = len(mol) + 1
+    while len(keys) < count:
+        key = prefix + str(number)
+        if key not in mol:
+            keys.append(key)
+        number += 1
+    return keys
+
+
 def add_explicit_hydrogens(mol, prefix=""):
     """
     Adds explicit hydrogen nodes to `mol`, the amount is determined by the node
     attribute 'hcount'. Will remove the 'hcount' attribute.
 
+    The new nodes are keyed `prefix` followed by consecutive numbers from the
+    number of nodes plus one, in the order of the atoms they are bonded to.
+    Numbers giving a key already in `mol` are skipped.
+
     Parameters
     ----------
     mol : nx.Graph
         The molecule to which explicit hydrogens should be added. Is modified
         in-place.
+    prefix : str
+        The prefix of the keys of the new nodes.
 
     Returns
     -------
@@ -235,14 +285,39 @@ def add_explicit_hydrogens(mol, prefix=""):
     h_atom = parse_atom('[H]')
     if 'hcount' in h_atom:
         del h_atom['hcount']
-    for n_idx in list(mol.nodes):
-        hcount = mol.nodes[n_idx].get('hcount', 0)
-        idxs = [ prefix + str(i) for i in range(len(mol.nodes()) + 1, len(mol.nodes()) + hcount + 1)]
-        # Get the defaults from parse_atom.
-        mol.add_nodes_from(idxs, **h_atom.copy())
-        mol.add_edges_from([(n_idx, jdx) for jdx in idxs], order=1)
-        if 'hcount' in mol.nodes[n_idx]:
-            del mol.nodes[n_idx]['hcount']
+    heavy_atoms = []
+    for n_idx, node in mol.nodes(data=True):
+        heavy_atoms.extend([n_idx] * node.pop('hcount', 0))
+    idxs = _hydrogen_keys(mol, prefix, len(heavy_atoms))
+    # Get the defaults from parse_atom.
+    mol.add_nodes_from(idxs, **h_atom)
+    mol.add_edges_from(zip(heavy_atoms, idxs), order=1)
+
+
+def add_explicit_hydrogens_many(mols, prefixes=None):
+    """
+    Adds explicit hydrogen nodes to all molecules in `mols`, see
+    :func:`add_explicit_hydrogens`.
+
+    Parameters
+    ----------
+    mols : collections.abc.Iterable[nx.Graph]
+        The molecules to which explicit hydrogens should be added. Are
+        modified in-place.
+    prefixes : collections.abc.Iterable[str]
+        The prefix of the keys of the new nodes for every molecule. No
+        prefix if None.
+
+    Returns
+    -------
+    None
+        `mols` are modified in-place.
+    """
+    mols = list(mols)
+    if prefixes is None:
+        prefixes = [""] * len(mols)
+    for mol, prefix in zip(mols, prefixes):
+        add_explicit_hydrogens(mol, prefix)
 
 
 def remove_explicit_hydrogens(mol):
@@ -262,26 +337,45 @@ def remove_explicit_hydrogens(mol):
     None
         `mol` is modified in-place.
     """
-    to_remove = set()
+    to_remove = []
+    nodes = mol.nodes
 #    defaults = parse_atom('[H]')
-    for n_idx in mol.nodes:
-        node = mol.nodes[n_idx]
-        neighbors = list(mol[n_idx])
+    for n_idx, neighbors in mol.adjacency():
+        node = nodes[n_idx]
         # TODO: get these defaults from parsing [H]. But do something smart
         #       with the hcount attribute.
-        if (node.get('charge', 0) == 0 and node.get('element', '') == 'H' and
-                'isotope' not in node and len(neighbors) == 1):    # and node.get('class', 0) == 0 also remove class!
-            neighbor = neighbors[0]
-            if (mol.nodes[neighbor].get('element', '') == 'H' or
-                    mol.edges[n_idx, neighbor].get('order', 1) != 1):
+        if (node.get('element', '') == 'H' and len(neighbors) == 1 and
+                node.get('charge', 0) == 0 and 'isotope' not in node):    # and node.get('class', 0) == 0 also remove class!
+            neighbor, bond = next(iter(neighbors.items()))
+            if (nodes[neighbor].get('element', '') == 'H' or
+                    bond.get('order', 1) != 1):
                 # The molecule is H2, or the bond order is not 1.
                 continue
-            to_remove.add(n_idx)
-            mol.nodes[neighbor]['hcount'] = mol.nodes[neighbor].get('hcount', 0) + 1
+            to_remove.append(n_idx)
+            nodes[neighbor]['hcount'] = nodes[neighbor].get('hcount', 0) + 1
     mol.remove_nodes_from(to_remove)
-    for n_idx in mol.nodes:
-        if 'hcount' not in mol.nodes[n_idx]:
-            mol.nodes[n_idx]['hcount'] = 0
+    for node in nodes.values():
+        node.setdefault('hcount', 0)
+
+
+def remove_explicit_hydrogens_many(mols):
+    """
+    Removes all explicit, simple hydrogens from all molecules in `mols`, see
+    :func:`remove_explicit_hydrogens`.
+
+    Parameters
+    ----------
+    mols : collections.abc.Iterable[nx.Graph]
+        The molecules whose explicit hydrogens should be removed. Are
+        modified in-place.
+
+    Returns
+    -------
+    None
+        `mols` are modified in-place.
+    """
+    for mol in mols:
+        remove_explicit_hydrogens(mol)
 
 
 def fill_valence(mol, respect_hcount=True, respect_bond_order=True,
@@ -495,28 +589,50 @@ def mark_aromatic_atoms(mol, atoms=None):
             node['aromatic'] = True
 
 
-def mark_aromatic_edges(mol):
+def ring_edges(mol):
+    """
+    Finds the bonds in `mol` that are part of a ring, i.e. all bonds that are
+    not bridges. This takes a single pass over the molecule.
+
+    Parameters
+    ----------
+    mol : nx.Graph
+        The molecule.
+
+    Returns
+    -------
+    set[frozenset]
+        The ring bonds as pairs of node keys.
+    """
+    bridges = {frozenset(edge) for edge in nx.bridges(mol)}
+    return {frozenset(edge) for edge in mol.edges} - bridges
+
+
+def mark_aromatic_edges(mol, rings=None):
     """
-    Set all bonds between aromatic atoms (attribute 'aromatic' is `True`) to
-    1.5. Gives all other bonds that don't have an order yet an order of 1.
+    Set all ring bonds between aromatic atoms (attribute 'aromatic' is `True`)
+    to 1.5. Gives all other bonds that don't have an order yet an order of 1.
 
     Parameters
     ----------
     mol : nx.Graph
         The molecule.
+    rings : set[frozenset]
+        The ring bonds of `mol` as found by :func:`ring_edges`. Found if not
+        given.
 
     Returns
     -------
     None
         `mol` is modified in-place.
     """
-    for cycle in nx.cycle_basis(mol):
-        for idx, jdx in mol.edges(nbunch=cycle):
-            if idx not in cycle or jdx not in cycle:
-                continue
-            if (mol.nodes[idx].get('aromatic', False)
-                    and mol.nodes[jdx].get('aromatic', False)):
-                mol.edges[idx, jdx]['order'] = 1.5
+    if rings is None:
+        rings = ring_edges(mol)
+    for edge in rings:
+        idx, jdx = edge
+        if (mol.nodes[idx].get('aromatic', False)
+                and mol.nodes[jdx].get('aromatic', False)):
+            mol.edges[idx, jdx]['order'] = 1.5
     for idx, jdx in mol.edges:
         if 'order' not in mol.edges[idx, jdx]:
             mol.edges[idx, jdx]['order'] = 1
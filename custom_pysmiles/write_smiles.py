@@ -18,30 +18,39 @@ Exposes functionality for writing SMILES strings
 """
 
 from collections import defaultdict
+import heapq
 
 import networkx as nx
 
 from .smiles_helper import remove_explicit_hydrogens, format_atom
 
 
-def _get_ring_marker(used_markers):
+class _RingMarkers:
     """
-    Returns the lowest number larger than 0 that is not in `used_markers`.
+    Hands out ring markers, always the lowest number larger than 0 that is
+    not in use. Released markers are kept in a heap, so getting and releasing
+    a marker does not scan the markers in use.
+    """
+    def __init__(self):
+        self._released = []
+        self._next = 1
 
-    Parameters
-    ----------
-    used_markers : Container
-        The numbers that can't be used.
+    def get(self):
+        """
+        Returns the lowest number larger than 0 that is not in use, and marks
+        it as used.
+        """
+        if self._released:
+            return heapq.heappop(self._released)
+        marker = self._next
+        self._next += 1
+        return marker
 
-    Returns
-    -------
-    int
-        The lowest number larger than 0 that's not in `used_markers`.
-    """
-    new_marker = 1
-    while new_marker in used_markers:
-        new_marker += 1
-    return new_marker
+    def release(self, marker):
+        """
+        Marks `marker` as no longer used.
+        """
+        heapq.heappush(self._released, marker)
 
 
 def _write_edge_symbol(molecule, n_idx, n_jdx):
@@ -74,7 +83,195 @@ def _write_edge_symbol(molecule, n_idx, n_jdx):
     return cross_aromatic or not (aromatic_bond or single_bond)
 
 
-def write_smiles(molecule, default_element='*', start=None):
+def _atom_invariant(molecule, node_key, default_element='*'):
+    """
+    Returns the invariant of an atom used for canonical ranking: its
+    attributes as written in a SMILES string, and its degree.
+    """
+    node = molecule.nodes[node_key]
+    return (str(node.get('element', default_element)),
+            bool(node.get('aromatic', False)),
+            node.get('charge', 0),
+            node.get('hcount', 0),
+            node.get('isotope') or 0,
+            node.get('class', -1),
+            molecule.degree(node_key))
+
+
+def _dense_ranks(keys):
+    """
+    Ranks the values of `keys`, equal values get equal ranks.
+
+    Parameters
+    ----------
+    keys : dict[collections.abc.Hashable, tuple]
+        The sort key of every node.
+
+    Returns
+    -------
+    dict[collections.abc.Hashable, int]
+        The rank of every node, starting at 0 without gaps.
+    """
+    ranking = {key: rank for rank, key in enumerate(sorted(set(keys.values())))}
+    return {node_key: ranking[key] for node_key, key in keys.items()}
+
+
+def _refine_ranks(bonds, ranks):
+    """
+    Splits atoms with equal ranks by the ranks of their neighbours and the
+    orders of the bonds to them, until no more atoms are split. `bonds`
+    lists the neighbours and bond orders of every atom.
+    """
+    n_ranks = len(set(ranks.values()))
+    while True:
+        keys = {}
+        for node_key, rank in ranks.items():
+            neighbours = sorted([(ranks[neighbour], order) for neighbour, order in bonds[node_key]])
+            keys[node_key] = (rank, tuple(neighbours))
+        refined = _dense_ranks(keys)
+        n_refined = len(set(refined.values()))
+        if n_refined == n_ranks:
+            return ranks
+        ranks, n_ranks = refined, n_refined
+
+
+def _individualise(bonds, ranks, chosen):
+    """
+    Ranks `chosen` before the other atoms of its rank, and refines the ranks.
+    """
+    ranks = _dense_ranks({node_key: (rank, node_key != chosen) for node_key, rank in ranks.items()})
+    return _refine_ranks(bonds, ranks)
+
+
+def _certificate(bonds, ranks):
+    """
+    Returns the bonds of a molecule relabelled by the distinct `ranks`, which
+    are equal for two rankings if and only if they relabel the molecule into
+    the same graph.
+    """
+    return sorted((ranks[node_key], ranks[neighbour], order)
+                  for node_key, neighbours in bonds.items()
+                  for neighbour, order in neighbours if ranks[node_key] < ranks[neighbour])
+
+
+def _orbit(automorphisms, fixed, node_key):
+    """
+    Returns the atoms `node_key` is mapped to by the group generated by the
+    `automorphisms` that fix every atom of `fixed`.
+    """
+    generators = [automorphism for automorphism in automorphisms
+                  if all(automorphism[atom] == atom for atom in fixed)]
+    orbit = {node_key}
+    to_visit = [node_key]
+    while to_visit:
+        current = to_visit.pop()
+        for automorphism in generators:
+            image = automorphism[current]
+            if image not in orbit:
+                orbit.add(image)
+                to_visit.append(image)
+    return orbit
+
+
+class _RankingSearch:
+    """
+    Searches the distinct rankings reached by individualising tied atoms for
+    the one with the smallest certificate. Two rankings with equal
+    certificates give an automorphism; atoms an automorphism fixing the
+    individualised atoms maps onto each other lead to equal certificates,
+    so only one of them is individualised.
+    """
+    def __init__(self, bonds):
+        self.bonds = bonds
+        self.best = None
+        self.first = None
+        self.automorphisms = []
+
+    def _leaf(self, ranks):
+        certificate = _certificate(self.bonds, ranks)
+        for leaf in (self.first, self.best):
+            if leaf is not None and leaf[0] == certificate:
+                by_rank = {rank: node_key for node_key, rank in leaf[1].items()}
+                self.automorphisms.append({node_key: by_rank[rank] for node_key, rank in ranks.items()})
+                return
+        if self.first is None:
+            self.first = (certificate, ranks)
+        if self.best is None or certificate < self.best[0]:
+            self.best = (certificate, ranks)
+
+    def search(self, ranks, fixed=()):
+        """
+        Visits the rankings below `ranks`, in which the atoms of `fixed`
+        have been individualised.
+        """
+        ties = {}
+        for node_key, rank in ranks.items():
+            ties.setdefault(rank, []).append(node_key)
+        tied = [rank for rank, node_keys in ties.items() if len(node_keys) > 1]
+        if not tied:
+            self._leaf(ranks)
+            return
+        visited = set()
+        for chosen in ties[min(tied)]:
+            if chosen in visited:
+                continue
+            self.search(_individualise(self.bonds, ranks, chosen), fixed + (chosen,))
+            visited |= _orbit(self.automorphisms, fixed, chosen)
+
+
+def canonical_ranks(molecule, default_element='*'):
+    """
+    Ranks the atoms of `molecule` such that isomorphic molecules get the same
+    ranking up to symmetry. Atoms are first ranked by their element,
+    aromaticity, charge, hydrogen count, isotope, class and degree, and these
+    ranks are refined with the ranks of their neighbours. If atoms with equal
+    ranks remain, each atom of the lowest tie is in turn ranked before the
+    others and the ranks are refined again, until all ranks are distinct. Of
+    all rankings found this way, the one relabelling the bonds into the
+    smallest sorted list is kept; symmetric atoms are only tried once.
+
+    Parameters
+    ----------
+    molecule : nx.Graph
+        The molecule to rank.
+    default_element : str
+        The element to use if the attribute is missing for a node.
+
+    Returns
+    -------
+    dict[collections.abc.Hashable, int]
+        The rank of every atom, from 0 to the number of atoms.
+    """
+    bonds = {node_key: [(neighbour, bond.get('order', 1)) for neighbour, bond in neighbours.items()]
+             for node_key, neighbours in molecule.adjacency()}
+    ranks = _dense_ranks({node_key: _atom_invariant(molecule, node_key, default_element)
+                          for node_key in molecule.nodes})
+    search = _RankingSearch(bonds)
+    search.search(_refine_ranks(bonds, ranks))
+    return search.best[1]
+
+
+def _canonical_molecule(molecule, default_element='*'):
+    """
+    Returns a copy of `molecule` with the atoms relabelled by their canonical
+    rank, and nodes and neighbours in the order of these ranks.
+    """
+    ranks = canonical_ranks(molecule, default_element)
+    by_rank = sorted(molecule.nodes, key=ranks.get)
+    canonical = nx.Graph()
+    canonical.add_nodes_from((ranks[node_key], molecule.nodes[node_key]) for node_key in by_rank)
+    # Neighbours are listed in the order edges are added. Adding them per atom
+    # by rank lists the lower ranked neighbours first.
+    for node_key in by_rank:
+        for neighbour in sorted(molecule[node_key], key=ranks.get):
+            if ranks[neighbour] > ranks[node_key]:
+                canonical.add_edge(ranks[node_key], ranks[neighbour],
+                                   **molecule.edges[node_key, neighbour])
+    return canonical
+
+
+def write_smiles(molecule, default_element='*', start=None, canonical=False,
+                 atom_classes=True):
     """
     Creates a SMILES string describing `molecule` according to the OpenSMILES
     standard.
@@ -88,6 +285,14 @@ def write_smiles(molecule, default_element='*', start=None):
     start : Hashable
         The atom at which the depth first traversal of the molecule should
         start. A sensible one is chosen: preferably a terminal heteroatom.
+    canonical : bool
+        Whether to write a canonical SMILES string, the same for all
+        isomorphic molecules. Atoms are visited in the order of
+        :func:`canonical_ranks`, and `start` is a canonical atom number if
+        given.
+    atom_classes : bool
+        Whether to write the classes of atoms. If False, the classes are
+        left out, and also not used to rank atoms.
 
     Returns
     -------
@@ -96,6 +301,11 @@ def write_smiles(molecule, default_element='*', start=None):
     """
     molecule = molecule.copy()
     remove_explicit_hydrogens(molecule)
+    if not atom_classes:
+        for node_key in molecule.nodes:
+            molecule.nodes[node_key].pop('class', None)
+    if canonical:
+        molecule = _canonical_molecule(molecule, default_element)
 
     if start is None:
         # Start at a terminal atom, and if possible, a heteroatom.
@@ -123,8 +333,8 @@ def write_smiles(molecule, default_element='*', start=None):
     for n_idx, n_jdxs in dfs_successors.items():
         for n_jdx in n_jdxs:
             edges.add(frozenset((n_idx, n_jdx)))
-    total_edges = set(map(frozenset, molecule.edges))
-    ring_edges = total_edges - edges
+    ring_edges = [(n_idx, n_jdx) for n_idx, n_jdx in molecule.edges
+                  if frozenset((n_idx, n_jdx)) not in edges]
 
     atom_to_ring_idx = defaultdict(list)
     ring_idx_to_bond = {}
@@ -133,17 +343,19 @@ def write_smiles(molecule, default_element='*', start=None):
         atom_to_ring_idx[n_idx].append(ring_idx)
         atom_to_ring_idx[n_jdx].append(ring_idx)
         ring_idx_to_bond[ring_idx] = (n_idx, n_jdx)
+    markers = _RingMarkers()
 
     branch_depth = 0
     branches = set()
     to_visit = [start]
-    smiles = ''
+    # Collected and joined at the end, rather than concatenating strings
+    smiles = []
 
     while to_visit:
         current = to_visit.pop()
         if current in branches:
             branch_depth += 1
-            smiles += '('
+            smiles.append('(')
             branches.remove(current)
 
         if current in predecessors:
@@ -154,25 +366,26 @@ def write_smiles(molecule, default_element='*', start=None):
             previous = previous[0]
             if _write_edge_symbol(molecule, previous, current):
                 order = molecule.edges[previous, current].get('order', 1)
-                smiles += order_to_symbol[order]
-        smiles += format_atom(molecule, current, default_element)
+                smiles.append(order_to_symbol[order])
+        smiles.append(format_atom(molecule, current, default_element))
         if current in atom_to_ring_idx:
             # We're going to need to write a ring number
             ring_idxs = atom_to_ring_idx[current]
             for ring_idx in ring_idxs:
                 ring_bond = ring_idx_to_bond[ring_idx]
                 if ring_idx not in ring_idx_to_marker:
-                    marker = _get_ring_marker(ring_idx_to_marker.values())
+                    marker = markers.get()
                     ring_idx_to_marker[ring_idx] = marker
                     new_marker = True
                 else:
                     marker = ring_idx_to_marker.pop(ring_idx)
+                    markers.release(marker)
                     new_marker = False
 
                 if _write_edge_symbol(molecule, *ring_bond) and new_marker:
                     order = molecule.edges[ring_bond].get('order', 1)
-                    smiles += order_to_symbol[order]
-                smiles += str(marker) if marker < 10 else '%{}'.format(marker)
+                    smiles.append(order_to_symbol[order])
+                smiles.append(str(marker) if marker < 10 else '%{}'.format(marker))
 
         if current in dfs_successors:
             # Proceed to the next node in this branch
@@ -182,8 +395,8 @@ def write_smiles(molecule, default_element='*', start=None):
             to_visit.extend(next_nodes)
         elif branch_depth:
             # We're finished with this branch.
-            smiles += ')'
+            smiles.append(')')
             branch_depth -= 1
 
-    smiles += ')' * branch_depth
-    return smiles
+    smiles.append(')' * branch_depth)
+    return ''.join(smiles)
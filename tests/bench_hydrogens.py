@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Times adding and removing explicit hydrogens against the per atom helpers
+they replaced, on the compounds of a mapped SMILES file (ecoli1 by default)
+parsed without hydrogens:
+
+    python tests/bench_hydrogens.py [mapped SMILES file] [repeats]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from custom_pysmiles import (read_smiles, add_explicit_hydrogens, remove_explicit_hydrogens,
+                             add_explicit_hydrogens_many, remove_explicit_hydrogens_many)
+
+from model_smiles import MODEL, model_smiles
+from hydrogens_reference import reference_add_explicit_hydrogens, reference_remove_explicit_hydrogens
+
+
+def compounds(path):
+    """
+    Returns the distinct compounds of `path` that read_smiles can parse.
+    """
+    molecules = []
+    for smiles in sorted(set(model_smiles(path))):
+        try:
+            molecules.append(read_smiles(smiles, explicit_hydrogen=False))
+        except Exception:  # pylint: disable=broad-except
+            continue
+    return molecules
+
+
+def best_time(molecules, function, repeats, prepare=None):
+    """
+    Returns the best time of applying `function` to copies of `molecules`,
+    after `prepare` if given.
+    """
+    def setup():
+        copies[:] = [molecule.copy() for molecule in molecules]
+        if prepare is not None:
+            prepare(copies)
+    copies = []
+    return min(timeit.repeat(lambda: function(copies), setup=setup, number=1, repeat=repeats))
+
+
+def main():
+    # the warnings of discarded stereo information would drown the timings
+    logging.disable(logging.WARNING)
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    molecules = compounds(path)
+    print('%d compounds, %d heavy atoms' % (len(molecules), sum(map(len, molecules))))
+
+    def each(function):
+        return lambda copies: [function(molecule) for molecule in copies]
+    for name, add, remove in (
+            ('reference', each(reference_add_explicit_hydrogens), each(reference_remove_explicit_hydrogens)),
+            ('current', each(add_explicit_hydrogens), each(remove_explicit_hydrogens)),
+            ('many', add_explicit_hydrogens_many, remove_explicit_hydrogens_many)):
+        print('%-10s add %8.2f ms   remove %8.2f ms' % (
+            name, best_time(molecules, add, repeats) * 1000,
+            best_time(molecules, remove, repeats, prepare=add) * 1000))
+
+if __name__ == "__main__":
+    main()
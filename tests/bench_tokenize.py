@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Times the regex tokenizer against the character by character one it
+replaced, on the SMILES of a mapped SMILES file (ecoli1 by default):
+
+    python tests/bench_tokenize.py [mapped SMILES file] [repeats]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from custom_pysmiles.read_smiles import _tokenize
+
+from model_smiles import MODEL, model_smiles
+from tokenize_reference import reference_tokenize
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    smiles = model_smiles(path)
+    print('%d SMILES, %d characters' % (len(smiles), sum(map(len, smiles))))
+    for name, tokenizer in (('reference', reference_tokenize), ('regex', _tokenize)):
+        def run():
+            for single in smiles:
+                for _ in tokenizer(single):
+                    pass
+        best = min(timeit.repeat(run, number=1, repeat=repeats))
+        print('%-10s %8.2f ms' % (name, best * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Peter C Kroon
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The per atom explicit hydrogen helpers that
+:func:`custom_pysmiles.smiles_helper.add_explicit_hydrogens` and
+:func:`custom_pysmiles.smiles_helper.remove_explicit_hydrogens` replaced,
+kept as reference.
+"""
+
+from custom_pysmiles.smiles_helper import parse_atom
+
+
+def reference_add_explicit_hydrogens(mol, prefix=""):
+    """
+    Adds explicit hydrogen nodes to `mol`, the amount is determined by the node
+    attribute 'hcount'. Will remove the 'hcount' attribute.
+
+    Parameters
+    ----------
+    mol : nx.Graph
+        The molecule to which explicit hydrogens should be added. Is modified
+        in-place.
+
+    Returns
+    -------
+    None
+        `mol` is modified in-place.
+    """
+    h_atom = parse_atom('[H]')
+    if 'hcount' in h_atom:
+        del h_atom['hcount']
+    for n_idx in list(mol.nodes):
+        hcount = mol.nodes[n_idx].get('hcount', 0)
+        idxs = [ prefix + str(i) for i in range(len(mol.nodes()) + 1, len(mol.nodes()) + hcount + 1)]
+        # Get the defaults from parse_atom.
+        mol.add_nodes_from(idxs, **h_atom.copy())
+        mol.add_edges_from([(n_idx, jdx) for jdx in idxs], order=1)
+        if 'hcount' in mol.nodes[n_idx]:
+            del mol.nodes[n_idx]['hcount']
+
+
+def reference_remove_explicit_hydrogens(mol):
+    """
+    Removes all explicit, simple hydrogens from `mol`. Simple means it is
+    identical to the SMILES string "[H]", and has exactly one bond. Increments
+    'hcount' where appropriate.
+
+    Parameters
+    ----------
+    mol : nx.Graph
+        The molecule whose explicit hydrogens should be removed. Is modified
+        in-place.
+
+    Returns
+    -------
+    None
+        `mol` is modified in-place.
+    """
+    to_remove = set()
+#    defaults = parse_atom('[H]')
+    for n_idx in mol.nodes:
+        node = mol.nodes[n_idx]
+        neighbors = list(mol[n_idx])
+        # TODO: get these defaults from parsing [H]. But do something smart
+        #       with the hcount attribute.
+        if (node.get('charge', 0) == 0 and node.get('element', '') == 'H' and
+                'isotope' not in node and len(neighbors) == 1):    # and node.get('class', 0) == 0 also remove class!
+            neighbor = neighbors[0]
+            if (mol.nodes[neighbor].get('element', '') == 'H' or
+                    mol.edges[n_idx, neighbor].get('order', 1) != 1):
+                # The molecule is H2, or the bond order is not 1.
+                continue
+            to_remove.add(n_idx)
+            mol.nodes[neighbor]['hcount'] = mol.nodes[neighbor].get('hcount', 0) + 1
+    mol.remove_nodes_from(to_remove)
+    for n_idx in mol.nodes:
+        if 'hcount' not in mol.nodes[n_idx]:
+            mol.nodes[n_idx]['hcount'] = 0
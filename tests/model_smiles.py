@@ -0,0 +1,20 @@
+"""
+The molecule SMILES of a mapped SMILES file, by default the ecoli1 model.
+"""
+
+import os
+
+MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'ecoli1')
+
+
+def model_smiles(path=MODEL):
+    """
+    Returns the molecule SMILES of the reactions in a mapped SMILES file.
+    """
+    smiles = []
+    with open(path) as smiles_file:
+        for line in smiles_file:
+            if '>>' in line:
+                for side in line.strip().split('>>'):
+                    smiles.extend(side.split('.'))
+    return smiles
@@ -0,0 +1,79 @@
+"""
+Symmetric images of EMUs follow the automorphisms of their compound.
+"""
+
+import pytest
+
+pytest.importorskip('rdkit')
+
+from atn.build import ATNBuilder, MappedReaction
+from atn.emu import EMUNetwork
+from atn.export import bfs_ready_transform, write_directed_bundle
+
+PIVALIC_ACID = '[CH3:1][C:2]([CH3:3])([CH3:4])[C:5](=[O:6])[OH:7]'
+
+
+def directed_builder(smiles):
+    """
+    Returns the directed builder of the reaction A = B, both with `smiles`.
+    """
+    builder = ATNBuilder(directed=True)
+    builder.build([MappedReaction(0, 'Reversible: False', 'A = B', smiles + '>>' + smiles)])
+    return builder
+
+
+def directed_atn(smiles):
+    builder = directed_builder(smiles)
+    return bfs_ready_transform(builder.ATN, builder.transitions)
+
+
+def formed(ATN, atoms):
+    network = EMUNetwork.from_graph(ATN)
+    network.add(['1_{}'.format(atom) for atom in atoms])
+    return network, [reaction for reaction in network.reactions if reaction.product == 0]
+
+
+def test_coupled_orbits():
+    # succinate: both carbon pairs swap together
+    _, reactions = formed(directed_atn('[O:1]=[C:2]([OH:3])[CH2:4][CH2:5][C:6](=[O:7])[OH:8]'), [1, 3])
+    assert len(reactions) == 2
+    assert all(reaction.weight == pytest.approx(1 / 2) for reaction in reactions)
+
+
+def test_orbit_of_three_atoms():
+    # pivalic acid: the three methyl groups are permuted
+    network, reactions = formed(directed_atn(PIVALIC_ACID), [0, 2])
+    assert len(reactions) == 3
+    assert all(reaction.weight == pytest.approx(1 / 3) for reaction in reactions)
+    # all pairs of methyl groups of A are the same EMU
+    assert len({reaction.precursors for reaction in reactions}) == 1
+    assert network.emus[0].atoms == ('1_0', '1_2')
+
+
+def test_independent_orbits():
+    # isopropyl isobutyrate: the methyl groups of both ends swap independently
+    smiles = '[CH3:1][CH:2]([CH3:3])[C:4](=[O:5])[O:6][CH:7]([CH3:8])[CH3:9]'
+    _, reactions = formed(directed_atn(smiles), [0, 7])
+    assert len(reactions) == 4
+    assert all(reaction.weight == pytest.approx(1 / 4) for reaction in reactions)
+
+
+def test_missing_automorphisms():
+    ATN = directed_atn(PIVALIC_ACID)
+    for node in ATN:
+        ATN.nodes[node].pop('automorphisms', None)
+    network = EMUNetwork.from_graph(ATN)
+    network.add(['1_0'])
+    with pytest.raises(ValueError):
+        network.add(['1_0', '1_2'])
+
+
+def test_bundle_automorphisms(tmp_path):
+    builder = directed_builder(PIVALIC_ACID)
+    path = str(tmp_path / 'atn.npz')
+    write_directed_bundle(builder.ATN, builder.transitions, builder.compoundId_to_compound, path)
+    network = EMUNetwork.from_file(path)
+    network.add(['1_0', '1_2'])
+    expected, _ = formed(directed_atn(PIVALIC_ACID), [0, 2])
+    assert network.emus == expected.emus
+    assert network.reactions == expected.reactions
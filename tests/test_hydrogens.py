@@ -0,0 +1,44 @@
+"""
+Adding and removing explicit hydrogens in bulk must give the graphs of the
+per atom helpers they replaced, including node and neighbour order.
+"""
+
+import networkx as nx
+import pytest
+
+from custom_pysmiles import read_smiles, add_explicit_hydrogens, remove_explicit_hydrogens
+
+from model_smiles import model_smiles
+from hydrogens_reference import reference_add_explicit_hydrogens, reference_remove_explicit_hydrogens
+
+
+def dump(mol):
+    return ([(node_key, node, list(mol[node_key])) for node_key, node in mol.nodes(data=True)],
+            list(mol.edges(data=True)))
+
+
+@pytest.mark.parametrize('prefix', ['', '5_'])
+def test_model_compounds(prefix):
+    for smiles in sorted(set(model_smiles())):
+        try:
+            parsed = read_smiles(smiles, explicit_hydrogen=False)
+        except Exception:  # pylint: disable=broad-except
+            continue
+        # copying can reorder neighbours, so both get a copy
+        mol, reference = parsed.copy(), parsed.copy()
+        add_explicit_hydrogens(mol, prefix)
+        reference_add_explicit_hydrogens(reference, prefix)
+        assert dump(mol) == dump(reference), smiles
+        remove_explicit_hydrogens(mol)
+        reference_remove_explicit_hydrogens(reference)
+        assert dump(mol) == dump(reference), smiles
+
+
+def test_keys_do_not_collide():
+    mol = nx.Graph()
+    mol.add_node(0, element='C', hcount=2)
+    mol.add_node('3', element='O', hcount=0)
+    mol.add_edge(0, '3')
+    add_explicit_hydrogens(mol)
+    assert len(mol) == 4
+    assert mol.degree(0) == 3
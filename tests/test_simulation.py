@@ -0,0 +1,73 @@
+"""
+Mass isotopomer distributions keep the atoms labelled together.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rdkit')
+
+from atn.build import ATNBuilder, MappedReaction
+from atn.export import bfs_ready_transform
+from atn.reachability import directed_arrays
+from atn.simulation import SIMULATION_TRANSITIONS, LabellingSimulator, MassIsotopomerSimulator
+
+ACETATE = '[CH3:1][C:2](=[O:3])[OH:4]>>[CH3:1][C:2](=[O:3])[OH:4]'
+
+
+def simulators(reactions, substrates, measured):
+    """
+    Returns the labelling simulator of `reactions` and the MID simulator of
+    the carbons of the `measured` compounds with their EMU indices.
+    """
+    builder = ATNBuilder(directed=True)
+    builder.build(reactions)
+    ATN = bfs_ready_transform(builder.ATN, builder.transitions)
+    simulator = LabellingSimulator(directed_arrays(ATN, SIMULATION_TRANSITIONS), reactions, substrates)
+    network = simulator.emu_network()
+    indices = [network.add(network.compound_atoms(compound, 'C')) for compound in measured]
+    return simulator, MassIsotopomerSimulator(simulator, network), indices
+
+
+def test_uniform_tracer():
+    reactions = [MappedReaction(0, 'Reversible: False', 'A = B', ACETATE)]
+    simulator, emus, (index,) = simulators(reactions, ['A'], ['B'])
+    mids = emus.simulate([1.0], [{atom: 0.5 for atom in simulator.compound_atoms('A', 'C')}])
+    # half of the molecules carry both labels, none only one
+    assert mids[index][0] == pytest.approx([0.5, 0.0, 0.5])
+
+
+def test_combined_substrates():
+    reactions = [MappedReaction(0, 'Reversible: False', 'A + C = D + E',
+                                '[CH3:1][OH:2].[CH3:3][OH:4]>>[CH3:1][CH2:3][OH:4].[OH2:2]')]
+    simulator, emus, (index,) = simulators(reactions, ['A', 'C'], ['D'])
+    first, = simulator.compound_atoms('A', 'C')
+    second, = simulator.compound_atoms('C', 'C')
+    mids = emus.simulate([1.0], [{first: 0.5}, {first: 0.5, second: 0.5}])
+    assert mids[index][0] == pytest.approx([0.5, 0.5, 0.0])
+    assert mids[index][1] == pytest.approx([0.25, 0.5, 0.25])
+
+
+def test_cycle():
+    reactions = [MappedReaction(0, 'Reversible: False', 'A = B', ACETATE),
+                 MappedReaction(1, 'Reversible: False', 'F = B', ACETATE),
+                 MappedReaction(2, 'Reversible: False', 'B = C', ACETATE),
+                 MappedReaction(3, 'Reversible: False', 'C = B', ACETATE),
+                 MappedReaction(4, 'Reversible: False', 'C = D', ACETATE)]
+    simulator, emus, (index,) = simulators(reactions, ['A', 'F'], ['D'])
+    fluxes = [1.0, 1.0, 3.0, 1.0, 2.0]
+    tracers = [simulator.compound_atoms('A', 'C')]
+    mids = emus.simulate(fluxes, tracers)
+    assert mids[index][0] == pytest.approx([0.5, 0.0, 0.5])
+    # the mean enrichment agrees with the atom enrichments
+    enrichment = simulator.simulate(fluxes, tracers)
+    rows = [simulator.node_index[atom] for atom in simulator.compound_atoms('D', 'C')]
+    assert mids[index][0] @ np.arange(3) / 2 == pytest.approx(enrichment[rows, 0].mean())
+
+
+def test_mixed_enrichments():
+    reactions = [MappedReaction(0, 'Reversible: False', 'A = B', ACETATE)]
+    simulator, emus, _ = simulators(reactions, ['A'], ['B'])
+    first, second = simulator.compound_atoms('A', 'C')
+    with pytest.raises(ValueError):
+        emus.simulate([1.0], [{first: 1.0, second: 0.5}])
@@ -0,0 +1,79 @@
+"""
+The regex tokenizer must yield exactly the tokens of the character by
+character tokenizer it replaced, including its errors.
+"""
+
+import random
+
+import pytest
+
+from custom_pysmiles.read_smiles import _tokenize
+
+from model_smiles import MODEL, model_smiles
+from tokenize_reference import reference_tokenize
+
+# the SMILES alphabet, and some characters neither tokenizer knows
+ALPHABET = list('BCNOPSFIbcnospClBrHK*[]@+-=#$:.()%/\\0123456789') + ['Cl', 'Br', ' ', '\n', 'x', '²', '٣']
+
+
+def tokens(tokenizer, smiles):
+    """
+    Returns the tokens of `smiles`, and the type of the error that ended
+    tokenizing, if any.
+    """
+    found = []
+    try:
+        for token in tokenizer(smiles):
+            found.append(token)
+    except ValueError as error:
+        return found, type(error)
+    return found, None
+
+
+def assert_same_tokens(smiles):
+    assert tokens(_tokenize, smiles) == tokens(reference_tokenize, smiles), smiles
+
+
+@pytest.mark.parametrize('smiles', [
+    '',
+    'CCO',
+    'ClCBr',
+    'C1CC%12CC1%12',
+    'C%1',
+    'C%',
+    'F/C=C\\F',
+    '[13CH3:1][C@@H](O)[NH3+]',
+    '[CH3',
+    'C[',
+    'c1ccccc1.[Na+]',
+    'C C',
+])
+def test_examples(smiles):
+    assert_same_tokens(smiles)
+
+
+def test_model_smiles():
+    for smiles in model_smiles(MODEL):
+        assert_same_tokens(smiles)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_strings(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        assert_same_tokens(''.join(rng.choice(ALPHABET) for _ in range(rng.randrange(30))))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_mutated_model_smiles(seed):
+    rng = random.Random(seed)
+    for smiles in rng.sample(model_smiles(MODEL), 200):
+        position = rng.randrange(len(smiles) + 1)
+        mutated = smiles[:position] + rng.choice(ALPHABET) + smiles[position + rng.randrange(3):]
+        assert_same_tokens(mutated)
+        assert_same_tokens(smiles[:position])
+
+
+def test_iterable_input():
+    smiles = '[NH4+].OC(=O)C%10CC%10'
+    assert list(_tokenize(iter(smiles))) == list(reference_tokenize(smiles))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Peter C Kroon
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+The character by character SMILES tokenizer that
+:func:`custom_pysmiles.read_smiles._tokenize` replaced, kept as reference.
+"""
+
+from custom_pysmiles.read_smiles import TokenType
+
+
+def reference_tokenize(smiles):
+    """
+    Iterates over a SMILES string, yielding tokens.
+    """
+    organic_subset = 'B C N O P S F Cl Br I * b c n o s p'.split()
+    smiles = iter(smiles)
+    token = ''
+    peek = None
+    while True:
+        char = peek if peek else next(smiles, '')
+        peek = None
+        if not char:
+            break
+        if char == '[':
+            token = char
+            for char in smiles:
+                token += char
+                if char == ']':
+                    break
+            yield TokenType.ATOM, token
+        elif char in organic_subset:
+            peek = next(smiles, '')
+            if char + peek in organic_subset:
+                yield TokenType.ATOM, char + peek
+                peek = None
+            else:
+                yield TokenType.ATOM, char
+        elif char in '-=#$:.':
+            yield TokenType.BOND_TYPE, char
+        elif char == '(':
+            yield TokenType.BRANCH_START, '('
+        elif char == ')':
+            yield TokenType.BRANCH_END, ')'
+        elif char == '%':
+            # If smiles is too short this will raise a ValueError, which is
+            # (slightly) prettier than a StopIteration.
+            yield TokenType.RING_NUM, int(next(smiles, '') + next(smiles, ''))
+        elif char in '/\\':
+            yield TokenType.EZSTEREO, char
+        elif char.isdigit():
+            yield TokenType.RING_NUM, int(char)
+